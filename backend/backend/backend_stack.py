@@ -14,6 +14,12 @@ from constructs import Construct
 from aws_cdk import aws_secretsmanager as secretsmanager
 
 
+# Chunk vector format, shared by the indexer (writes) and the agent (queries).
+# Must match the type of the Atlas "vector_index", see lambda/vector_codec.py
+VECTOR_STORAGE = "array"
+
+# "tool": LLM answers are tool calls validated against a JSON schema, "tags": XML-like tags, see lambda/structured_output.py
+LLM_OUTPUT_MODE = "tool"
 
 
 class BackendStack(Stack):
@@ -62,7 +68,9 @@ class BackendStack(Stack):
             memory_size=2048,
             environment={
                 "BUCKET_NAME": documents_bucket.bucket_name,
-                "SECRET_NAME": mongoagent_secret.secret_name
+                "SECRET_NAME": mongoagent_secret.secret_name,
+                "VECTOR_STORAGE": VECTOR_STORAGE,
+                "LLM_OUTPUT_MODE": LLM_OUTPUT_MODE
             },
             layers=[voyageai_layer]  # 👈 Reuse the same layer that has pymongo 
         )
@@ -71,6 +79,19 @@ class BackendStack(Stack):
         # Allow Lambda to generate pre-signed URLs for objects in this bucket
         documents_bucket.grant_read(process_message_fn)
 
+        # POST runs the agent in an asynchronous invocation of the same function.
+        # A separate policy, the function's default policy cannot reference its own ARN (circular dependency)
+        iam.Policy(
+            self, "ProcessMessageSelfInvokePolicy",
+            roles=[process_message_fn.role],
+            statements=[
+                iam.PolicyStatement(
+                    actions=["lambda:InvokeFunction"],
+                    resources=[process_message_fn.function_arn]
+                )
+            ]
+        )
+
 
         # Create Cognito Authorizer
         authorizer = apigw.CognitoUserPoolsAuthorizer(
@@ -118,12 +139,21 @@ class BackendStack(Stack):
         )
 
 
+        # Polled by the chat UI for the progress, partial answer and response of a request
+        message.add_method(
+            "GET",
+            apigw.LambdaIntegration(process_message_fn),
+            authorization_type=apigw.AuthorizationType.COGNITO,
+            authorizer=authorizer
+        )
+
+
         message.add_cors_preflight(
             allow_origins=[
                 "http://localhost:5173",
                 "https://mongoagent.com"
             ],
-            allow_methods=["POST"],
+            allow_methods=["POST", "GET"],
             allow_headers=["Authorization", "Content-Type"],
         )
 
@@ -142,7 +172,10 @@ class BackendStack(Stack):
             memory_size=1024,
             environment={
                 "BUCKET_NAME": documents_bucket.bucket_name,
-                "SECRET_NAME": mongoagent_secret.secret_name
+                "SECRET_NAME": mongoagent_secret.secret_name,
+                "STRUCTURE_MAX_IN_FLIGHT": "8",
+                "VECTOR_STORAGE": VECTOR_STORAGE,
+                "LLM_OUTPUT_MODE": LLM_OUTPUT_MODE
             },
             layers=[voyageai_layer]
         )
@@ -150,6 +183,14 @@ class BackendStack(Stack):
         # Grant Lambda full access to the S3 bucket
         documents_bucket.grant_read_write(index_new_document_fn)
 
+        # Allow the indexer to re-invoke itself to resume long documents before the timeout
+        index_new_document_fn.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[f"arn:aws:lambda:{self.region}:{self.account}:function:IndexNewDocument"]
+            )
+        )
+
         # Grant S3 permission to invoke the Lambda
         index_new_document_fn.add_permission(
             "AllowS3Invoke",
@@ -211,6 +252,31 @@ class BackendStack(Stack):
         index_new_document_fn.add_environment("TEXTRACT_ROLE_ARN", textract_service_role.role_arn)
 
 
+#SQS (page range work items of large documents, see lambda/fanout.py)
+
+        from aws_cdk import aws_sqs as sqs
+        from aws_cdk import aws_lambda_event_sources as lambda_event_sources
+
+        ingestion_dead_letter_queue = sqs.Queue(
+            self, "IngestionWorkDeadLetterQueue",
+            retention_period=Duration.days(14)
+        )
+
+        ingestion_work_queue = sqs.Queue(
+            self, "IngestionWorkQueue",
+            # Longer than the function timeout, so an item is only delivered again once its worker has stopped
+            visibility_timeout=Duration.seconds(960),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=ingestion_dead_letter_queue)
+        )
+
+        # The same function is the coordinator (sends the work items) and the workers (one item per invocation)
+        ingestion_work_queue.grant_send_messages(index_new_document_fn)
+        index_new_document_fn.add_event_source(
+            lambda_event_sources.SqsEventSource(ingestion_work_queue, batch_size=1)
+        )
+        index_new_document_fn.add_environment("WORK_QUEUE_URL", ingestion_work_queue.queue_url)
+
+
         model_regions = ['us-east-1', 'us-west-2']
         model_name = "anthropic.claude-3-7-sonnet-20250219-v1:0"
 
@@ -1,33 +1,61 @@
-from embedding import invoke_claude_x, get_tag, create_embeddings
-from mongodb_tools import get_all_documents, search_chunks
+from embedding import invoke_claude_x, invoke_claude_x_stream, invoke_claude_x_tool, get_tag
+from catalog import get_catalog_text
 from s3_presigned import replace_sources_with_links
+from retrieval_session import RetrievalSession
+from answer_stream import AnswerStream
+from prompt_budget import budget_sections, estimate_tokens
+from structured_output import LLM_OUTPUT_MODE, ACTION_TOOL, invoke_structured
 
 
-def determine_action(user_input, recent_history, context):
-    available_docs = get_all_documents()
+def catalog_query(user_input, recent_history, user_turns=2):
+    # Follow-up questions often only name the equipment in earlier turns
+    previous = []
+    if isinstance(recent_history, list):
+        previous = [msg.get("content", "") for msg in recent_history if isinstance(msg, dict) and msg.get("sender") == "user"]
+    return " ".join(previous[-user_turns:] + [user_input])
 
-    # Format each document into a readable string
-    formatted_docs = []
-    for doc in available_docs:
-        doc_name = f"doc_name:'{doc.get('doc_name', 'Unnamed Document')}'"
-        manufacturer = doc.get("manufacturer", "")
-        model = doc.get("model", "")
-        description = doc.get("doc_description", "")
 
-        # Build string: doc_name (manufacturer model): description
-        parts = [doc_name]
-        if manufacturer or model:
-            parts.append(f"({manufacturer} {model})".strip())
-        if description:
-            parts.append(f": {description.strip()}")
+RESPONSE_FORMATS = {
+    "tags": """## RESPONSE FORMAT
+        Your response must follow this exact structure:
 
-        formatted_docs.append(" ".join(parts).strip())
+        <IMPROVED_USER_QUERY>
+        [Write improved version of user query]
+        </IMPROVED_USER_QUERY>
 
-    # Join all formatted docs into a single string with line breaks
-    available_docs_text = "\n".join(formatted_docs)
+        Then EXACTLY ONE of these options:
 
-    # Final prompt
-    prompt = f"""
+        Option 1:
+        <DOCS>[document ID|...  or *]</DOCS>
+        <SEARCH_FOR>[specific search text]</SEARCH_FOR>
+        <ACTION>QUERY_DOCS</ACTION>
+
+        Option 2:
+        <ACTION>INVALID</ACTION>
+
+        Option 3:
+        <QUESTION>[clarifying question]</QUESTION>
+        <ACTION>QUESTION</ACTION>
+
+        Option 4:
+        <ANSWER>[Final response to the user question in markdown with <SOURCE doc_file_name='<filename>' page='<page_number>'...> citatioms]</ANSWER>
+        <ACTION>RESPOND</ACTION>""",
+    "tool": """## RESPONSE FORMAT
+        Your response must be a call of the choose_action tool, the tags named above are its fields:
+
+        - improved_user_query: the improved version of the user query (<IMPROVED_USER_QUERY>)
+        - action: QUERY_DOCS, INVALID, QUESTION or RESPOND (<ACTION>)
+        - docs: list of document IDs (<DOCS>), an empty list instead of * (wildcard)
+        - search_for: specific search text (<SEARCH_FOR>)
+        - question: clarifying question (<QUESTION>)
+        - answer: final response to the user question in markdown with <SOURCE doc_file_name='<filename>' page='<page_number>'...> citatioms (<ANSWER>)
+
+        Only fill the fields of the chosen action."""
+}
+
+
+def build_action_prompt(user_input, recent_history, available_docs_text, context, output_mode=LLM_OUTPUT_MODE):
+    return f"""
         # Document Assistant Prompt
 
         <CONVERSATION_HISTORY>
@@ -90,33 +118,37 @@ def determine_action(user_input, recent_history, context):
                 - Format information clearly with headings, lists, or code blocks as needed
                 - End with <ACTION>RESPOND</ACTION>
 
-        ## RESPONSE FORMAT
-        Your response must follow this exact structure:
+        {RESPONSE_FORMATS[output_mode]}
+    """
 
-        <IMPROVED_USER_QUERY>
-        [Write improved version of user query]
-        </IMPROVED_USER_QUERY>
 
-        Then EXACTLY ONE of these options:
+# Estimated tokens of the prompt without history, catalog and sources
+ACTION_PROMPT_TOKENS = estimate_tokens(build_action_prompt("", "", "", ""))
 
-        Option 1:
-        <DOCS>[document ID|...  or *]</DOCS>
-        <SEARCH_FOR>[specific search text]</SEARCH_FOR>
-        <ACTION>QUERY_DOCS</ACTION>
 
-        Option 2:
-        <ACTION>INVALID</ACTION>
+def determine_action(user_input, recent_history, context, on_answer=None):
+    # Only the documents most relevant to the query, from a catalog cached per version
+    available_docs_text = get_catalog_text(catalog_query(user_input, recent_history))
 
-        Option 3:
-        <QUESTION>[clarifying question]</QUESTION>
-        <ACTION>QUESTION</ACTION>
+    # Old history turns, the least relevant documents and the oldest sources are left out above the token budget
+    history_text, available_docs_text, sources_text, usage = budget_sections(
+        ACTION_PROMPT_TOKENS, user_input, recent_history, available_docs_text, context
+    )
+    print(f"Prompt tokens (estimated): {usage}")
 
-        Option 4:
-        <ANSWER>[Final response to the user question in markdown with <SOURCE doc_file_name='<filename>' page='<page_number>'...> citatioms]</ANSWER>
-        <ACTION>RESPOND</ACTION>
-    """
+    # Final prompt
+    prompt = build_action_prompt(user_input, history_text, available_docs_text, sources_text)
+
+    if LLM_OUTPUT_MODE == "tool":
+        return parse_action(invoke_action_tool(prompt, on_answer))
 
-    response = invoke_claude_x(prompt)
+    if on_answer:
+        # Relays the <ANSWER> section while it is generated, the final answer (with links) is returned as usual
+        stream = AnswerStream(on_answer)
+        response = invoke_claude_x_stream(prompt, stream.feed)
+        stream.flush()
+    else:
+        response = invoke_claude_x(prompt)
     action = get_tag(response, "ACTION")
     docs = get_tag(response, "DOCS")
     question = get_tag(response, "QUESTION")
@@ -134,32 +166,54 @@ def determine_action(user_input, recent_history, context):
     return action, docs, question, improved_query, answer, search_for, docs
 
 
+def invoke_action_tool(prompt, on_answer=None):
+    """choose_action tool input (validated, repaired once if needed), None when the call failed."""
+    def invoke_tool(prompt):
+        return invoke_claude_x_tool(prompt, ACTION_TOOL)
 
+    if not on_answer:
+        data, _ = invoke_structured(prompt, ACTION_TOOL, invoke_tool)
+        return data
 
-def retrieve_chunks(search_text, document_list):
+    # Relays the answer field while the tool input is generated, a repair call is not streamed
+    stream = AnswerStream(on_answer, json_field="answer")
 
-    #calculate embeddings for the search text
-    search_embedding = create_embeddings(search_text)
+    def invoke_stream(prompt):
+        response = invoke_claude_x_stream(prompt, stream.feed, ACTION_TOOL)
+        stream.flush()
+        return response
 
-    #perform hybrid search in MongoDB (Vector Search and by doc_name)
-    search_results = search_chunks(search_embedding, document_list, 5)
+    data, _ = invoke_structured(prompt, ACTION_TOOL, invoke_stream, repair_tool=invoke_tool)
+    return data
 
-    return search_results
 
+def parse_action(data):
+    """Same values as the tags response: (action, docs, question, improved_query, answer, search_for, docs)."""
+    data = data or {}
+    docs = [doc.strip() for doc in data.get("docs", []) if doc.strip() not in ("", "*")]
+    answer = replace_sources_with_links(data.get("answer", ""))
+    return data.get("action", ""), docs, data.get("question", ""), data.get("improved_user_query", ""), answer, data.get("search_for", ""), docs
 
 
 
-def agent_loop(user_input, conversation_history):
+
+def agent_loop(user_input, conversation_history, on_answer=None, on_progress=None):
+    # on_answer(text), when given, receives the partial answer while it streams
+    # on_progress(message), when given, receives a short status after each step
+    progress = on_progress or (lambda message: None)
+    # Embeddings, search results and retrieved sources are kept across iterations of this request
+    session = RetrievalSession()
     context = ""
     # Main loop for the agent
     safe_stop = 5
     safe_stop_counter = 0
     while True:
         # Determine action and context
-        action, docs, question, improved_query, answer, search_for, docs = determine_action(user_input, conversation_history, context)
+        action, docs, question, improved_query, answer, search_for, docs = determine_action(user_input, conversation_history, context, on_answer)
         safe_stop_counter += 1
         if safe_stop_counter > safe_stop:
             #print("I'm sorry, I could not determine a valid response.")
+            print(f"Retrieval session: {session.stats()}")
             return "I'm sorry, I could not determine a valid response."
         if action == "INVALID":
             #print("I'm sorry, I can't help with that..")
@@ -170,18 +224,13 @@ def agent_loop(user_input, conversation_history):
             return question
         elif action == "RESPOND":
             #print(answer)
+            print(f"Retrieval session: {session.stats()}")
+            progress("Answer ready")
             return answer
         # Handle respond action
         elif action == "QUERY_DOCS":
-            search_results = retrieve_chunks(search_for, docs)
-            context = ""
-            for result in search_results:
-                context += f"""
-                            <SOURCE doc="{result['file_name']}" page="{result['page']}">
-                            <EXCERPT>
-                            {result['text']}
-                            </EXCERPT>
-                            </SOURCE>
-                            """
-
-
+            progress(f"Searching {', '.join(docs) if docs else 'all documents'} for: {search_for}")
+            search_results, new_hits = session.retrieve(search_for, docs)
+            print(f"🔎 {len(search_results)} results for '{search_for}', {new_hits} new")
+            progress(f"Found {len(search_results)} excerpts ({new_hits} new)")
+            context = session.context()
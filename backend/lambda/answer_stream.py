@@ -0,0 +1,183 @@
+import re
+import json
+import time
+
+
+ANSWER_START = "<ANSWER>"
+ANSWER_END = "</ANSWER>"
+
+# Minimum seconds between two partial answer updates written for the UI
+PARTIAL_UPDATE_INTERVAL = 0.5
+
+SOURCE_TAG = re.compile(r"</?SOURCE[^>]*>")
+
+
+def display_text(answer):
+    """
+    Partial answer as shown while it streams: SOURCE tags are reduced to their quoted text
+    (links are only added to the final answer) and an unfinished tag at the end is held back.
+    """
+    last_open = answer.rfind("<")
+    if last_open > answer.rfind(">"):
+        answer = answer[:last_open]
+    return SOURCE_TAG.sub("", answer).strip()
+
+
+class TagSection:
+    """
+    Incremental reader of the text between two tags of a streamed response: each delta is
+    scanned once, only a possibly cut tag at the end is kept for the next one.
+    """
+
+    def __init__(self, start_tag, end_tag):
+        self.start_tag = start_tag
+        self.end_tag = end_tag
+        self.started = False
+        self.done = False
+        self.parts = []
+        self.pending = ""
+
+    def feed(self, delta):
+        if self.done:
+            return
+        text = self.pending + delta
+        if not self.started:
+            start = text.find(self.start_tag)
+            if start == -1:
+                self.pending = text[-(len(self.start_tag) - 1):]
+                return
+            self.started = True
+            text = text[start + len(self.start_tag):]
+        end = text.find(self.end_tag)
+        if end != -1:
+            self.parts.append(text[:end])
+            self.pending = ""
+            self.done = True
+            return
+        cut = max(0, len(text) - (len(self.end_tag) - 1))
+        self.parts.append(text[:cut])
+        self.pending = text[cut:]
+
+    def value(self):
+        """The text so far (a cut end tag included), None before the start tag."""
+        if not self.started:
+            return None
+        self.parts = ["".join(self.parts)]
+        return self.parts[0] + self.pending
+
+
+class JsonStringField:
+    """
+    Incremental decoder of a string field of a JSON object still being generated: each delta
+    is scanned once, only a cut key or escape sequence at the end is kept for the next one.
+    """
+
+    def __init__(self, field):
+        self.key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        prefixes = "|".join(re.escape(field[:i]) for i in range(len(field) + 1))
+        self.cut_key = re.compile(r'"(?:%s|%s"\s*(?::\s*)?)' % (prefixes, re.escape(field)))
+        self.started = False
+        self.done = False
+        self.parts = []
+        self.pending = ""
+
+    def _keep_cut_key(self, text):
+        # A cut key starts at one of the last two quotes (the key has two, then only ':' and spaces)
+        last = text.rfind('"')
+        for quote in (text.rfind('"', 0, last) if last > 0 else -1, last):
+            if quote != -1 and self.cut_key.fullmatch(text, quote):
+                return text[quote:]
+        return ""
+
+    def feed(self, delta):
+        if self.done:
+            return
+        text = self.pending + delta
+        if not self.started:
+            match = self.key.search(text)
+            if not match:
+                self.pending = self._keep_cut_key(text)
+                return
+            self.started = True
+            text = text[match.end():]
+        i = 0
+        while i < len(text):
+            if text[i] == "\\":
+                step = 6 if text[i + 1:i + 2] == "u" else 2
+                # The two escapes of a surrogate pair are decoded together
+                if step == 6 and text[i + 2:i + 4].lower() in ("d8", "d9", "da", "db"):
+                    step = 12
+                if i + step > len(text):
+                    break
+                i += step
+            elif text[i] == '"':
+                self.done = True
+                break
+            else:
+                i += 1
+        self.parts.append(json.loads('"' + text[:i] + '"'))
+        self.pending = "" if self.done else text[i:]
+
+    def value(self):
+        """The decoded text so far (a cut escape sequence held back), None before the field starts."""
+        if not self.started:
+            return None
+        self.parts = ["".join(self.parts)]
+        return self.parts[0]
+
+
+def partial_json_string(text, field):
+    """
+    Value of a string field of a JSON object still being generated: the text decoded so far,
+    or None while the field has not started. An escape sequence cut at the end is held back.
+    """
+    decoder = JsonStringField(field)
+    decoder.feed(text)
+    return decoder.value()
+
+
+class AnswerStream:
+    """
+    Follows a streamed determine_action response. Only the RESPOND option has an <ANSWER>
+    section, so its text is relayed to on_answer(text) from the moment the tag opens,
+    throttled to one call every `interval` seconds. With json_field, the response is the
+    streamed tool input JSON and the answer is that field. Deltas are decoded as they arrive
+    (see TagSection and JsonStringField), the answer is only joined when it is published.
+    """
+
+    def __init__(self, on_answer, interval=PARTIAL_UPDATE_INTERVAL, clock=time.monotonic, json_field=None):
+        self.on_answer = on_answer
+        self.section = JsonStringField(json_field) if json_field else TagSection(ANSWER_START, ANSWER_END)
+        self.interval = interval
+        self.clock = clock
+        self.started_at = clock()
+        self.first_answer_at = None
+        self._published = ""
+        self._published_at = None
+
+    def answer(self):
+        return self.section.value()
+
+    def feed(self, delta):
+        self.section.feed(delta)
+        if not self.section.started:
+            return
+        now = self.clock()
+        if self._published_at is None or now - self._published_at >= self.interval:
+            self._publish(self.answer(), now)
+
+    def flush(self):
+        answer = self.answer()
+        if answer is not None:
+            self._publish(answer, self.clock())
+
+    def _publish(self, answer, now):
+        text = display_text(answer)
+        if not text or text == self._published:
+            return
+        if self.first_answer_at is None:
+            self.first_answer_at = now
+            print(f"⏱️ First answer text after {now - self.started_at:.2f} s")
+        self._published = text
+        self._published_at = now
+        self.on_answer(text)
@@ -0,0 +1,140 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+
+# How often (seconds) the catalog version is checked, a new document may take this long to show up
+CATALOG_VERSION_CHECK_SECONDS = int(os.environ.get("CATALOG_VERSION_CHECK_SECONDS", "10"))
+
+# Maximum number of documents listed in the agent prompt
+CATALOG_TOP_K = int(os.environ.get("CATALOG_TOP_K", "20"))
+
+_cache = {"version": None, "documents": [], "text": "", "checked_at": 0.0}
+_shortlists = OrderedDict()
+_lock = threading.Lock()
+
+
+def format_document(doc):
+    doc_name = f"doc_name:'{doc.get('doc_name', 'Unnamed Document')}'"
+    manufacturer = doc.get("manufacturer", "")
+    model = doc.get("model", "")
+    description = doc.get("doc_description", "")
+
+    # Build string: doc_name (manufacturer model): description
+    parts = [doc_name]
+    if manufacturer or model:
+        parts.append(f"({manufacturer} {model})".strip())
+    if description:
+        parts.append(f": {description.strip()}")
+
+    return " ".join(parts).strip()
+
+
+def format_catalog(documents):
+    # Join all formatted docs into a single string with line breaks
+    return "\n".join(format_document(doc) for doc in documents)
+
+
+def _terms(text):
+    return set(re.findall(r"[a-z0-9][a-z0-9\-\.]*[a-z0-9]|[a-z0-9]", (text or "").lower()))
+
+
+def keyword_scores(query, documents):
+    """
+    Scores documents whose model (2 points per term) or manufacturer (1 point per term)
+    is mentioned in the query. Returns {doc_name: score} for the matching ones.
+    """
+    query_terms = _terms(query)
+    scores = {}
+    for doc in documents:
+        score = 2 * len(_terms(doc.get("model")) & query_terms) + len(_terms(doc.get("manufacturer")) & query_terms)
+        if score:
+            scores[doc.get("doc_name")] = score
+    return scores
+
+
+def shortlist_documents(query, documents, k, vector_search=None):
+    """
+    Narrows the catalog to the k documents most relevant to the query:
+    documents whose model is named in the query first, then the vector search hits
+    (those from a named manufacturer first), then the remaining keyword matches.
+
+    :param vector_search: optional function(query, limit) returning doc_names ranked by similarity.
+    """
+    by_name = {doc.get("doc_name"): doc for doc in documents}
+    scores = keyword_scores(query, documents)
+    vector_ranked = [name for name in (vector_search(query, 2 * k) if vector_search else []) if name in by_name]
+
+    model_matches = sorted((name for name, score in scores.items() if score >= 2), key=lambda name: -scores[name])
+    vector_hits = sorted(vector_ranked, key=lambda name: -scores.get(name, 0))
+    keyword_matches = sorted(scores, key=lambda name: -scores[name])
+
+    shortlist = []
+    for name in model_matches + vector_hits + keyword_matches:
+        if name not in shortlist:
+            shortlist.append(name)
+        if len(shortlist) == k:
+            break
+    return [by_name[name] for name in shortlist]
+
+
+def search_catalog_by_vector(query, limit):
+    from embedding import create_embeddings
+    from mongodb_tools import search_catalog
+    return [hit["doc_name"] for hit in search_catalog(create_embeddings(query), limit)]
+
+
+def _load_catalog():
+    from mongodb_tools import get_catalog_documents, get_catalog_version
+    now = time.time()
+    if _cache["version"] is not None and now - _cache["checked_at"] < CATALOG_VERSION_CHECK_SECONDS:
+        return _cache["version"]
+
+    version = get_catalog_version()
+    _cache["checked_at"] = now
+    if version != _cache["version"]:
+        documents = get_catalog_documents()
+        _cache["documents"] = documents
+        _cache["text"] = format_catalog(documents)
+        _cache["version"] = version
+        _shortlists.clear()
+        print(f"Catalog version {version} loaded: {len(documents)} documents")
+    return version
+
+
+def get_catalog_text(query=None, k=CATALOG_TOP_K):
+    """
+    Returns the AVAILABLE_DOCS text for the agent prompt. The full catalog is built once per
+    catalog version (bumped by insert_document_to_mongo) and kept in process across invocations.
+    When a query is given and the catalog has more than k documents, only the k most relevant
+    documents are listed (memoized per query and version), or all of them if the search fails.
+    """
+    with _lock:
+        version = _load_catalog()
+        documents = _cache["documents"]
+        full_text = _cache["text"]
+        if query is None or len(documents) <= k:
+            return full_text
+
+        key = (query, k)
+        if key in _shortlists:
+            _shortlists.move_to_end(key)
+            return _shortlists[key]
+
+    try:
+        shortlist = shortlist_documents(query, documents, k, search_catalog_by_vector)
+    except Exception as e:
+        # e.g. the catalog vector index is missing or the embedding call failed, not memoized
+        print(f"❌ Catalog shortlist failed, listing every document: {str(e)}")
+        return full_text
+    text = format_catalog(shortlist)
+    print(f"Catalog shortlist for version {version}: {len(shortlist)}/{len(documents)} documents")
+
+    with _lock:
+        if _cache["version"] == version:
+            _shortlists[key] = text
+            while len(_shortlists) > 256:
+                _shortlists.popitem(last=False)
+    return text
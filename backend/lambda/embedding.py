@@ -1,29 +1,33 @@
 import os
-import boto3
 import re
-import voyageai
-from mongodb_tools import insert_document_to_mongo
-import random
+from mongodb_tools import insert_document_to_mongo, ChunkWriter
 from common import document_types 
+from page_structuring import PageStructurer, build_structure_prompt, build_structure_tool_prompt, DEFAULT_MAX_IN_FLIGHT
+from ingestion_state import IngestionState
+from ingest_pipeline import DocumentIngestion
+from fanout import FanOut
+from llm_cache import ResponseCache, MongoCacheStore
+from embedding_cache import EmbeddingCache
+from catalog import format_document
+from prompt_budget import estimate_tokens
+from resources import get_client, get_voyage_client, BOTO3_MAX_POOL_CONNECTIONS
+from model_router import ModelRouter, PartialResponseError, inference_profile_ids
+from structured_output import LLM_OUTPUT_MODE, DOCUMENT_METADATA_TOOL, STRUCTURE_PAGE_TOOL, invoke_structured, elements_to_tags, structured_metrics, parse_tool_output
 import json
 
 
-# Get secret name from environment variable
-secret_name = os.environ["SECRET_NAME"]
-region_name = os.environ.get("AWS_REGION", "us-west-2")  # fallback default
+def get_bedrock_client():
+    # Shared by all threads, with a connection per concurrent page structuring request
+    return get_client("bedrock-runtime", max_pool_connections=max(BOTO3_MAX_POOL_CONNECTIONS, DEFAULT_MAX_IN_FLIGHT))
 
-# Create a Secrets Manager client
-session = boto3.session.Session()
-client = session.client(service_name="secretsmanager", region_name=region_name)
 
-# Retrieve secret value
-get_secret_value_response = client.get_secret_value(SecretId=secret_name)
-secrets = json.loads(get_secret_value_response["SecretString"])
-
-# Now you can access keys inside the secret
-voyage_api_key = secrets["VOYAGE_API_KEY"]
-mongodb_uri = secrets["MONGODB_URI"]
+# VoyageAI request limits for voyage-3 (1000 texts and 120K tokens per request), with some margin on tokens
+EMBEDDING_MODEL = "voyage-3"
+EMBEDDING_BATCH_MAX_ITEMS = 1000
+EMBEDDING_BATCH_MAX_TOKENS = 100000
 
+# Query and chunk embeddings are shared, repeated questions and boilerplate sections are embedded once
+embedding_cache = EmbeddingCache()
 
 #----- Helper Functions
 
@@ -43,59 +47,59 @@ def get_tag(text, tag):
 
 
 
-def create_embeddings(text):
-    vo = voyageai.Client(api_key=voyage_api_key)
-    result = vo.embed([text], model="voyage-3")
-    embedding = result.embeddings[0]
-    return embedding
+def pack_embedding_batches(texts, max_items=EMBEDDING_BATCH_MAX_ITEMS, max_tokens=EMBEDDING_BATCH_MAX_TOKENS):
+    """
+    Groups text positions into batches capped by item count and estimated token count.
+    A single text above the token cap is sent alone (VoyageAI truncates it).
 
-def extract_first_xml_element(input_str):
+    :return: list of batches, each a list of indexes into texts.
     """
-    Extracts:
-    1. Text within the first pair of XML-like tags.
-    2. The tag name.
-    3. The remaining string after the closing tag.
-    
-    Args:
-        input_str (str): The input string to process.
-        
-    Returns:
-        tuple: (inner_text, tag_name, remaining_text) or (None, None, None) if not found
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def create_embeddings_batch(texts):
     """
-    # Find the first opening tag
-    start_tag_open = input_str.find('<')
-    if start_tag_open == -1:
-        return None, None, None
-    
-    start_tag_close = input_str.find('>', start_tag_open)
-    if start_tag_close == -1:
-        return None, None, None
-    
-    # Extract potential tag name
-    tag_name = input_str[start_tag_open + 1:start_tag_close]
-    
-    # Validate tag name (must be non-empty and contain only word characters)
-    if not tag_name or not all(char.isalnum() or char == '_' for char in tag_name):
-        return None, None, None
-    
-    # Find closing tag
-    closing_tag = f"</{tag_name}>"
-    end_tag_open = input_str.find(closing_tag, start_tag_close)
-    if end_tag_open == -1:
-        return None, None, None
-    
-    # Extract inner text
-    inner_text = input_str[start_tag_close + 1:end_tag_open]
-    
-    # Extract remaining text
-    end_tag_close = end_tag_open + len(closing_tag)
-    remaining_text = input_str[end_tag_close:]
-    
-    return inner_text, tag_name, remaining_text
+    Creates embeddings for a list of texts using the embedding cache and as few VoyageAI requests as possible.
 
+    :param texts: list of strings to embed.
+    :return: list of embeddings, in the same order as texts.
+    """
+    embeddings = embedding_cache.get_many(texts, EMBEDDING_MODEL)
 
+    # Identical texts are only embedded once
+    missing = {}
+    for i, embedding in enumerate(embeddings):
+        if embedding is None:
+            missing.setdefault(texts[i], []).append(i)
+    unique_texts = list(missing)
 
+    batches = pack_embedding_batches(unique_texts)
+    for batch in batches:
+        result = get_voyage_client().embed([unique_texts[j] for j in batch], model=EMBEDDING_MODEL)
+        for j, embedding in zip(batch, result.embeddings):
+            for i in missing[unique_texts[j]]:
+                embeddings[i] = embedding
+    embedding_cache.put_many(unique_texts, [embeddings[missing[text][0]] for text in unique_texts], EMBEDDING_MODEL)
 
+    print(f"Embedded {len(texts)} texts ({len(texts) - len(unique_texts)} cached) in {len(batches)} VoyageAI requests, cache: {embedding_cache.stats()}")
+    return embeddings
+
+
+def create_embeddings(text):
+    return create_embeddings_batch([text])[0]
 
 def invoke_claude_sonnet_37(prompt):
     """
@@ -105,7 +109,7 @@ def invoke_claude_sonnet_37(prompt):
     :return: A string containing the AI-generated response.
     """
     # Create a Bedrock Runtime client in the AWS Region of your choice.
-    client = boto3.client("bedrock-runtime")
+    client = get_bedrock_client()
 
     # Set the model ID for Claude 3 Sonnet.
     model_id = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
@@ -147,27 +151,22 @@ def invoke_claude_sonnet_37(prompt):
 
 
 
-def invoke_claude_x(prompt):
-    """
-    Invokes one of the Anthropic Claude x models via AWS Bedrock to generate a response.
-    It randomly selects a starting model and, in case of a ThrottlingException,
-    tries the next model in a round-robin manner.
+# Models used by invoke_claude_x, interchangeable for our prompts (comma-separated CLAUDE_MODEL_IDS overrides them).
+# Cross-region inference profiles are pointed at the region group of the Lambda.
+CLAUDE_MODEL_IDS = inference_profile_ids(os.environ.get("CLAUDE_MODEL_IDS", ",".join([
+    "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
+    "us.anthropic.claude-3-5-sonnet-20241022-v2:0",
+    "us.anthropic.claude-3-5-sonnet-20240620-v1:0"
+])).split(","))
+# Cache namespace of the responses of CLAUDE_MODEL_IDS, change it when the model list changes
+CLAUDE_MODEL_FAMILY = "anthropic.claude-3.x-sonnet"
 
-    :param prompt: A string representing the user query.
-    :return: A string containing the AI-generated response or an error message.
-    """
-    # Create a Bedrock Runtime client in the AWS Region of your choice.
-    client = boto3.client("bedrock-runtime")
+# Health and latency of each model, shared by all calls of the container
+model_router = ModelRouter(CLAUDE_MODEL_IDS)
 
-    # List of model IDs.
-    model_ids = [
-        "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-        "us.anthropic.claude-3-5-sonnet-20241022-v2:0",
-        "us.anthropic.claude-3-5-sonnet-20240620-v1:0"
-    ]
 
-    # Define the request payload.
-    native_request = {
+def build_claude_request(prompt, tool=None):
+    request = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 10000,
         "temperature": 0,
@@ -178,32 +177,132 @@ def invoke_claude_x(prompt):
             }
         ],
     }
+    if tool:
+        # The model must answer with a call of this tool, its input follows the tool JSON schema
+        request["tools"] = [tool]
+        request["tool_choice"] = {"type": "tool", "name": tool["name"]}
+    return request
+
+
+def invoke_claude_x(prompt):
+    """
+    Invokes one of the Anthropic Claude x models via AWS Bedrock to generate a response.
+    The model router tries the healthiest model first and fails over to the others when
+    a model is throttled or unavailable (see model_router.ModelRouter).
 
-    # Pick a random starting index.
-    start_index = random.randint(0, len(model_ids) - 1)
-    attempts = 0
+    :param prompt: A string representing the user query.
+    :return: A string containing the AI-generated response or an error message.
+    """
+    native_request = json.dumps(build_claude_request(prompt))
 
-    # Try each model in a round-robin fashion.
-    while attempts < len(model_ids):
-        current_index = (start_index + attempts) % len(model_ids)
-        model_id = model_ids[current_index]
+    def call(model_id):
         print(f"using FM: {model_id}")
+        response = get_bedrock_client().invoke_model(modelId=model_id, body=native_request)
+        model_response = json.loads(response["body"].read())
+        return model_response["content"][0]["text"]
+
+    return model_router.invoke(call)
+
+
+def invoke_claude_x_tool(prompt, tool):
+    """
+    Same as invoke_claude_x, forcing the model to answer with a call of `tool`
+    (see structured_output for the tool definitions).
+
+    :return: The tool input as JSON text or an error message.
+    """
+    native_request = json.dumps(build_claude_request(prompt, tool))
+
+    def call(model_id):
+        print(f"using FM (tool {tool['name']}): {model_id}")
+        response = get_bedrock_client().invoke_model(modelId=model_id, body=native_request)
+        model_response = json.loads(response["body"].read())
+        for block in model_response["content"]:
+            if block["type"] == "tool_use":
+                return json.dumps(block["input"])
+        # No tool call: the text is returned, structured_output asks for a repair
+        return "".join(block.get("text", "") for block in model_response["content"])
+
+    return model_router.invoke(call)
+
+
+def invoke_claude_x_stream(prompt, on_text, tool=None):
+    """
+    Same as invoke_claude_x, with invoke_model_with_response_stream: on_text(delta) is called
+    with every piece of text as it is generated. A failing model is only swapped for another
+    one while nothing has been streamed yet. With a tool, the deltas are pieces of the tool
+    input JSON.
+
+    :return: The complete response text (or tool input JSON) or an error message.
+    """
+    native_request = json.dumps(build_claude_request(prompt, tool))
+
+    def call(model_id):
+        print(f"using FM (streaming): {model_id}")
+        parts = []
         try:
-            response = client.invoke_model(modelId=model_id, body=json.dumps(native_request))
-            model_response = json.loads(response["body"].read())
-            return model_response["content"][0]["text"]
+            response = get_bedrock_client().invoke_model_with_response_stream(modelId=model_id, body=native_request)
+            for event in response["body"]:
+                if "chunk" not in event:
+                    # Errors inside the stream (throttlingException, modelStreamErrorException, ...)
+                    raise Exception(str(event))
+                payload = json.loads(event["chunk"]["bytes"])
+                if payload.get("type") == "content_block_delta":
+                    delta = payload["delta"].get("partial_json" if tool else "text", "")
+                    parts.append(delta)
+                    on_text(delta)
         except Exception as e:
-            # If a ThrottlingException is encountered, try the next model.
-            if "ThrottlingException" in str(e):
-                print(f"Model {model_id} throttled. Trying next model.")
-                attempts += 1
-                continue
-            else:
-                print(f"ERROR: Unable to invoke model {model_id}. Reason: {str(e)}")
-                return f"ERROR: {str(e)}"
+            if not parts:
+                raise
+            # Counted as a failure of this model, the text already relayed cannot be taken back
+            raise PartialResponseError(str(e)) from e
+        return "".join(parts)
+
+    return model_router.invoke(call)
+
+
+# Ingestion prompts are deterministic (temperature 0), re-indexing reuses their responses
+llm_cache = ResponseCache(MongoCacheStore())
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+if LLM_CACHE_ENABLED:
+    invoke_claude_cached = llm_cache.wrap(invoke_claude_x, CLAUDE_MODEL_FAMILY)
+else:
+    invoke_claude_cached = invoke_claude_x
+
+
+def tool_invoker(tool):
+    """
+    invoke(prompt) returning the tool input JSON, cached apart from the text responses. Only
+    output that follows the tool schema is cached, an invalid one is asked again on a retry.
+    """
+    def invoke(prompt):
+        return invoke_claude_x_tool(prompt, tool)
+
+    def is_valid(raw):
+        return parse_tool_output(raw, tool["input_schema"])[0] is not None
+
+    if LLM_CACHE_ENABLED:
+        return llm_cache.wrap(invoke, f"{CLAUDE_MODEL_FAMILY}/tool:{tool['name']}", is_valid)
+    return invoke
+
+
+def invoke_structure_page(prompt):
+    """Page structuring through the structure_page tool, returned as the same tagged text as the tags prompt."""
+    data, response = invoke_structured(prompt, STRUCTURE_PAGE_TOOL, invoke_structure_page_tool)
+    return elements_to_tags(data) if data is not None else response
 
-    return "ERROR: All models throttled or unavailable."
 
+invoke_metadata_tool = tool_invoker(DOCUMENT_METADATA_TOOL)
+invoke_structure_page_tool = tool_invoker(STRUCTURE_PAGE_TOOL)
+
+
+
+METADATA_OUTPUT_RULES = {
+    "tags": """- In your output, the only allowed tags you can write are <NAME></NAME>, <TYPE></TYPE>, <DESCRIPTION></DESCRIPTION>, <MANUFACTURER></MANUFACTURER>, <MODEL></MODEL>
+    - You should write empty tags when no information is available for a particular attribute, e.g. write <MANUFACTURER></MANUFACTURER> when manufacturer cannot be found in tags <DOCUMENT></DOCUMENT>.""",
+    "tool": """- Answer by calling the document_metadata tool.
+    - You should use an empty string when no information is available for a particular attribute, e.g. manufacturer "" when manufacturer cannot be found in tags <DOCUMENT></DOCUMENT>."""
+}
 
 
 def determine_document_metadata(extracted_doc, file_name):
@@ -236,11 +335,14 @@ def determine_document_metadata(extracted_doc, file_name):
     
     RULES
     -----
-    - In your output, the only allowed tags you can write are <NAME></NAME>, <TYPE></TYPE>, <DESCRIPTION></DESCRIPTION>, <MANUFACTURER></MANUFACTURER>, <MODEL></MODEL>
+    {METADATA_OUTPUT_RULES[LLM_OUTPUT_MODE]}
     - Ignore any character/text that it is obviously invalid (any OCR extraction inconsistentcy).
-    - You should write empty tags when no information is available for a particular attribute, e.g. write <MANUFACTURER></MANUFACTURER> when manufacturer cannot be found in tags <DOCUMENT></DOCUMENT>.
     """
-    response = invoke_claude_x(prompt)
+    if LLM_OUTPUT_MODE == "tool":
+        data, _ = invoke_structured(prompt, DOCUMENT_METADATA_TOOL, invoke_metadata_tool)
+        data = data or {}
+        return tuple(data.get(field, "") for field in ("name", "type", "description", "manufacturer", "model"))
+    response = invoke_claude_cached(prompt)
     doc_name = get_tag(response, "NAME")
     doc_type = get_tag(response, "TYPE")
     doc_description = get_tag(response, "DESCRIPTION")
@@ -252,104 +354,80 @@ def determine_document_metadata(extracted_doc, file_name):
 #----- Document Chunking
 
 
-def chuck_document(extracted_doc, file_name):
-    formated_doc = ""
-    doc_name, doc_type, doc_description, doc_manufacturer, doc_model = determine_document_metadata(extracted_doc, file_name)
+# Stop starting new work when less than this is left in the invocation, so checkpoints are saved before the timeout
+INGESTION_SAFETY_MARGIN_SECONDS = 120
+
+def extract_metadata(state, document_head, file_name):
+    """Document metadata extracted from its first pages, stored with the catalog entry and checkpointed in the ingestion state."""
+    doc_name, doc_type, doc_description, doc_manufacturer, doc_model = determine_document_metadata(document_head, file_name)
+    metadata = {
+        "doc_name": doc_name,
+        "doc_type": doc_type,
+        "doc_description": doc_description,
+        "manufacturer": doc_manufacturer,
+        "model": doc_model
+    }
+    # Embedding of the catalog entry, used to shortlist the documents shown to the agent
+    description_vector = create_embeddings(format_document(metadata))
+    insert_document_to_mongo(file_name, doc_name, doc_type, doc_description, doc_manufacturer, doc_model, description_vector=description_vector)
+    state.save_metadata(metadata)
     print(f"Document Name: {doc_name}")
     print(f"Document Type: {doc_type}")
     print(f"Document Description: {doc_description}")
     print(f"Manufacturer: {doc_manufacturer}")
     print(f"Model: {doc_model}")
-    insert_document_to_mongo(file_name, doc_name, doc_type, doc_description, doc_manufacturer, doc_model)
-    for i, page_text in enumerate(extracted_doc):
-        print(f"\n Processing 📄 Page {i + 1} — {len(page_text)} characters")
-
-        prompt = f"""
-        <CURRENT_PAGE>
-        {page_text}
-        </CURRENT_PAGE>
-
-
-        TASK
-        ----
-        You are processing a large OCR extracted document, the objective is to organize the document into relevant sections focusing on the current page provided in tags <CURRENT_PAGE>, following these rules:
-
-        RULES
-        -----
-        - if you identify a Main Heading, write it verbatim in tags <H1></H1>
-        - if you identify a Section Heading, write it verbatim in tags <H2></H2>
-        - if you identify a Sub-Section Heading, write it verbatim in tags <H3></H3>
-        - if you identify any body text or block of text, write it verbatim in tags <BODY></BODY>
-        - All the content in tags <CURRENT_PAGE> must be included in your output.
-        - In your output, the only allowed tags you can write are <H1></H1>, <H2></H2>, <H3></H3> and <BODY></BODY>.
-        - Excludde any character/text that it is obviously invalid (any OCR extraction inconsistentcy).
-        """
-        response = invoke_claude_x(prompt)
-        formated_doc += f"\n<PAGE>{i+1}</PAGE>\n"
-        formated_doc += response
-
-    doc = formated_doc
-    H1 = ""
-    H2 = ""
-    H3 = ""
-    page = ""
-
-    #print(f"Doc to be processed:\n{doc}")
-
-    structured_document = []
-
-    while (doc):
-        text, tag, doc = extract_first_xml_element(doc)
-
-        #print(f"tag = {tag} \n text ={text} ")
-         
-        if tag == "H1":
-            H1 = text
-        if tag == "H2":
-            H2 = text
-        if tag == "H3":
-            H3 = text
-        if tag == "PAGE":
-            page = text
-        if tag == "BODY":
-            sub_chunk = {
-                "H1": H1,
-                "H2": H2,
-                "H3": H3,
-                "page": page,
-                "text": text
-            }
-            structured_document.append(sub_chunk)
+    return metadata
 
 
-    # To group contiguous <BODY> with same H1, H2, H3, and track the initial page
-    temp_body = ""
-    last_h1, last_h2, last_h3, initial_page = "", "", "", ""
-
-    for sub_chunk in structured_document:
-        # Check if we are continuing the same section (same H1, H2, H3)
-        if sub_chunk["H1"] == last_h1 and sub_chunk["H2"] == last_h2 and sub_chunk["H3"] == last_h3:
-            # If it's the same section, accumulate the body text
-            temp_body += "\n" + sub_chunk["text"]
-        else:
-            # If it's a new section, process the previous accumulated body text as a chunk
-            if temp_body:
-                process_chunk(file_name, last_h1, last_h2, last_h3, initial_page, temp_body, doc_name, doc_type, doc_description, doc_manufacturer, doc_model)
-            # Reset for the new section
-            last_h1, last_h2, last_h3, initial_page = sub_chunk["H1"], sub_chunk["H2"], sub_chunk["H3"], sub_chunk["page"]
-            temp_body = sub_chunk["text"]  # Start accumulating new body text
+def build_page_structurer():
+    if LLM_OUTPUT_MODE == "tool":
+        return PageStructurer(invoke_structure_page, build_prompt=build_structure_tool_prompt)
+    return PageStructurer(invoke_claude_cached, build_prompt=build_structure_prompt)
 
-    # Process any remaining body content in temp_body after the loop ends
-    if temp_body:
-        process_chunk(file_name, last_h1, last_h2, last_h3, initial_page, temp_body, doc_name, doc_type, doc_description, doc_manufacturer, doc_model)
 
+def build_fanout(work_queue):
+    """Coordinator/worker of large documents, with the same structuring, embedding and metadata as chuck_document."""
+    return FanOut(work_queue, build_page_structurer().structure, create_embeddings_batch, extract_metadata,
+                  structure_workers=DEFAULT_MAX_IN_FLIGHT)
 
 
-def process_chunk(file_name, H1, H2, H3, page, text, doc_name, doc_type, doc_description, doc_manufacturer, doc_model):
-    text_to_embed = f"{H1} {H2} {H3} {text}"
-
-    #creates vector embeddings
-    embedding = create_embeddings(text_to_embed)
-
-    #now stores the document chunk to MongoDB
-    insert_document_chunk_to_mongo(file_name, page, H1, H2, H3, text, embedding, doc_name, doc_type, doc_description, doc_manufacturer, doc_model)
\ No newline at end of file
+def chuck_document(pages, file_name, time_left=None):
+    """
+    Indexes a document: metadata extraction, page structuring, section grouping, embedding and storage.
+    Reading, structuring, grouping, embedding and writing run as a pipeline (see ingest_pipeline), with
+    the metadata extracted alongside. Progress is checkpointed per file, so calling it again after a
+    timeout or crash resumes where it stopped.
+
+    :param pages: iterable of page texts, read as the pipeline consumes them.
+    :param file_name: S3 key of the document.
+    :param time_left: optional function returning the seconds left in the invocation.
+    :return: True when the document is fully indexed, False when it stopped early to avoid a timeout
+             or pages could not be structured (the document is only completed once every page is).
+    """
+    def out_of_time():
+        return time_left is not None and time_left() < INGESTION_SAFETY_MARGIN_SECONDS
+
+    state = IngestionState(file_name)
+    structurer = build_page_structurer()
+    # Metadata extraction runs alongside the pipeline once the first pages are read, only the write stage waits for it
+    ingestion = DocumentIngestion(
+        file_name, pages, state,
+        structure=structurer.structure,
+        embed=create_embeddings_batch,
+        writer=ChunkWriter(),
+        extract_metadata=lambda document_head: extract_metadata(state, document_head, file_name),
+        should_stop=out_of_time,
+        structure_workers=DEFAULT_MAX_IN_FLIGHT
+    )
+    done = ingestion.run()
+    print(f"Structured pages: {structurer.limiter.throttles} throttled calls")
+    if not done:
+        return False
+    if ingestion.unchanged:
+        return True
+
+    state.complete(ingestion.page_count)
+    print(f"LLM response cache: {llm_cache.stats()}")
+    print(f"Model router: {model_router.stats()}")
+    print(f"Structured output: {structured_metrics.stats()}")
+    return True
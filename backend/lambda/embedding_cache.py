@@ -0,0 +1,107 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+CACHE_DATABASE = "manufacturing_database"
+EMBEDDING_CACHE_COLLECTION = "embedding_cache"
+
+DEFAULT_MAX_MEMORY_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MEMORY_ENTRIES", "5000"))
+
+
+def normalize_text(text):
+    # Case and whitespace differences do not justify a new embedding
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def embedding_key(text, model):
+    return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embeddings keyed on normalized text plus model name:
+    an in-process LRU that survives warm Lambda invocations, backed by the
+    manufacturing_database.embedding_cache collection shared by all containers.
+    """
+
+    def __init__(self, collection=None, max_memory_entries=DEFAULT_MAX_MEMORY_ENTRIES, use_store=True):
+        self._collection = collection
+        self.use_store = use_store
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from resources import get_mongo_client
+            self._collection = get_mongo_client()[CACHE_DATABASE][EMBEDDING_CACHE_COLLECTION]
+        return self._collection
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, texts, model):
+        """Returns a list aligned with texts, with None for the texts not in the cache."""
+        keys = [embedding_key(text, model) for text in texts]
+        vectors = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    vectors[i] = self.memory[key]
+                    self.memory_hits += 1
+
+        missing = {keys[i] for i, vector in enumerate(vectors) if vector is None}
+        if missing and self.use_store:
+            stored = {entry["_id"]: entry["vector"] for entry in self.collection.find({"_id": {"$in": list(missing)}}, {"vector": 1})}
+            with self._lock:
+                for i, key in enumerate(keys):
+                    if vectors[i] is None and key in stored:
+                        vectors[i] = stored[key]
+                        self.store_hits += 1
+                        self._remember(key, stored[key])
+
+        with self._lock:
+            self.misses += sum(vector is None for vector in vectors)
+        return vectors
+
+    def put_many(self, texts, vectors, model):
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            entries[embedding_key(text, model)] = vector
+        if not entries:
+            return
+        with self._lock:
+            for key, vector in entries.items():
+                self._remember(key, vector)
+        if self.use_store:
+            from pymongo.errors import BulkWriteError
+            now = int(time.time())
+            try:
+                self.collection.insert_many(
+                    [{"_id": key, "model": model, "vector": vector, "created_at": now} for key, vector in entries.items()],
+                    ordered=False
+                )
+            except BulkWriteError:
+                # Another container cached some of them first
+                pass
+
+    def stats(self):
+        lookups = self.memory_hits + self.store_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.store_hits) / lookups, 3) if lookups else 0.0
+        }
@@ -0,0 +1,180 @@
+import os
+import json
+from ingestion_state import IngestionState
+from ingest_pipeline import DocumentIngestion, DocumentHead
+from mongodb_tools import ChunkWriter
+from section_chunker import SectionChunker
+
+
+# Documents with at least this many pages are split into work items when a work queue is configured
+FANOUT_MIN_PAGES = int(os.environ.get("FANOUT_MIN_PAGES", "150"))
+
+# Pages per work item, fewer when their text would not fit in one SQS message (256 KB)
+PAGES_PER_WORK_ITEM = int(os.environ.get("PAGES_PER_WORK_ITEM", "25"))
+MAX_WORK_ITEM_BYTES = 200 * 1024
+
+
+def iter_ranges(pages, pages_per_item=PAGES_PER_WORK_ITEM, max_bytes=MAX_WORK_ITEM_BYTES):
+    """Yields (first_page, range_pages) as the pages are read, each range within pages_per_item pages and max_bytes of JSON text."""
+    first = 0
+    range_pages = []
+    size = 0
+    for i, page_text in enumerate(pages):
+        page_bytes = len(json.dumps(page_text))
+        if range_pages and (len(range_pages) >= pages_per_item or size + page_bytes > max_bytes):
+            yield first, range_pages
+            first = i
+            range_pages = []
+            size = 0
+        range_pages.append(page_text)
+        size += page_bytes
+    if range_pages:
+        yield first, range_pages
+
+
+class FanOut:
+    """
+    Indexes a large document across several workers:
+
+    - start() (coordinator): reads the pages as they arrive, extracts the metadata from the first
+      ones and sends one work item per page range to the work queue (see work_queue) as soon as
+      the range is read. Ranges whose pages are all structured already (e.g. unchanged since the
+      last upload) are not sent.
+    - process() (worker): structures, embeds and writes the sections of one range, leaving the
+      sections at its boundaries (see DocumentIngestion partial mode). The worker that completes
+      the last range finalizes the document, or a finalize work item when no range was left.
+    - finalize(): groups the whole document from the checkpointed page responses, writes the
+      sections not stored yet (those at the boundaries, and those of ranges not sent), deletes
+      stale chunks and completes the state.
+
+    Work items can be delivered more than once: every step is idempotent, and a failed item is retried.
+    """
+
+    def __init__(self, work_queue, structure, embed, extract_metadata, new_state=IngestionState, new_writer=ChunkWriter,
+                 new_chunker=SectionChunker, pages_per_item=PAGES_PER_WORK_ITEM, structure_workers=1):
+        self.work_queue = work_queue
+        self.structure = structure
+        self.embed = embed
+        self.extract_metadata = extract_metadata
+        self.new_state = new_state
+        self.new_writer = new_writer
+        self.new_chunker = new_chunker
+        self.pages_per_item = pages_per_item
+        self.structure_workers = structure_workers
+
+    def start(self, pages, file_name):
+        """:return: number of work items sent (0 when the file is unchanged)."""
+        state = self.new_state(file_name)
+        indexed = state.status == "completed"
+        tracker = state.track_pages()
+        head = DocumentHead()
+        page_hashes = []
+
+        def read():
+            for page_text in pages:
+                page_hash, unchanged = tracker.add(page_text)
+                page_hashes.append(page_hash)
+                head.add(page_text, unchanged)
+                yield page_text
+
+        skipped = []
+        range_count = 0
+        sent = 0
+        for range_index, (first, range_pages) in enumerate(iter_ranges(read(), self.pages_per_item)):
+            range_count += 1
+            range_hashes = page_hashes[:len(range_pages)]
+            del page_hashes[:len(range_pages)]
+            if state.all_structured(range_hashes):
+                # Structured by an earlier run, the finalizer groups it with the others
+                if sent:
+                    state.complete_range(range_index, f"{state.ingestion_id}:start")
+                else:
+                    skipped.append(range_index)
+                continue
+            if not sent:
+                self._start_ingestion(state, head, file_name, skipped)
+            self.work_queue.send({
+                "file_name": file_name,
+                "ingestion_id": state.ingestion_id,
+                "range_index": range_index,
+                "first_page": first,
+                "pages": range_pages
+            })
+            sent += 1
+
+        if tracker.finish() and indexed and not sent:
+            print(f"{file_name} is unchanged since it was indexed, skipping")
+            return 0
+        if not sent:
+            self._start_ingestion(state, head, file_name, skipped)
+        if state.finish_ranges(range_count, tracker.page_count, f"{state.ingestion_id}:finalize"):
+            # Every range was structured before, only the finalization is left
+            self.work_queue.send({"file_name": file_name, "ingestion_id": state.ingestion_id, "finalize": True})
+            sent += 1
+        print(f"📤 {file_name}: {tracker.page_count} pages sent as {sent} work items")
+        return sent
+
+    def _start_ingestion(self, state, head, file_name, ranges_done):
+        """New ingestion of the file, with its metadata checkpointed before the first work item is sent."""
+        if not (head.unchanged and state.metadata):
+            self.extract_metadata(state, head.pages, file_name)
+        state.start()
+        state.start_fanout(ranges_done)
+        print(f"Fanned out ingestion {state.ingestion_id} of {file_name}: {len(ranges_done)} ranges already structured")
+
+    def process(self, item, should_stop=None):
+        """
+        Indexes one work item. Raises when the range could not be completed, so the item is retried.
+
+        :return: True when this worker also finalized the document.
+        """
+        file_name = item["file_name"]
+        state = self.new_state(file_name)
+        if state.ingestion_id != item["ingestion_id"]:
+            print(f"Skipping work item of ingestion {item['ingestion_id']}, {file_name} has been uploaded again")
+            return False
+        if item.get("finalize"):
+            self.finalize(file_name, state)
+            return True
+
+        pages = item["pages"]
+        ingestion = DocumentIngestion(
+            file_name, pages, state,
+            structure=self.structure,
+            embed=self.embed,
+            writer=self.new_writer(),
+            get_metadata=lambda: state.metadata,
+            should_stop=should_stop,
+            structure_workers=self.structure_workers,
+            first_page=item["first_page"],
+            partial=True,
+            chunker=self.new_chunker()
+        )
+        # Pages skipped before a timeout or whose structuring failed are not checkpointed, the item is retried for them
+        # (and for chunks that failed to insert)
+        if not ingestion.run():
+            raise RuntimeError(f"Pages {item['first_page'] + 1}-{item['first_page'] + len(pages)} of {file_name} were not all structured and written")
+
+        worker_id = f"{item['ingestion_id']}:{item['range_index']}"
+        if not state.complete_range(item["range_index"], worker_id):
+            return False
+        self.finalize(file_name, state)
+        return True
+
+    def finalize(self, file_name, state):
+        page_count = state.page_count
+        print(f"🧵 Finalizing {file_name}: stitching the sections of {state.state.get('ranges_total')} ranges")
+        # Streamed from the checkpoints, the pages are not held in memory
+        ingestion = DocumentIngestion(
+            file_name, None, state,
+            structure=self.structure,
+            embed=self.embed,
+            writer=self.new_writer(),
+            get_metadata=lambda: state.metadata,
+            structure_workers=self.structure_workers,
+            chunker=self.new_chunker(),
+            page_hashes=(page_hash for _, page_hash in state.iter_page_hashes(page_count))
+        )
+        if not ingestion.run():
+            raise RuntimeError(f"Cannot finalize {file_name}: {ingestion.failed_pages} pages are not structured, {ingestion.failed_chunks} chunks not written")
+        state.complete(page_count)
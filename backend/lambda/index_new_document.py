@@ -7,25 +7,43 @@ except Exception as e:
 
 
 
-import boto3
 import json
+import itertools
 import urllib.parse
 import os
-from embedding import chuck_document
+from embedding import chuck_document, build_fanout, INGESTION_SAFETY_MARGIN_SECONDS
+from resources import get_client
+from work_queue import get_work_queue
+from fanout import FANOUT_MIN_PAGES
+from textract_reader import iter_textract_pages
+from text_reader import iter_text_pages, TEXT_PAGE_CHAR_LIMIT, TEXT_READ_CHUNK_BYTES
 
-s3_client = boto3.client("s3")
-textract_client = boto3.client("textract")
+# Maximum number of chained invocations used to finish a single document
+MAX_CONTINUATIONS = 10
 
 
 
 def handler(event, context):
     print("Event received:", json.dumps(event, indent=2))
 
+    def time_left():
+        return context.get_remaining_time_in_millis() / 1000
+
+    # Page range work items of a large document (SQS), a failure returns the item to the queue
+    if "Records" in event and event["Records"][0].get("eventSource") == "aws:sqs":
+        for record in event["Records"]:
+            build_fanout(get_work_queue()).process(
+                json.loads(record["body"]),
+                should_stop=lambda: time_left() < INGESTION_SAFETY_MARGIN_SECONDS
+            )
+        return
+
     # Check if SNS (from Textract async job)
     if "Records" in event and "Sns" in event["Records"][0]:
         sns_message = json.loads(event["Records"][0]["Sns"]["Message"])
         content, doc_name = handle_textract_completion(sns_message)
-        chuck_document(content, doc_name)
+        if not index_document(content, doc_name, time_left):
+            continue_in_new_invocation(event, context)
         return
 
     # Otherwise, assume it's an S3 event
@@ -35,40 +53,71 @@ def handler(event, context):
 
         if key.endswith(".txt"):
             content = handle_text_file(bucket, key)
-            chuck_document(content, key)
+            if not index_document(content, key, time_left):
+                continue_in_new_invocation({**event, "Records": [record]}, context)
         else:
             start_textract_async(bucket, key)
 
 
-def handle_text_file(bucket, key, page_char_limit=1800):
-    print(f"📄 Reading plain text file: s3://{bucket}/{key}")
-    response = s3_client.get_object(Bucket=bucket, Key=key)
-    text = response["Body"].read().decode("utf-8").strip()
-
-    ordered_pages = []
-    position = 0
-    text_len = len(text)
-
-    while position < text_len:
-        end = min(position + page_char_limit, text_len)
-
-        # Look backward to the last space to avoid breaking a word
-        if end < text_len and text[end].isalnum():
-            last_space = text.rfind(" ", position, end)
-            if last_space > position:
-                end = last_space
+def index_document(pages, file_name, time_left):
+    """
+    Large documents are split into page range work items for the workers when a work queue
+    is configured (see fanout), the others are indexed in this invocation. pages is read as
+    the ingestion consumes it, only the first FANOUT_MIN_PAGES are read ahead to choose.
+
+    :return: False when the ingestion stopped early and must continue in a new invocation.
+    """
+    reader = pages
+    try:
+        work_queue = get_work_queue()
+        if work_queue:
+            large, pages = has_pages(pages, FANOUT_MIN_PAGES)
+            if large:
+                build_fanout(work_queue).start(pages, file_name)
+                return True
+        return chuck_document(pages, file_name, time_left)
+    finally:
+        # A reader left before its last page (failed or stopped ingestion) releases its S3 body or Textract fetcher
+        close = getattr(reader, "close", None)
+        if close:
+            close()
+
+
+def has_pages(pages, count):
+    """Returns (whether pages has at least count pages, the same pages), only the first count are read."""
+    pages = iter(pages)
+    first_pages = list(itertools.islice(pages, count))
+    return len(first_pages) == count, itertools.chain(first_pages, pages)
+
+
+def continue_in_new_invocation(event, context):
+    """
+    Re-invokes this function asynchronously with the same event, the ingestion
+    resumes from the checkpoints saved by chuck_document.
+    """
+    continuation = event.get("continuation", 0) + 1
+    if continuation > MAX_CONTINUATIONS:
+        print(f"❌ Giving up after {MAX_CONTINUATIONS} continuations")
+        return
+    print(f"⏭️ Continuing ingestion in a new invocation ({continuation}/{MAX_CONTINUATIONS})")
+    get_client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps({**event, "continuation": continuation})
+    )
 
-        chunk = text[position:end].strip()
-        ordered_pages.append(chunk)
-        position = end + 1  # move past the space
 
-    return ordered_pages
+def handle_text_file(bucket, key, page_char_limit=TEXT_PAGE_CHAR_LIMIT):
+    print(f"📄 Reading plain text file: s3://{bucket}/{key}")
+    response = get_client("s3").get_object(Bucket=bucket, Key=key)
+    # Pages are read and split as the ingestion consumes them, only the pages in flight are held
+    return iter_text_pages(response["Body"].iter_chunks(TEXT_READ_CHUNK_BYTES), page_char_limit)
 
 
 
 def start_textract_async(bucket, key):
     print(f"🚀 Starting Textract async job for: s3://{bucket}/{key}")
-    response = textract_client.start_document_text_detection(
+    response = get_client("textract").start_document_text_detection(
         DocumentLocation={"S3Object": {"Bucket": bucket, "Name": key}},
         NotificationChannel={
             "RoleArn": os.environ["TEXTRACT_ROLE_ARN"],  # Pass via Lambda env vars
@@ -90,27 +139,14 @@ def handle_textract_completion(message):
         return
 
     print(f"✅ Textract job {job_id} completed successfully. Retrieving results...")
-    pages = {}
-    next_token = None
 
-    while True:
+    def get_results(next_token):
         if next_token:
-            response = textract_client.get_document_text_detection(JobId=job_id, NextToken=next_token)
-        else:
-            response = textract_client.get_document_text_detection(JobId=job_id)
-
-        for block in response.get("Blocks", []):
-            if block["BlockType"] == "LINE":
-                page = block.get("Page", 1)
-                pages.setdefault(page, []).append(block["Text"])
-
-        next_token = response.get("NextToken")
-        if not next_token:
-            break
+            return get_client("textract").get_document_text_detection(JobId=job_id, NextToken=next_token)
+        return get_client("textract").get_document_text_detection(JobId=job_id)
 
-    ordered_pages = []
-    for page_num in sorted(pages.keys()):
-        page_text = "\n".join(pages[page_num])
-        ordered_pages.append(page_text)
+    # Result pages are fetched ahead while the previous ones are parsed, and each page is
+    # structured as soon as it is complete
+    ordered_pages = (page_text for _, page_text in iter_textract_pages(get_results))
 
     return ordered_pages, job_tag
@@ -0,0 +1,352 @@
+import os
+import threading
+from concurrent.futures import Future
+from pipeline import Pipeline, Stage, PIPELINE_QUEUE_SIZE
+from section_grouping import SectionGrouper
+from section_chunker import SectionChunker
+from ingestion_state import hash_section, hash_text
+from mongodb_tools import build_document_chunk
+
+
+# Sections embedded per VoyageAI request in the pipeline, small enough for the first chunks to be written early
+PIPELINE_EMBED_BATCH = int(os.environ.get("PIPELINE_EMBED_BATCH", "64"))
+
+# Characters of the first pages the document metadata is extracted from
+METADATA_HEAD_CHARACTERS = 10000
+
+
+class DocumentHead:
+    """First pages of a document as they are read, until METADATA_HEAD_CHARACTERS, and whether they are unchanged."""
+
+    def __init__(self, characters=METADATA_HEAD_CHARACTERS):
+        self.characters = characters
+        self.pages = []
+        self.size = 0
+        self.unchanged = True
+
+    @property
+    def complete(self):
+        return self.size > self.characters
+
+    def add(self, page_text, unchanged):
+        if not self.complete:
+            self.pages.append(page_text)
+            self.size += len(page_text)
+            self.unchanged = self.unchanged and unchanged
+        return self.complete
+
+
+class DocumentIngestion:
+    """
+    Indexes the pages of one document as a staged pipeline, the stages joined by bounded queues:
+
+        pages -> read (page hashes) -> structure (LLM, max_in_flight workers)
+              -> group (tag parse, sections, chunks) -> embed (batches of embed_batch)
+              -> write (bulk insert, checkpoint)
+
+    The sections are split and merged into chunks of a bounded size by chunker (a SectionChunker).
+
+    pages is any iterable of page texts (e.g. a reader streaming them from S3 or Textract): a page
+    is hashed when it is read and structured while the next ones are still being read, so the
+    document is never held in memory. Each page hash is compared with the one stored for the same
+    page when the file was last read (see PageHashTracker). When the file was completely indexed,
+    the pages are held back (as hashes) while they are unchanged, so an unchanged re-upload is only
+    read; the first changed page starts a new ingestion and releases them.
+
+    Pages already structured (same content) skip the LLM. Chunks already stored for the file
+    (same headings and text) are not embedded again, only their page is updated when pages were
+    inserted or removed before them; stored chunks that are no longer part of the document are
+    deleted once every page has been grouped. The metadata is given by get_metadata(), or
+    extracted by extract_metadata(document_head) from the first pages in a background thread once
+    they are read (unless they are unchanged and the metadata is known). It is only waited for by
+    the write stage, so the metadata extraction runs alongside the structuring.
+
+    structure(page_index, page_text) returns the page response (e.g. PageStructurer.structure),
+    embed(texts) the embeddings and writer is a mongodb_tools.ChunkWriter.
+
+    With page_hashes instead of pages, the pages are all structured already (the fan-out finalizer).
+    With partial=True, pages are the pages of a range starting at page index first_page (see
+    fanout). Only the chunks that cannot depend on the pages outside the range are written: the
+    sections before the range sets all its headings, the first one after that (it may continue the
+    previous range) and the last one are left to the full run that finalizes the document, which
+    writes them because their hashes are not stored yet. So are the chunks before the first
+    section that starts a chunk whatever the sections before it (see SectionChunker.restarted),
+    as merging depends on them.
+    """
+
+    def __init__(self, file_name, pages, state, structure, embed, writer, get_metadata=None, extract_metadata=None,
+                 should_stop=None, structure_workers=1, embed_batch=PIPELINE_EMBED_BATCH,
+                 queue_size=PIPELINE_QUEUE_SIZE, first_page=0, partial=False, chunker=None, page_hashes=None):
+        self.file_name = file_name
+        self.pages = pages
+        self.page_hashes = page_hashes
+        self.state = state
+        self.structure = structure
+        self.embed = embed
+        self.writer = writer
+        self.extract_metadata = extract_metadata
+        self.metadata = Future()
+        self.get_metadata = get_metadata or self.metadata.result
+        self.should_stop = should_stop
+        self.embed_batch = embed_batch
+        self.first_page = first_page
+        self.partial = partial
+
+        self.grouper = SectionGrouper(known_start=first_page == 0, track_pages=True)
+        self.chunker = chunker or SectionChunker()
+        # Whether the section before the next one has all its headings known (nothing before the first page)
+        self.previous_known = first_page == 0
+        # Index of the first section whose chunks are the same as in a run of the whole document
+        self.first_anchored_section = None if partial else 0
+        self.boundary_chunks = 0
+        # Full runs from the page texts compare them with the stored pages (see run)
+        self.tracker = None
+        self.held = None
+        self.unchanged = False
+        self.head = DocumentHead() if extract_metadata else None
+        self.metadata_started = False
+        self.page_count = 0
+        self.pending_pages = {}
+        self.grouped_page_hashes = {}
+        self.next_page = 0
+        self.section_count = 0
+        self.current_hashes = set()
+        self.content_counts = {}
+        self.stored_chunks = {}
+        self.stored_pages = {}
+        self.moved_chunks = []
+        self.stale_ids = []
+        self.skipped_pages = 0
+        self.failed_pages = 0
+        self.failed_chunks = 0
+        self.embed_buffer = []
+
+        self.pipeline = Pipeline([
+            Stage("read", self._read_page, finish=self._read_finish),
+            Stage("structure", self._structure_page, workers=structure_workers),
+            Stage("group", self._group_page, finish=self._group_finish),
+            Stage("embed", self._embed_section, finish=self._embed_flush),
+            Stage("write", self._write_batch)
+        ], queue_size=queue_size)
+
+    def _load_stored_chunks(self):
+        """Chunks already stored for this file, from a previous upload or from an interrupted run."""
+        collection = self.writer.collection
+        collection.create_index([("file_name", 1), ("chunk_hash", 1)])
+        for chunk in collection.find({"file_name": self.file_name}, {"chunk_hash": 1, "page": 1}):
+            if chunk.get("chunk_hash") and chunk["chunk_hash"] not in self.stored_chunks:
+                self.stored_chunks[chunk["chunk_hash"]] = chunk["_id"]
+                self.stored_pages[chunk["chunk_hash"]] = chunk.get("page")
+            else:
+                self.stale_ids.append(chunk["_id"])
+
+    def _read_page(self, page, emit):
+        i, page_text, page_hash = page
+        unchanged = False
+        if self.tracker:
+            page_hash, unchanged = self.tracker.add(page_text)
+        elif page_hash is None:
+            page_hash = hash_text(page_text)
+        self.page_count += 1
+        if self.head is not None and self.head.add(page_text, unchanged):
+            self._start_metadata()
+        if self.held is not None:
+            if unchanged:
+                self.held.append((i, page_hash))
+                return
+            self._release_held(emit)
+        emit((i, page_hash, page_text))
+
+    def _read_finish(self, emit):
+        if self.head is not None:
+            self._start_metadata()
+        if self.tracker is None:
+            return
+        if self.tracker.finish() and self.held is not None:
+            self.unchanged = True
+        elif self.held is not None:
+            self._release_held(emit)
+
+    def _release_held(self, emit):
+        """A page changed since the file was indexed: the pages held back are grouped with the others."""
+        print(f"{self.file_name} changed since it was indexed ({self.tracker.changed_pages} pages so far), indexing it again")
+        self.state.start()
+        self._load_stored_chunks()
+        held, self.held = self.held, None
+        for i, page_hash in held:
+            emit((i, page_hash, None))
+
+    def _start_metadata(self):
+        head, self.head = self.head, None
+        self.metadata_started = True
+        if head.unchanged and self.state.metadata:
+            self.metadata.set_result(self.state.metadata)
+            return
+
+        def extract():
+            try:
+                self.metadata.set_result(self.extract_metadata(head.pages))
+            except Exception as e:
+                self.metadata.set_exception(e)
+
+        threading.Thread(target=extract, daemon=True).start()
+
+    def _structure_page(self, page, emit):
+        i, page_hash, page_text = page
+        response = self.state.load_page(page_hash)
+        if response is not None:
+            emit((i, page_hash, response))
+            return
+        if page_text is None:
+            # Only the hash of the page is known (unchanged or finalizer pages), it should have been structured
+            self.failed_pages += 1
+            print(f"❌ Page {self.first_page + i + 1} of {self.file_name} is not structured")
+            return
+        if self.should_stop and self.should_stop():
+            self.skipped_pages += 1
+            return
+        response = self.structure(i, page_text)
+        if response.startswith("ERROR:"):
+            # Grouping stops at this page like at a skipped one, the next run structures it again
+            self.failed_pages += 1
+            print(f"❌ Page {self.first_page + i + 1} of {self.file_name} could not be structured: {response}")
+            return
+        self.state.save_page(page_hash, response)
+        emit((i, page_hash, response))
+
+    def _emit_section(self, section, emit):
+        index = self.chunker.sections_added
+        chunks = self.chunker.add(section)
+        if self.first_anchored_section is None:
+            known = None not in (section["H1"], section["H2"], section["H3"])
+            if known and self.previous_known and self.chunker.restarted:
+                self.first_anchored_section = index
+            self.previous_known = known
+        for chunk in chunks:
+            self._emit_chunk(chunk, emit)
+
+    def _emit_chunk(self, chunk, emit):
+        if self.first_anchored_section is None or chunk.pop("first_section") < self.first_anchored_section:
+            self.boundary_chunks += 1
+            return
+        content_hash = hash_section(chunk)
+        # Repeated chunks (e.g. the same warning on several pages) are told apart by their occurrence
+        occurrence = self.content_counts.get(content_hash, 0)
+        self.content_counts[content_hash] = occurrence + 1
+        chunk["chunk_hash"] = content_hash if occurrence == 0 else hash_text(f"{content_hash}:{occurrence}")
+        chunk["page_hash"] = self.grouped_page_hashes[int(chunk["page"])]
+        self.section_count += 1
+        self.current_hashes.add(chunk["chunk_hash"])
+        if chunk["chunk_hash"] not in self.stored_chunks:
+            emit(chunk)
+        elif self.stored_pages[chunk["chunk_hash"]] != chunk["page"]:
+            self.moved_chunks.append((self.stored_chunks[chunk["chunk_hash"]], chunk["page"], chunk["page_hash"]))
+
+    def _group_page(self, page, emit):
+        # Pages arrive in completion order, sections are grouped in page order
+        i, page_hash, response = page
+        self.pending_pages[i] = (page_hash, response)
+        while self.next_page in self.pending_pages:
+            page_number = self.first_page + self.next_page + 1
+            page_hash, response = self.pending_pages.pop(self.next_page)
+            self.grouped_page_hashes[page_number] = page_hash
+            for section in self.grouper.add_page(page_number, response):
+                self._emit_section(section, emit)
+            self.next_page += 1
+
+    def _group_finish(self, emit):
+        # The last section may continue on a page that was not structured yet (or in the next range)
+        if self.next_page == self.page_count and not self.partial and not self.unchanged:
+            for section in self.grouper.finish():
+                self._emit_section(section, emit)
+            for chunk in self.chunker.finish():
+                self._emit_chunk(chunk, emit)
+
+    def _embed_section(self, section, emit):
+        self.embed_buffer.append(section)
+        if len(self.embed_buffer) >= self.embed_batch:
+            self._embed_flush(emit)
+
+    def _embed_flush(self, emit):
+        if not self.embed_buffer:
+            return
+        batch, self.embed_buffer = self.embed_buffer, []
+        texts_to_embed = [f"{s['H1']} {s['H2']} {s['H3']} {s['text']}" for s in batch]
+        emit(list(zip(batch, self.embed(texts_to_embed))))
+
+    def _write_batch(self, batch, emit):
+        metadata = self.get_metadata()
+        failed_before = self.writer.totals()["failed"]
+        for section, embedding in batch:
+            chunk = build_document_chunk(self.file_name, section["page"], section["H1"], section["H2"], section["H3"], section["text"], embedding, metadata["doc_name"], metadata["doc_type"], metadata["doc_description"], metadata["manufacturer"], metadata["model"])
+            chunk["chunk_hash"] = section["chunk_hash"]
+            chunk["page_hash"] = section["page_hash"]
+            self.writer.add(chunk)
+        self.writer.flush()
+        # Chunks rejected by the bulk insert are embedded and written again by the next run
+        failed = self.writer.totals()["failed"] - failed_before
+        self.failed_chunks += failed
+        self.state.add_chunks_written(len(batch) - failed)
+        emit(len(batch) - failed)
+
+    def _update_moved_chunks(self):
+        """Points the stored chunks found on other pages than before to their new page, without embedding them again."""
+        if not self.moved_chunks:
+            return
+        from pymongo import UpdateOne
+        updates = [UpdateOne({"_id": chunk_id}, {"$set": {"page": page, "page_hash": page_hash}})
+                   for chunk_id, page, page_hash in self.moved_chunks]
+        self.writer.collection.bulk_write(updates, ordered=False)
+        print(f"Moved {len(updates)} unchanged chunks of {self.file_name} to their new page")
+
+    def run(self):
+        """
+        :return: True when the document is fully indexed (or unchanged, see self.unchanged), False
+                 when pages were left unstructured by should_stop() or by a failed LLM call, or when chunks
+                 failed to insert (the structured pages and the chunks written are kept for the next run,
+                 no stored chunk is deleted).
+        """
+        if self.page_hashes is not None:
+            items = ((i, None, page_hash) for i, page_hash in enumerate(self.page_hashes))
+        else:
+            items = ((i, page_text, None) for i, page_text in enumerate(self.pages))
+            if not self.partial:
+                self.tracker = self.state.track_pages()
+                if self.state.status == "completed":
+                    self.held = []
+                elif self.state.status == "in_progress":
+                    print(f"Resuming ingestion {self.state.ingestion_id} of {self.file_name}")
+                else:
+                    self.state.start()
+        if self.held is None:
+            self._load_stored_chunks()
+        written = sum(self.pipeline.run(items))
+        if self.metadata_started:
+            self.get_metadata()
+        if self.unchanged:
+            print(f"{self.file_name} is unchanged since it was indexed, skipping")
+            return True
+        print(f"Pipeline stages: {self.pipeline.stats()}")
+        print(f"Chunk sizes of {self.file_name} (estimated tokens): {self.chunker.stats()}")
+        self._update_moved_chunks()
+        if self.failed_chunks:
+            print(f"Stopping with {self.failed_chunks} chunks not written, {written} new chunks written")
+            return False
+        if self.next_page < self.page_count:
+            print(f"Stopping with pages left: {self.skipped_pages} skipped before timeout, {self.failed_pages} failed, {self.next_page}/{self.page_count} grouped, {written} new chunks written")
+            return False
+        if self.partial:
+            print(f"{self.file_name} pages {self.first_page + 1}-{self.first_page + self.page_count}: {self.section_count} chunks, {written} embedded, {self.boundary_chunks + 1} left for the finalizer")
+            return True
+
+        stale_ids = self.stale_ids + [chunk_id for chunk_hash, chunk_id in self.stored_chunks.items() if chunk_hash not in self.current_hashes]
+        print(f"{self.file_name}: {self.section_count} chunks, {written} embedded, {len(stale_ids)} stale")
+        collection = self.writer.collection
+        if stale_ids:
+            result = collection.delete_many({"_id": {"$in": stale_ids}})
+            print(f"Deleted {result.deleted_count} stale chunks of {self.file_name}")
+
+        # Unchanged chunks keep their vectors, only the document metadata may need refreshing
+        collection.update_many({"file_name": self.file_name}, {"$set": self.get_metadata()})
+        print(f"Chunks written for {self.file_name}: {self.writer.totals()}")
+        return True
@@ -0,0 +1,246 @@
+import time
+import uuid
+import hashlib
+
+
+INGESTION_DATABASE = "manufacturing_database"
+INGESTION_STATE_COLLECTION = "ingestion_state"
+INGESTION_PAGES_COLLECTION = "ingestion_pages"
+INGESTION_PAGE_HASHES_COLLECTION = "ingestion_page_hashes"
+
+# Changed page hashes written per bulk write while a document is read
+PAGE_HASH_BATCH = 500
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_section(section):
+    # The page is not part of the hash: a chunk moved by pages inserted or removed before it is not embedded again
+    return hash_text("\x1f".join([section["H1"], section["H2"], section["H3"], section["text"]]))
+
+
+class IngestionState:
+    """
+    Checkpoints of the ingestion of one file, so a timed out or crashed run can resume:
+
+    - ingestion_state: one document per file with the status, the page count, the
+      document metadata and how many chunks have already been embedded and written.
+    - ingestion_pages: the LLM response of every structured page, keyed by the page content
+      hash, so unchanged pages are not structured again when the file is re-uploaded.
+    - ingestion_page_hashes: the content hash of every page of the file as last read, one
+      record per page (those of a very large file would not fit in one document).
+
+    Any object with the pymongo collection API can be passed in (e.g. for local testing).
+    """
+
+    def __init__(self, file_name, state_collection=None, pages_collection=None, hashes_collection=None):
+        if state_collection is None or pages_collection is None or hashes_collection is None:
+            from resources import get_mongo_client
+            db = get_mongo_client()[INGESTION_DATABASE]
+            state_collection = db[INGESTION_STATE_COLLECTION]
+            pages_collection = db[INGESTION_PAGES_COLLECTION]
+            hashes_collection = db[INGESTION_PAGE_HASHES_COLLECTION]
+        self.file_name = file_name
+        self.state_collection = state_collection
+        self.pages_collection = pages_collection
+        self.hashes_collection = hashes_collection
+        self.state = state_collection.find_one({"file_name": file_name}) or {}
+
+    @property
+    def status(self):
+        return self.state.get("status")
+
+    @property
+    def metadata(self):
+        return self.state.get("metadata")
+
+    @property
+    def ingestion_id(self):
+        return self.state.get("ingestion_id")
+
+    @property
+    def page_count(self):
+        return self.state.get("page_count")
+
+    @property
+    def chunks_written(self):
+        return self.state.get("chunks_written", 0)
+
+    def _set(self, fields):
+        fields["updated_at"] = int(time.time())
+        self.state_collection.update_one({"file_name": self.file_name}, {"$set": fields}, upsert=True)
+        self.state.update(fields)
+
+    def start(self):
+        """
+        Starts a new ingestion of the file. The structured pages of previous ones are kept for reuse,
+        and so is the metadata: it is only extracted again when the first pages changed.
+        """
+        self.state = {"file_name": self.file_name, "metadata": self.metadata}
+        # Page hashes used to be an array in this document, they are kept per page now (16 MB document limit)
+        self.state_collection.update_one({"file_name": self.file_name}, {"$unset": {"page_hashes": ""}})
+        self._set({
+            "status": "in_progress",
+            "ingestion_id": str(uuid.uuid4()),
+            "page_count": None,
+            "chunks_written": 0,
+            "started_at": int(time.time())
+        })
+
+    def save_metadata(self, metadata):
+        self._set({"metadata": metadata})
+
+    def load_pages(self, page_hashes):
+        """Returns {page_index: response} for every page already structured with the same content."""
+        stored = {}
+        for page in self.pages_collection.find({"file_name": self.file_name, "page_hash": {"$in": list(set(page_hashes))}}):
+            stored[page["page_hash"]] = page["response"]
+        return {i: stored[page_hash] for i, page_hash in enumerate(page_hashes) if page_hash in stored}
+
+    def load_page(self, page_hash):
+        """Response of a page already structured with the same content, None otherwise."""
+        page = self.pages_collection.find_one({"file_name": self.file_name, "page_hash": page_hash}, {"response": 1})
+        return page["response"] if page else None
+
+    def all_structured(self, page_hashes):
+        unique = set(page_hashes)
+        return self.pages_collection.count_documents({"file_name": self.file_name, "page_hash": {"$in": list(unique)}}) >= len(unique)
+
+    def save_page(self, page_hash, response):
+        self.pages_collection.update_one(
+            {"file_name": self.file_name, "page_hash": page_hash},
+            {"$set": {"response": response}},
+            upsert=True
+        )
+
+    def save_chunks_written(self, chunks_written):
+        self._set({"chunks_written": chunks_written})
+
+    def add_chunks_written(self, count):
+        """Atomic increment, the workers of a fanned out ingestion write chunks concurrently."""
+        self.state_collection.update_one(
+            {"file_name": self.file_name},
+            {"$inc": {"chunks_written": count}, "$set": {"updated_at": int(time.time())}}
+        )
+        self.state["chunks_written"] = self.chunks_written + count
+
+    def track_pages(self):
+        return PageHashTracker(self)
+
+    def iter_page_hashes(self, page_count=None):
+        """(page_index, page_hash) of the pages of the file as last read, in page order."""
+        filter = {"file_name": self.file_name}
+        if page_count is not None:
+            filter["page_index"] = {"$lt": page_count}
+        for record in self.hashes_collection.find(filter, {"page_index": 1, "page_hash": 1}, sort=[("page_index", 1)]):
+            yield record["page_index"], record["page_hash"]
+
+    def save_page_hashes(self, page_hashes):
+        """Stores [(page_index, page_hash)] in place of the hashes previously read at those pages."""
+        from pymongo import UpdateOne
+        self.hashes_collection.bulk_write([
+            UpdateOne({"file_name": self.file_name, "page_index": page_index}, {"$set": {"page_hash": page_hash}}, upsert=True)
+            for page_index, page_hash in page_hashes
+        ], ordered=False)
+
+    def start_fanout(self, ranges_done):
+        """
+        Records the ranges a fanned out ingestion starts with already done. How many ranges it waits
+        for is only known once the whole document is read (see finish_ranges).
+        """
+        self._set({"ranges_total": None, "ranges_done": ranges_done, "finalizer": None})
+
+    def complete_range(self, range_index, worker_id):
+        """
+        Marks a page range as done (idempotent, work items can be delivered twice).
+        Returns True for exactly one worker_id once every range is done: that worker finalizes the
+        document. The same worker_id is accepted again, so a redelivered work item retries a failed finalization.
+        """
+        ingestion_id = self.ingestion_id
+        self.state_collection.update_one(
+            {"file_name": self.file_name, "ingestion_id": ingestion_id},
+            {"$addToSet": {"ranges_done": range_index}}
+        )
+        return self._claim_finalizer(ingestion_id, worker_id)
+
+    def finish_ranges(self, range_count, page_count, worker_id):
+        """
+        Records how many ranges (and pages) the document has once it is read. Returns True, like
+        complete_range, when every range is already done: the workers finished before it was known.
+        """
+        ingestion_id = self.ingestion_id
+        self.state_collection.update_one(
+            {"file_name": self.file_name, "ingestion_id": ingestion_id},
+            {"$set": {"ranges_total": range_count, "page_count": page_count}}
+        )
+        return self._claim_finalizer(ingestion_id, worker_id)
+
+    def _claim_finalizer(self, ingestion_id, worker_id):
+        self.state = self.state_collection.find_one({"file_name": self.file_name}) or {}
+        ranges_total = self.state.get("ranges_total")
+        if self.ingestion_id != ingestion_id or ranges_total is None or len(self.state.get("ranges_done", [])) < ranges_total:
+            return False
+        claimed = self.state_collection.update_one(
+            {"file_name": self.file_name, "ingestion_id": ingestion_id, "finalizer": {"$in": [None, worker_id]}},
+            {"$set": {"finalizer": worker_id}}
+        )
+        return claimed.matched_count == 1
+
+    def complete(self, page_count):
+        self._set({"status": "completed", "page_count": page_count})
+        self.hashes_collection.delete_many({"file_name": self.file_name, "page_index": {"$gte": page_count}})
+        # Only the pages still in the document are worth keeping for the next upload
+        page_hashes = {page_hash for _, page_hash in self.iter_page_hashes()}
+        stale_ids = [page["_id"] for page in self.pages_collection.find({"file_name": self.file_name}, {"page_hash": 1})
+                     if page["page_hash"] not in page_hashes]
+        if stale_ids:
+            self.pages_collection.delete_many({"_id": {"$in": stale_ids}})
+
+
+class PageHashTracker:
+    """
+    Hashes the pages of a document as they are read and compares each one with the hash stored
+    for the same page when the file was last read, so a re-upload is known to be unchanged without
+    holding its pages. Only the changed hashes are written, PAGE_HASH_BATCH at a time.
+    """
+
+    def __init__(self, state, batch=PAGE_HASH_BATCH):
+        self.state = state
+        self.batch = batch
+        state.hashes_collection.create_index([("file_name", 1), ("page_index", 1)])
+        self.stored = state.iter_page_hashes()
+        self.next_stored = next(self.stored, None)
+        self.page_count = 0
+        self.changed_pages = 0
+        self.changes = []
+
+    def _skip_stored(self, page_index):
+        while self.next_stored is not None and self.next_stored[0] < page_index:
+            self.next_stored = next(self.stored, None)
+
+    def add(self, page_text):
+        """:return: (page_hash, whether the page is the same as when the file was last read)."""
+        page_hash = hash_text(page_text)
+        page_index = self.page_count
+        self.page_count += 1
+        self._skip_stored(page_index)
+        if self.next_stored == (page_index, page_hash):
+            return page_hash, True
+        self.changed_pages += 1
+        self.changes.append((page_index, page_hash))
+        if len(self.changes) >= self.batch:
+            self.flush()
+        return page_hash, False
+
+    def flush(self):
+        if self.changes:
+            self.state.save_page_hashes(self.changes)
+            self.changes = []
+
+    def finish(self):
+        """Writes the remaining changes. :return: True when the file has the same pages as when it was last read."""
+        self.flush()
+        self._skip_stored(self.page_count)
+        return self.changed_pages == 0 and self.next_stored is None
@@ -0,0 +1,151 @@
+import os
+import time
+import hashlib
+import threading
+import datetime
+from collections import OrderedDict
+
+
+CACHE_DATABASE = "manufacturing_database"
+LLM_CACHE_COLLECTION = "llm_cache"
+
+DEFAULT_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_DAYS", "30")) * 24 * 3600
+DEFAULT_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "100000"))
+
+
+def cache_key(model_family, prompt):
+    return hashlib.sha256(f"{model_family}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class MemoryCacheStore:
+    """In-process store (least recently used entries are evicted first), for tests and local runs."""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry["response"]
+
+    def put(self, key, response, ttl_seconds):
+        with self._lock:
+            self.entries[key] = {"response": response, "expires_at": time.time() + ttl_seconds}
+            self.entries.move_to_end(key)
+
+    def evict(self, max_entries):
+        with self._lock:
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+
+class MongoCacheStore:
+    """
+    Stores responses in manufacturing_database.llm_cache. Expired entries are removed by a
+    TTL index on expires_at, the least recently used ones are deleted when above max_entries.
+    """
+
+    def __init__(self, collection=None):
+        self._collection = collection
+        self._indexes_ready = False
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from resources import get_mongo_client
+            self._collection = get_mongo_client()[CACHE_DATABASE][LLM_CACHE_COLLECTION]
+        if not self._indexes_ready:
+            self._collection.create_index("expires_at", expireAfterSeconds=0)
+            self._collection.create_index("last_used")
+            self._indexes_ready = True
+        return self._collection
+
+    def get(self, key):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        entry = self.collection.find_one_and_update(
+            {"_id": key, "expires_at": {"$gt": now}},
+            {"$set": {"last_used": now}},
+            projection={"response": 1}
+        )
+        return entry["response"] if entry else None
+
+    def put(self, key, response, ttl_seconds):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.collection.update_one(
+            {"_id": key},
+            {"$set": {"response": response, "last_used": now, "expires_at": now + datetime.timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+
+    def evict(self, max_entries):
+        excess = self.collection.estimated_document_count() - max_entries
+        if excess > 0:
+            oldest = self.collection.find({}, {"_id": 1}).sort("last_used", 1).limit(excess)
+            self.collection.delete_many({"_id": {"$in": [entry["_id"] for entry in oldest]}})
+
+
+class ResponseCache:
+    """
+    Caches deterministic LLM responses keyed by model family plus a hash of the prompt.
+    Error responses are never cached. Hits and misses are counted per container.
+    """
+
+    def __init__(self, store, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES, evict_every=100):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def get(self, model_family, prompt):
+        response = self.store.get(cache_key(model_family, prompt))
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, model_family, prompt, response):
+        if response.startswith("ERROR:"):
+            return
+        self.store.put(cache_key(model_family, prompt), response, self.ttl_seconds)
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self.store.evict(self.max_entries)
+
+    def wrap(self, invoke, model_family, is_valid=None):
+        """
+        Returns invoke(prompt) answering from the cache when possible. With is_valid(response),
+        only the responses it accepts are cached, and a stored one it rejects is asked again.
+        """
+        def cached_invoke(prompt):
+            response = self.get(model_family, prompt)
+            if response is not None and is_valid and not is_valid(response):
+                response = None
+            if response is None:
+                response = invoke(prompt)
+                if not is_valid or is_valid(response):
+                    self.put(model_family, prompt, response)
+            return response
+        return cached_invoke
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
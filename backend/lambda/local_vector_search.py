@@ -0,0 +1,199 @@
+import os
+import re
+import json
+from collections import Counter
+import numpy as np
+
+
+# Projection returned by search_chunks, the local index stores these fields per row
+CHUNK_FIELDS = ["_id", "file_name", "page", "text", "doc_name"]
+
+VECTORS_FILE = "vectors.f32"
+CHUNKS_FILE = "chunks.json"
+IVF_FILE = "ivf.npz"
+
+# Terms of the keyword search: error codes and part numbers (e.g. "srvo-062", "a05b-2600") are kept whole
+TERMS = re.compile(r"[a-z0-9][a-z0-9\-\.]*[a-z0-9]|[a-z0-9]")
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _terms(text):
+    return TERMS.findall((text or "").lower())
+
+
+def _kmeans(vectors, clusters, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(clusters):
+            members = vectors[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class LocalVectorIndex:
+    """
+    Local stand-in for the Atlas "vector_index" on documents_chunks.
+
+    Vectors are L2-normalized and stored as one contiguous float32 matrix that is
+    memory-mapped from disk, so cosine similarity is a single matrix-vector product.
+    The doc_name $in filter uses a precomputed doc_name -> rows index. With an IVF
+    partition (clusters > 0) only the rows of the nprobe closest clusters are scored.
+
+    text_search() stands in for the Atlas "text_index", so the hybrid search also runs without Atlas.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, CHUNKS_FILE)) as f:
+            self.chunks = json.load(f)
+        self.vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode="r").reshape(len(self.chunks), -1)
+
+        doc_rows = {}
+        for row, chunk in enumerate(self.chunks):
+            doc_rows.setdefault(chunk["doc_name"], []).append(row)
+        self.doc_rows = {doc_name: np.array(rows, dtype=np.int64) for doc_name, rows in doc_rows.items()}
+
+        self.centroids = None
+        self.cluster_rows = []
+        ivf_path = os.path.join(path, IVF_FILE)
+        if os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            self.centroids = ivf["centroids"]
+            assignments = ivf["assignments"]
+            self.cluster_rows = [np.flatnonzero(assignments == c) for c in range(len(self.centroids))]
+
+        # Inverted index of the keyword search, built on its first use
+        self.postings = None
+        self.lengths = None
+
+    @staticmethod
+    def build(path, chunks, vectors, clusters=0):
+        """
+        Writes an index to `path`.
+
+        :param chunks: list of chunk dicts (only CHUNK_FIELDS are kept).
+        :param vectors: list or array of embeddings, aligned with chunks.
+        :param clusters: number of IVF clusters, 0 for exact search only.
+        """
+        os.makedirs(path, exist_ok=True)
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+        matrix.tofile(os.path.join(path, VECTORS_FILE))
+        with open(os.path.join(path, CHUNKS_FILE), "w") as f:
+            json.dump([{field: str(chunk.get(field, "")) for field in CHUNK_FIELDS} for chunk in chunks], f)
+        if clusters:
+            centroids, assignments = _kmeans(matrix, min(clusters, len(matrix)))
+            np.savez(os.path.join(path, IVF_FILE), centroids=centroids, assignments=assignments)
+        return LocalVectorIndex(path)
+
+    def _candidate_rows(self, query, doc_list, nprobe):
+        rows = None
+        if doc_list:
+            selected = [self.doc_rows[doc_name] for doc_name in doc_list if doc_name in self.doc_rows]
+            rows = np.unique(np.concatenate(selected)) if selected else np.array([], dtype=np.int64)
+        if self.centroids is not None and nprobe:
+            closest = np.argsort(-(self.centroids @ query))[:nprobe]
+            probed = np.concatenate([self.cluster_rows[c] for c in closest])
+            rows = probed if rows is None else np.intersect1d(rows, probed, assume_unique=True)
+        return rows
+
+    def search(self, search_embedding, doc_list, limit, nprobe=None):
+        """
+        Top-k chunks by cosine similarity, optionally restricted to doc_list.
+        nprobe=None scores every row (exact), otherwise only the nprobe closest IVF clusters.
+        """
+        query = _normalize(np.asarray(search_embedding, dtype=np.float32))
+        rows = self._candidate_rows(query, doc_list, nprobe)
+        scores = self.vectors @ query if rows is None else self.vectors[rows] @ query
+        if len(scores) == 0:
+            return []
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            row = int(i) if rows is None else int(rows[i])
+            results.append({**self.chunks[row], "score": float(scores[i])})
+        return results
+
+
+    def _build_postings(self):
+        postings = {}
+        lengths = np.zeros(len(self.chunks), dtype=np.float32)
+        for row, chunk in enumerate(self.chunks):
+            terms = _terms(chunk["text"])
+            lengths[row] = len(terms)
+            for term, count in Counter(terms).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(count)
+        self.lengths = lengths
+        self.postings = {term: (np.array(rows, dtype=np.int64), np.array(counts, dtype=np.float32))
+                         for term, (rows, counts) in postings.items()}
+
+    def text_search(self, search_text, doc_list, limit, k1=1.2, b=0.75):
+        """
+        Top-k chunks by BM25 over their text, optionally restricted to doc_list. Chunks containing
+        the exact phrase are boosted, like the phrase clause of mongodb_tools.text_search_chunks.
+        """
+        if self.postings is None:
+            self._build_postings()
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        average_length = max(float(self.lengths.mean()), 1.0) if len(self.lengths) else 1.0
+        for term in set(_terms(search_text)):
+            if term not in self.postings:
+                continue
+            rows, counts = self.postings[term]
+            idf = np.log(1 + (len(self.chunks) - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * counts * (k1 + 1) / (counts + k1 * (1 - b + b * self.lengths[rows] / average_length))
+
+        rows = np.flatnonzero(scores)
+        if doc_list:
+            rows = np.intersect1d(rows, self._candidate_rows(None, doc_list, None), assume_unique=True)
+        phrase = " ".join((search_text or "").lower().split())
+        for row in rows:
+            if phrase and phrase in " ".join(self.chunks[row]["text"].lower().split()):
+                # Text clause plus the phrase clause boosted 3 times
+                scores[row] *= 4
+
+        top = rows[np.argsort(-scores[rows], kind="stable")][:limit]
+        return [{**self.chunks[int(row)], "score": float(scores[row])} for row in top]
+
+
+def export_from_mongo(collection, path, clusters=0, batch_size=1000):
+    """Builds a local index from the chunks stored in MongoDB (e.g. for offline benchmarks)."""
+    from vector_codec import decode_vector
+    chunks, vectors = [], []
+    for chunk in collection.find({}, {**{field: 1 for field in CHUNK_FIELDS}, "vector": 1}).batch_size(batch_size):
+        chunks.append(chunk)
+        vectors.append(decode_vector(chunk["vector"]))
+    return LocalVectorIndex.build(path, chunks, vectors, clusters)
+
+
+_index = None
+
+
+def get_local_index():
+    global _index
+    if _index is None:
+        _index = LocalVectorIndex(os.environ["LOCAL_VECTOR_INDEX_PATH"])
+    return _index
+
+
+def search_chunks(search_embedding, doc_list, limit):
+    """Same contract as mongodb_tools.vector_search_chunks, served from the index at LOCAL_VECTOR_INDEX_PATH."""
+    nprobe = os.environ.get("LOCAL_VECTOR_NPROBE")
+    return get_local_index().search(search_embedding, doc_list, limit, int(nprobe) if nprobe else None)
+
+
+def text_search_chunks(search_text, doc_list, limit):
+    """Same contract as mongodb_tools.text_search_chunks, served from the index at LOCAL_VECTOR_INDEX_PATH."""
+    return get_local_index().text_search(search_text, doc_list, limit)
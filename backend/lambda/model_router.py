@@ -0,0 +1,188 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+
+
+# Failures in a row that open a model's circuit, and how long it stays open (doubled on every re-open)
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_OPEN_SECONDS = 30.0
+CIRCUIT_MAX_OPEN_SECONDS = 300.0
+
+# Throttles older than this no longer count against a model
+THROTTLE_WINDOW_SECONDS = 60.0
+# Score added per recent throttle, in seconds of expected latency
+THROTTLE_PENALTY_SECONDS = 5.0
+
+EWMA_ALPHA = 0.2
+
+# Cross-region inference profile prefix of each region group
+INFERENCE_PROFILE_PREFIXES = {"us": "us.", "eu": "eu.", "ap": "apac."}
+
+THROTTLE_MARKERS = ("throttling", "too many requests", "rate exceeded")
+TRANSIENT_MARKERS = (
+    "serviceunavailable", "modelnotready", "internalserver", "modeltimeout",
+    "modelstreamerror", "read timeout", "endpointconnectionerror", "connection was closed"
+)
+
+
+def classify_error(error):
+    """'throttled' and 'transient' errors are worth another model, 'fatal' ones (bad request, access) are not."""
+    message = str(error).lower()
+    if any(marker in message for marker in THROTTLE_MARKERS):
+        return "throttled"
+    if any(marker in message for marker in TRANSIENT_MARKERS):
+        return "transient"
+    return "fatal"
+
+
+def inference_profile_ids(model_ids, region_name=None):
+    """
+    Points cross-region inference profile ids ("us.anthropic...") at the region group
+    of the Lambda (eu-west-1 -> "eu.anthropic..."). Other ids are returned unchanged.
+    """
+    region_name = region_name or os.environ.get("AWS_REGION", "us-west-2")
+    prefix = INFERENCE_PROFILE_PREFIXES.get(region_name.split("-")[0], "us.")
+    profile_ids = []
+    for model_id in model_ids:
+        group = model_id.split(".")[0] + "."
+        profile_ids.append(prefix + model_id[len(group):] if group in INFERENCE_PROFILE_PREFIXES.values() else model_id)
+    return profile_ids
+
+
+class PartialResponseError(Exception):
+    """
+    Raised by a call that failed after part of its response was already relayed (streaming):
+    the failure counts against the model, but no other model can take over.
+    """
+
+
+class ModelHealth:
+    """Recent behaviour of one model in this container."""
+
+    def __init__(self, model_id):
+        self.model_id = model_id
+        self.latency = None
+        self.failure_rate = 0.0
+        self.throttle_times = deque()
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+        self.calls = 0
+        self.throttles = 0
+        self.errors = 0
+
+    def recent_throttles(self, now):
+        while self.throttle_times and now - self.throttle_times[0] > THROTTLE_WINDOW_SECONDS:
+            self.throttle_times.popleft()
+        return len(self.throttle_times)
+
+    def score(self, now, default_latency):
+        """Expected cost of a call, lower is healthier. Models never used yet get the average latency."""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (1 + 4 * self.failure_rate) + THROTTLE_PENALTY_SECONDS * self.recent_throttles(now)
+
+    def record_success(self, latency):
+        self.calls += 1
+        self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+        self.failure_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+
+    def record_failure(self, now, throttled):
+        self.calls += 1
+        if throttled:
+            self.throttles += 1
+            self.throttle_times.append(now)
+        else:
+            self.errors += 1
+        self.failure_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.failure_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            # Opened again after the trial call of a half-open circuit failed: wait longer
+            if self.open_until:
+                self.open_seconds = min(2 * self.open_seconds, CIRCUIT_MAX_OPEN_SECONDS)
+            self.open_until = now + self.open_seconds
+            self.consecutive_failures = CIRCUIT_FAILURE_THRESHOLD - 1
+            print(f"⚡ Circuit open for {self.model_id} ({self.open_seconds:.0f} s)")
+
+
+class ModelRouter:
+    """
+    Chooses which of several interchangeable models serves each call. Models are tried from
+    the healthiest (EWMA latency, weighted by the recent failure rate and throttles); a model
+    with CIRCUIT_FAILURE_THRESHOLD failures in a row is skipped until its circuit closes.
+    When every model failed, the round is retried after a jittered exponential backoff.
+    """
+
+    def __init__(self, model_ids, max_rounds=2, base_backoff=0.5, clock=time.monotonic, sleep=time.sleep, rng=None):
+        self.models = {model_id: ModelHealth(model_id) for model_id in model_ids}
+        self.max_rounds = max_rounds
+        self.base_backoff = base_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        """Models to try, healthiest first. Models with an open circuit are left out unless all are open."""
+        with self._lock:
+            now = self.clock()
+            known = [health.latency for health in self.models.values() if health.latency is not None]
+            default_latency = sum(known) / len(known) if known else 0.0
+            # Models never called yet come first, so each gets a latency measurement.
+            # Random tie-break, so containers without history do not all start with the same model
+            order = sorted(self.models.values(), key=lambda health: (health.calls > 0, health.score(now, default_latency), self.rng.random()))
+            closed = [health.model_id for health in order if health.open_until <= now]
+            if closed:
+                return closed
+            return [min(order, key=lambda health: health.open_until).model_id]
+
+    def invoke(self, call):
+        """
+        Returns call(model_id) from the first model that succeeds. call raises on errors;
+        fatal errors are returned right away as "ERROR: ..." text, like invoke_claude_x always did,
+        and so is a PartialResponseError after it is recorded as a failure of the model.
+        """
+        for attempt in range(self.max_rounds):
+            if attempt:
+                backoff = self.base_backoff * 2 ** (attempt - 1)
+                self.sleep(backoff * self.rng.uniform(0.5, 1.5))
+            for model_id in self.ranked():
+                start = self.clock()
+                try:
+                    response = call(model_id)
+                except PartialResponseError as e:
+                    with self._lock:
+                        self.models[model_id].record_failure(self.clock(), classify_error(e) == "throttled")
+                    print(f"ERROR: Response of model {model_id} interrupted. Reason: {str(e)}")
+                    return f"ERROR: {str(e)}"
+                except Exception as e:
+                    kind = classify_error(e)
+                    if kind == "fatal":
+                        print(f"ERROR: Unable to invoke model {model_id}. Reason: {str(e)}")
+                        return f"ERROR: {str(e)}"
+                    with self._lock:
+                        self.models[model_id].record_failure(self.clock(), kind == "throttled")
+                    print(f"Model {model_id} {kind}. Trying next model.")
+                    continue
+                with self._lock:
+                    self.models[model_id].record_success(self.clock() - start)
+                return response
+        return "ERROR: All models throttled or unavailable."
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            return {
+                model_id: {
+                    "calls": health.calls,
+                    "throttles": health.throttles,
+                    "errors": health.errors,
+                    "latency": round(health.latency, 3) if health.latency is not None else None,
+                    "circuit_open": health.open_until > now
+                }
+                for model_id, health in self.models.items()
+            }
@@ -1,75 +1,132 @@
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+from pymongo.errors import BulkWriteError, OperationFailure
+import bson
 import time
+from concurrent.futures import ThreadPoolExecutor
+from rank_fusion import reciprocal_rank_fusion
+from vector_codec import encode_vector, VECTOR_STORAGE
+from resources import get_mongo_client
 import os
-import json
-import boto3
 
 
-# Get secret name from environment variable
-secret_name = os.environ["SECRET_NAME"]
-region_name = os.environ.get("AWS_REGION", "us-west-2")  # fallback default
-
-# Create a Secrets Manager client
-session = boto3.session.Session()
-client = session.client(service_name="secretsmanager", region_name=region_name)
-
-# Retrieve secret value
-get_secret_value_response = client.get_secret_value(SecretId=secret_name)
-secrets = json.loads(get_secret_value_response["SecretString"])
-
-# Now you can access keys inside the secret
-voyage_api_key = secrets["VOYAGE_API_KEY"]
-uri = secrets["MONGODB_URI"]
-
-
-
-client = MongoClient(uri, server_api=ServerApi('1'))
-    
-
-# MongoDB connection helper function
-def insert_document_chunk_to_mongo(file_name, page, H1, H2, H3, text, embedding, doc_name, doc_type, doc_description, manufacturer, model):
-
-    database_name = "manufacturing_database"
-    document_chunks_collection = "documents_chunks"
-
-    db = client[database_name]  # Your database name
-    collection = db[document_chunks_collection]  # Your collection name
-    
-    # Prepare the document to be inserted
-    document = {
+def build_document_chunk(file_name, page, H1, H2, H3, text, embedding, doc_name, doc_type, doc_description, manufacturer, model):
+    return {
         "file_name": file_name,
         "page": page,
         "H1": H1,
         "H2": H2,
         "H3": H3,
         "text": text,
-        "vector": embedding,
+        "vector": encode_vector(embedding),
+        "vector_storage": VECTOR_STORAGE,
         "doc_name": doc_name,
         "doc_type": doc_type,
         "doc_description": doc_description,
         "manufacturer": manufacturer,
         "model": model
     }
-    # Insert the document into MongoDB
-    result = collection.insert_one(document)
-    print(f"Inserted document with ID: {result.inserted_id}")
 
 
+class ChunkWriter:
+    """
+    Buffers document chunks and writes them with insert_many(ordered=False), flushing
+    whenever the buffer reaches max_docs documents or max_bytes of BSON.
+    Each flush prints and records a summary (inserted, failed, latency).
+    """
+
+    def __init__(self, collection=None, max_docs=500, max_bytes=8 * 1024 * 1024):
+        if collection is None:
+            collection = get_mongo_client()["manufacturing_database"]["documents_chunks"]
+        self.collection = collection
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.flushes = []
+
+    def add(self, document):
+        self.buffer.append(document)
+        self.buffer_bytes += len(bson.encode(document))
+        if len(self.buffer) >= self.max_docs or self.buffer_bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return None
+
+        documents = self.buffer
+        size_bytes = self.buffer_bytes
+        self.buffer = []
+        self.buffer_bytes = 0
+
+        start = time.perf_counter()
+        errors = []
+        try:
+            result = self.collection.insert_many(documents, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # With ordered=False every document is attempted, only the failed ones are reported
+            inserted = e.details.get("nInserted", 0)
+            errors = [error.get("errmsg", "") for error in e.details.get("writeErrors", [])]
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        summary = {
+            "documents": len(documents),
+            "inserted": inserted,
+            "failed": len(documents) - inserted,
+            "bytes": size_bytes,
+            "latency_ms": round(latency_ms, 1)
+        }
+        self.flushes.append(summary)
+        print(f"Flushed {summary['documents']} chunks ({size_bytes / 1024:.0f} KB): {inserted} inserted, {summary['failed']} failed in {latency_ms:.0f} ms")
+        for error in errors[:5]:
+            print(f"  insert error: {error}")
+        return summary
+
+    def totals(self):
+        return {
+            "flushes": len(self.flushes),
+            "inserted": sum(f["inserted"] for f in self.flushes),
+            "failed": sum(f["failed"] for f in self.flushes),
+            "latency_ms": round(sum(f["latency_ms"] for f in self.flushes), 1)
+        }
+
+
+
+# Hybrid search defaults, the weights apply to each result list in the rank fusion
+HYBRID_VECTOR_WEIGHT = float(os.environ.get("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_TEXT_WEIGHT = float(os.environ.get("HYBRID_TEXT_WEIGHT", "1.0"))
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))
+
+# "atlas" uses $vectorSearch and $search, "local" the NumPy index at LOCAL_VECTOR_INDEX_PATH for both
+# (see local_vector_search). With LOCAL_VECTOR_INDEX_PATH set, the local index is also the fallback when $vectorSearch fails.
+VECTOR_SEARCH_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "atlas")
+
+CHUNK_SEARCH_PROJECTION = {
+    "_id": 1,
+    "file_name": 1,
+    "page": 1,
+    "text": 1,
+    "doc_name": 1
+}
+
+
+def vector_search_chunks(search_embedding, doc_list, limit, num_candidates=100):
+    if VECTOR_SEARCH_BACKEND == "local":
+        import local_vector_search
+        return local_vector_search.search_chunks(search_embedding, doc_list, limit)
 
-def search_chunks(search_embedding, doc_list, limit):
     database_name = "manufacturing_database"
     document_chunks_collection = "documents_chunks"
 
-    db = client[database_name]
+    db = get_mongo_client()[database_name]
     collection = db[document_chunks_collection]
 
     # Step 2: Build the vector search stage
     vector_search_stage = {
         "$vectorSearch": {
-            "queryVector": search_embedding,
+            "queryVector": encode_vector(search_embedding),
             "path": "vector",
-            "numCandidates": 100,
+            "numCandidates": max(num_candidates, limit),
             "limit": limit,
             "index": "vector_index"
         }
@@ -86,43 +143,137 @@ def search_chunks(search_embedding, doc_list, limit):
         vector_search_stage,
         {
             "$project": {
-                "_id": 1,
-                "file_name": 1,
-                "page": 1,
-                "text": 1,
-                "doc_name": 1,
+                **CHUNK_SEARCH_PROJECTION,
                 "score": {"$meta": "vectorSearchScore"}
             }
         }
     ]
 
     # Step 5: Execute the query
-    results = list(collection.aggregate(pipeline))
+    try:
+        results = list(collection.aggregate(pipeline))
+    except OperationFailure as e:
+        if not os.environ.get("LOCAL_VECTOR_INDEX_PATH"):
+            raise
+        print(f"Vector search failed ({e}), using the local vector index")
+        import local_vector_search
+        results = local_vector_search.search_chunks(search_embedding, doc_list, limit)
     return results
 
 
+def text_search_chunks(search_text, doc_list, limit):
+    """
+    Full-text search over the chunks. Requires an Atlas Search index named "text_index" on
+    documents_chunks with text, H1, H2, H3 as string fields and doc_name as a token field.
+    The exact phrase is boosted, so part numbers and error codes (e.g. "SRVO-062") rank first.
+    """
+    if VECTOR_SEARCH_BACKEND == "local":
+        import local_vector_search
+        return local_vector_search.text_search_chunks(search_text, doc_list, limit)
 
-def get_all_documents():
     database_name = "manufacturing_database"
-    document_collection = "documents"
+    document_chunks_collection = "documents_chunks"
+
+    db = get_mongo_client()[database_name]
+    collection = db[document_chunks_collection]
+
+    paths = ["text", "H1", "H2", "H3"]
+    compound = {
+        "should": [
+            {"text": {"query": search_text, "path": paths}},
+            {"phrase": {"query": search_text, "path": paths, "score": {"boost": {"value": 3}}}}
+        ],
+        "minimumShouldMatch": 1
+    }
+    if doc_list:
+        compound["filter"] = [{"in": {"path": "doc_name", "value": doc_list}}]
+
+    pipeline = [
+        {"$search": {"index": "text_index", "compound": compound}},
+        {"$limit": limit},
+        {
+            "$project": {
+                **CHUNK_SEARCH_PROJECTION,
+                "score": {"$meta": "searchScore"}
+            }
+        }
+    ]
+    return list(collection.aggregate(pipeline))
+
+
+def search_chunks(search_embedding, doc_list, limit, search_text=None, vector_weight=HYBRID_VECTOR_WEIGHT, text_weight=HYBRID_TEXT_WEIGHT, candidates=HYBRID_CANDIDATES, num_candidates=100):
+    """
+    Searches the document chunks, optionally restricted to the documents in doc_list.
+
+    Without search_text it is a pure vector search. With search_text the vector and full-text
+    searches run in parallel, each returning `candidates` results, and are fused with weighted
+    reciprocal rank fusion before keeping the best `limit` results.
+    """
+    if not search_text:
+        return vector_search_chunks(search_embedding, doc_list, limit, num_candidates)
+
+    candidates = max(candidates, limit)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        vector_results = executor.submit(vector_search_chunks, search_embedding, doc_list, candidates, num_candidates)
+        text_results = executor.submit(text_search_chunks, search_text, doc_list, candidates)
+        ranked_lists = [vector_results.result(), text_results.result()]
 
-    db = client[database_name]
-    collection = db[document_collection]
+    return reciprocal_rank_fusion(ranked_lists, [vector_weight, text_weight])[:limit]
 
-    # Retrieve all documents
-    documents = list(collection.find())
 
-    #print(f"Retrieved {len(documents)} documents.")
-    return documents
+
+# Fields of the documents collection needed to describe the catalog to the agent
+CATALOG_FIELDS = {"_id": 0, "doc_name": 1, "manufacturer": 1, "model": 1, "doc_description": 1}
+
+
+def get_catalog_documents():
+    db = get_mongo_client()["manufacturing_database"]
+    collection = db["documents"]
+    return list(collection.find({}, CATALOG_FIELDS))
+
+
+def search_catalog(query_vector, limit):
+    """
+    Vector search over the description embeddings of the documents collection.
+    Requires an Atlas Vector Search index named "catalog_vector_index" on the
+    "description_vector" path (1024 dimensions, cosine).
+    """
+    db = get_mongo_client()["manufacturing_database"]
+    collection = db["documents"]
+    pipeline = [
+        {
+            "$vectorSearch": {
+                "queryVector": query_vector,
+                "path": "description_vector",
+                "numCandidates": limit * 10,
+                "limit": limit,
+                "index": "catalog_vector_index"
+            }
+        },
+        {"$project": {"_id": 0, "doc_name": 1, "score": {"$meta": "vectorSearchScore"}}}
+    ]
+    return list(collection.aggregate(pipeline))
+
+
+def get_catalog_version():
+    db = get_mongo_client()["manufacturing_database"]
+    meta = db["catalog_meta"].find_one({"_id": "documents"})
+    return meta["version"] if meta else 0
+
+
+def bump_catalog_version():
+    # Invalidates the catalog cached by every process_message container
+    db = get_mongo_client()["manufacturing_database"]
+    db["catalog_meta"].update_one({"_id": "documents"}, {"$inc": {"version": 1}}, upsert=True)
 
 
 # MongoDB connection helper function
-def insert_document_to_mongo(file_name, doc_name, doc_type, doc_description, manufacturer, model):
+def insert_document_to_mongo(file_name, doc_name, doc_type, doc_description, manufacturer, model, description_vector=None):
 
     database_name = "manufacturing_database"
     document_collection = "documents"
 
-    db = client[database_name]  # Your database name
+    db = get_mongo_client()[database_name]  # Your database name
     collection = db[document_collection]  # Your collection name
     
     # Prepare the document to be inserted
@@ -132,23 +283,43 @@ def insert_document_to_mongo(file_name, doc_name, doc_type, doc_description, man
         "doc_type": doc_type,
         "doc_description": doc_description,
         "manufacturer": manufacturer,
-        "model": model
+        "model": model,
+        "description_vector": description_vector
     }
 
-    # Insert the document into MongoDB
-    result = collection.insert_one(document)
-    print(f"Inserted document with ID: {result.inserted_id}")
+    # Insert the document into MongoDB, or replace it when the same file is re-uploaded
+    # Page hashes are kept one record per page (see ingestion_state), older entries drop theirs
+    result = collection.update_one(
+        {"file_name": file_name},
+        {"$set": document, "$unset": {"file_hash": "", "page_hashes": ""}},
+        upsert=True
+    )
+    if result.upserted_id:
+        print(f"Inserted document with ID: {result.upserted_id}")
+    else:
+        print(f"Updated document {file_name}")
+    bump_catalog_version()
 
 
 
-def insert_update_request(user_id, request_id, update_text, completed = False):
-    database_name = "chatbot"
-    collection_name = "user_requests"
+_user_requests_indexed = False
 
-    db = client[database_name]
-    collection = db[collection_name]
 
-    current_time = int(time.time())
+def get_user_requests_collection():
+    global _user_requests_indexed
+    collection = get_mongo_client()["chatbot"]["user_requests"]
+    if not _user_requests_indexed:
+        # Every write and poll looks up a single request
+        collection.create_index([("user_id", 1), ("request_id", 1)], unique=True)
+        _user_requests_indexed = True
+    return collection
+
+
+def insert_update_request(user_id, request_id, update_text, completed = False):
+    collection = get_user_requests_collection()
+
+    # Sub-second time stamps, GET reads the updates after the last one it has seen
+    current_time = time.time()
 
     result = collection.update_one(
         {"user_id": user_id, "request_id": request_id},
@@ -170,3 +341,43 @@ def insert_update_request(user_id, request_id, update_text, completed = False):
         print(f"Created new document with ID: {result.upserted_id}")
     else:
         print("Appended update to existing document.")
+
+
+def save_request_input(user_id, request_id, user_request, history):
+    # Read back by the asynchronous invocation, an invocation payload is limited to 256 KB
+    get_user_requests_collection().update_one(
+        {"user_id": user_id, "request_id": request_id},
+        {"$set": {"request": user_request, "history": history}},
+        upsert=True
+    )
+
+
+def get_request_input(user_id, request_id):
+    """Returns the request document with the user request and history saved by save_request_input."""
+    return get_user_requests_collection().find_one(
+        {"user_id": user_id, "request_id": request_id},
+        {"_id": 0, "request": 1, "history": 1}
+    )
+
+
+def set_partial_answer(user_id, request_id, partial_answer):
+    # Overwritten while the answer streams, the UI polls it with GET /user/message
+    get_user_requests_collection().update_one(
+        {"user_id": user_id, "request_id": request_id},
+        {"$set": {"partial_answer": partial_answer, "partial_time_stamp": time.time()}},
+        upsert=True
+    )
+
+
+def get_request(user_id, request_id, since=None):
+    """Returns the request document (without its input), with only the updates newer than `since` when given."""
+    projection = {"_id": 0, "request": 0, "history": 0}
+    if since is not None:
+        projection = {
+            "_id": 0,
+            "completed": 1,
+            "partial_answer": 1,
+            "partial_time_stamp": 1,
+            "updates": {"$filter": {"input": "$updates", "cond": {"$gt": ["$$this.time_stamp", since]}}}
+        }
+    return get_user_requests_collection().find_one({"user_id": user_id, "request_id": request_id}, projection)
@@ -0,0 +1,131 @@
+import os
+import time
+import random
+import threading
+
+
+# Maximum number of pages sent to Bedrock at the same time (can be tuned per Lambda)
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("STRUCTURE_MAX_IN_FLIGHT", "8"))
+
+
+def build_structure_prompt(page_text):
+    return f"""
+        <CURRENT_PAGE>
+        {page_text}
+        </CURRENT_PAGE>
+
+
+        TASK
+        ----
+        You are processing a large OCR extracted document, the objective is to organize the document into relevant sections focusing on the current page provided in tags <CURRENT_PAGE>, following these rules:
+
+        RULES
+        -----
+        - if you identify a Main Heading, write it verbatim in tags <H1></H1>
+        - if you identify a Section Heading, write it verbatim in tags <H2></H2>
+        - if you identify a Sub-Section Heading, write it verbatim in tags <H3></H3>
+        - if you identify any body text or block of text, write it verbatim in tags <BODY></BODY>
+        - All the content in tags <CURRENT_PAGE> must be included in your output.
+        - In your output, the only allowed tags you can write are <H1></H1>, <H2></H2>, <H3></H3> and <BODY></BODY>.
+        - Excludde any character/text that it is obviously invalid (any OCR extraction inconsistentcy).
+        """
+
+
+def build_structure_tool_prompt(page_text):
+    return f"""
+        <CURRENT_PAGE>
+        {page_text}
+        </CURRENT_PAGE>
+
+
+        TASK
+        ----
+        You are processing a large OCR extracted document, the objective is to organize the document into relevant sections focusing on the current page provided in tags <CURRENT_PAGE>, following these rules:
+
+        RULES
+        -----
+        - Answer by calling the structure_page tool, with one element per heading or block of text, in page order
+        - if you identify a Main Heading, write it verbatim in an element of type H1
+        - if you identify a Section Heading, write it verbatim in an element of type H2
+        - if you identify a Sub-Section Heading, write it verbatim in an element of type H3
+        - if you identify any body text or block of text, write it verbatim in an element of type BODY
+        - All the content in tags <CURRENT_PAGE> must be included in your output.
+        - Excludde any character/text that it is obviously invalid (any OCR extraction inconsistentcy).
+        """
+
+
+def is_throttled(response):
+    # invoke_claude_x reports errors as text, throttling is the only one worth retrying
+    return response.startswith("ERROR:") and ("ThrottlingException" in response or "throttled" in response)
+
+
+class AdaptiveLimiter:
+    """
+    Bounds the number of in-flight Bedrock calls. The allowed concurrency is halved
+    every time a call is throttled and grows back by one after a run of successful calls
+    (additive increase / multiplicative decrease).
+    """
+
+    def __init__(self, max_in_flight, min_in_flight=1, increase_after=5):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.increase_after = increase_after
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.throttles = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self.limit = max(self.min_in_flight, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after and self.limit < self.max_in_flight:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+class PageStructurer:
+    """
+    Structures single pages through the LLM, sharing one AdaptiveLimiter between all the threads
+    that call structure(). Throttled calls are retried with a jittered exponential backoff.
+    """
+
+    def __init__(self, invoke, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_retries=5, base_backoff=1.0, build_prompt=build_structure_prompt):
+        self.invoke = invoke
+        self.limiter = AdaptiveLimiter(max(1, max_in_flight))
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.build_prompt = build_prompt
+
+    def structure(self, i, page_text):
+        """Returns the response for page index i, "ERROR: ..." when it failed or stayed throttled."""
+        print(f"\n Processing 📄 Page {i + 1} — {len(page_text)} characters")
+        prompt = self.build_prompt(page_text)
+        response = ""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            throttled = False
+            try:
+                response = self.invoke(prompt)
+                throttled = is_throttled(response)
+            finally:
+                self.limiter.release(throttled)
+            if not throttled:
+                break
+            backoff = self.base_backoff * (2 ** attempt)
+            print(f"Page {i + 1} throttled, retrying in {backoff:.1f}s (concurrency limit {self.limiter.limit})")
+            time.sleep(random.uniform(backoff / 2, backoff))
+        return response
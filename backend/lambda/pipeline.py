@@ -0,0 +1,175 @@
+import os
+import time
+import queue
+import threading
+
+
+# Items waiting between two stages, a full queue blocks the stage before it (back-pressure)
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "16"))
+
+_END = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class Stage:
+    """
+    One step of a Pipeline, run by `workers` threads. process(item, emit) is called for every
+    input item and may emit any number of outputs; finish(emit), when given, is called once
+    after the last item (by the last worker to stop), e.g. to emit a partial batch.
+    """
+
+    def __init__(self, name, process, workers=1, finish=None):
+        self.name = name
+        self.process = process
+        self.workers = max(1, workers)
+        self.finish = finish
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def record_depth(self, depth):
+        with self._lock:
+            self.depth_samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def stats(self, elapsed):
+        return {
+            "workers": self.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_s": round(self.busy_seconds, 2),
+            # Time spent waiting for room in the next queue: the stages after this one are slower
+            "blocked_s": round(self.blocked_seconds, 2),
+            # Items per second of busy worker time: the stage with the lowest rate per worker is the bottleneck
+            "items_per_s": round(self.items_in / self.busy_seconds * self.workers, 1) if self.busy_seconds else None,
+            "utilization": round(self.busy_seconds / (elapsed * self.workers), 2) if elapsed else 0.0,
+            "queue_avg": round(self.depth_total / self.depth_samples, 1) if self.depth_samples else 0.0,
+            "queue_max": self.max_depth
+        }
+
+
+class Pipeline:
+    """
+    Runs stages concurrently, each reading from a bounded queue filled by the stage before it.
+    The first exception raised by a stage stops every stage and is raised again by run().
+    Queue depth is sampled every time an item is queued, so stats() shows where items wait.
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+        self.outputs = []
+        self.error = None
+        self.elapsed = 0.0
+        self._aborted = threading.Event()
+
+    def _put(self, index, item):
+        """Queues item for stage `index` (past the last stage: the pipeline outputs)."""
+        if index == len(self.stages):
+            if item is not _END:
+                self.outputs.append(item)
+            return
+        if item is not _END:
+            self.stages[index].record_depth(self.queues[index].qsize())
+        while True:
+            if self._aborted.is_set():
+                raise PipelineAborted()
+            try:
+                self.queues[index].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, index):
+        while True:
+            if self._aborted.is_set():
+                raise PipelineAborted()
+            try:
+                return self.queues[index].get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _run_worker(self, index, remaining):
+        stage = self.stages[index]
+
+        # Seconds this worker waited in emit, left out of its busy time
+        blocked = [0.0]
+
+        def emit(item):
+            start = time.perf_counter()
+            self._put(index + 1, item)
+            waited = time.perf_counter() - start
+            blocked[0] += waited
+            with stage._lock:
+                stage.items_out += 1
+                stage.blocked_seconds += waited
+
+        try:
+            while True:
+                item = self._get(index)
+                if item is _END:
+                    break
+                start, blocked[0] = time.perf_counter(), 0.0
+                stage.process(item, emit)
+                with stage._lock:
+                    stage.items_in += 1
+                    stage.busy_seconds += time.perf_counter() - start - blocked[0]
+            with stage._lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if not last:
+                # Lets the next worker of this stage see the end too
+                self._put(index, _END)
+                return
+            if stage.finish:
+                start, blocked[0] = time.perf_counter(), 0.0
+                stage.finish(emit)
+                stage.busy_seconds += time.perf_counter() - start - blocked[0]
+            self._put(index + 1, _END)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+            self._aborted.set()
+
+    def run(self, items):
+        """Feeds items to the first stage and returns everything emitted by the last one."""
+        start = time.perf_counter()
+        remaining = [stage.workers for stage in self.stages]
+        threads = [
+            threading.Thread(target=self._run_worker, args=(index, remaining), daemon=True)
+            for index, stage in enumerate(self.stages)
+            for _ in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for item in items:
+                self._put(0, item)
+            self._put(0, _END)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            # The source failed (e.g. a page reader), the stages are stopped
+            if self.error is None:
+                self.error = e
+            self._aborted.set()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+        if self.error is not None:
+            raise self.error
+        return self.outputs
+
+    def stats(self):
+        return {stage.name: stage.stats(self.elapsed) for stage in self.stages}
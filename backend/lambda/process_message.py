@@ -1,29 +1,81 @@
 import json
-import time
+import math
 import uuid
-from common import document_types
-from mongodb_tools import insert_update_request
+from mongodb_tools import insert_update_request, set_partial_answer, get_request, save_request_input, get_request_input
 from agent import agent_loop
+from resources import get_client
 
 
-def search_inflight_request(user_id, request_id):
-    # Example simulated response
-    return [
-        {"message": "Processing your request", "time_stamp": int(time.time())}
-    ]
+def search_inflight_request(user_id, request_id, since=None):
+    request = get_request(user_id, request_id, since) or {}
+    messages = [{"message": update["update"], "time_stamp": update["time_stamp"]} for update in request.get("updates") or []]
+    return messages, request.get("partial_answer", ""), request.get("completed", False)
 
-def new_request(user_id, user_request, history):
-    # generates new uuid 
-    request_id = str(uuid.uuid4())
-    response = agent_loop(user_request, history)
+def new_request(user_id, user_request, history, request_id=None):
+    # the client may send its own request_id to poll the request while it runs
+    request_id = request_id or str(uuid.uuid4())
+    try:
+        response = agent_loop(
+            user_request,
+            history,
+            on_answer=lambda text: set_partial_answer(user_id, request_id, text),
+            on_progress=lambda message: update_inflight_request(user_id, request_id, message)
+        )
+    except Exception as e:
+        print(f"❌ Agent failed: {e}")
+        response = "Apologies, the AI agent failed to process your request."
     print(f"request:{user_request}\n\nresponse:{response}")
+    # the last update of a completed request is the response
+    insert_update_request(user_id, request_id, response, True)
     return request_id, response
 
+def enqueue_request(user_id, user_request, history, context, request_id=None):
+    """
+    Records the request and runs it in an asynchronous invocation of this function,
+    so POST returns right away and the response is read with GET. The request and its
+    history are stored with the request, only their ids are sent to the invocation.
+    """
+    request_id = request_id or str(uuid.uuid4())
+    save_request_input(user_id, request_id, user_request, history)
+    update_inflight_request(user_id, request_id, "Request received")
+    try:
+        get_client("lambda").invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps({"async_request": {"user_id": user_id, "request_id": request_id}})
+        )
+    except Exception as e:
+        # Completed with the error, so the client polling the request does not wait forever
+        print(f"❌ Could not start the request: {e}")
+        insert_update_request(user_id, request_id, "Apologies, the AI agent could not start processing your request.", True)
+        raise
+    return request_id
+
 def update_inflight_request(user_id, request_id, message):
     insert_update_request(user_id, request_id, message, False)
 
+def parse_since(since):
+    """The `since` query parameter as a time stamp, None when absent and False when invalid."""
+    if not since:
+        return None
+    try:
+        value = float(since)
+    except ValueError:
+        return False
+    return value if math.isfinite(value) else False
+
 
 def handler(event, context):
+    # Asynchronous invocation queued by enqueue_request
+    if "async_request" in event:
+        user_id, request_id = event["async_request"]["user_id"], event["async_request"]["request_id"]
+        request = get_request_input(user_id, request_id)
+        if not request:
+            print(f"❌ Request {request_id} of {user_id} not found")
+            return
+        new_request(user_id, request.get("request", ""), request.get("history", ""), request_id)
+        return
+
     method = event.get("httpMethod", "POST")
     headers = {
         "Access-Control-Allow-Origin": event.get('headers', {}).get('origin', '*'),
@@ -45,13 +97,23 @@ def handler(event, context):
                     "body": json.dumps({"error": "GET request requires both 'user_id' and 'request_id'"})
                 }
 
-            messages = search_inflight_request(user_id, request_id)
+            # Only the updates after `since` (the time_stamp of the last update already read)
+            since = parse_since(query.get("since"))
+            if since is False:
+                return {
+                    "statusCode": 400,
+                    "headers": headers,
+                    "body": json.dumps({"error": "'since' must be the time_stamp of an update"})
+                }
+            messages, partial_answer, completed = search_inflight_request(user_id, request_id, since)
             return {
                 "statusCode": 200,
                 "headers": headers,
                 "body": json.dumps({
                     "request_id": request_id,
-                    "messages": messages
+                    "messages": messages,
+                    "partial_answer": partial_answer,
+                    "completed": completed
                 })
             }
 
@@ -68,11 +130,11 @@ def handler(event, context):
                     "body": json.dumps({"error": "Missing 'user_id' in POST request"})
                 }
 
-            new_id, response = new_request(user_id, user_request, history)
+            new_id = enqueue_request(user_id, user_request, history, context, body.get("request_id"))
             return {
-                "statusCode": 200,
+                "statusCode": 202,
                 "headers": headers,
-                "body": json.dumps({"request_id": new_id, "response": response})
+                "body": json.dumps({"request_id": new_id})
             }
 
         elif method == "OPTIONS":
@@ -0,0 +1,116 @@
+import os
+import re
+
+
+# Total size of the determine_action prompt (template included)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "20000"))
+
+# Maximum size of each section, sources have the priority over the catalog, the catalog over the history
+SOURCES_MAX_TOKENS = int(os.environ.get("PROMPT_SOURCES_MAX_TOKENS", "8000"))
+CATALOG_MAX_TOKENS = int(os.environ.get("PROMPT_CATALOG_MAX_TOKENS", "3000"))
+HISTORY_MAX_TOKENS = int(os.environ.get("PROMPT_HISTORY_MAX_TOKENS", "3000"))
+
+# Turns quoted in full, older ones are reduced to one line each
+HISTORY_FULL_TURNS = int(os.environ.get("PROMPT_HISTORY_FULL_TURNS", "6"))
+SUMMARY_LINE_CHARACTERS = 160
+
+def estimate_tokens(text):
+    # Conservative estimate (~3 characters per token), OCR text tokenizes worse than prose
+    return len(text) // 3 + 1
+
+
+SOURCE_BLOCK = re.compile(r"\s*<SOURCE\b.*?</SOURCE>\s*", re.DOTALL)
+
+
+def truncate_to_tokens(text, max_tokens, keep_end=False):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    characters = max(0, max_tokens * 3 - 3)
+    return "…" + text[-characters:] if keep_end else text[:characters] + "…"
+
+
+def _shorten(text):
+    text = " ".join(str(text).split())
+    return text if len(text) <= SUMMARY_LINE_CHARACTERS else text[:SUMMARY_LINE_CHARACTERS] + "…"
+
+
+def history_entries(recent_history, full_turns=HISTORY_FULL_TURNS):
+    """
+    Splits the conversation into (summarized, full) "sender: content" entries, oldest first.
+    Only the last full_turns messages are kept in full, older ones are reduced to their first characters.
+    """
+    if not isinstance(recent_history, list):
+        return [], [str(recent_history)] if recent_history else []
+    messages = [msg for msg in recent_history if isinstance(msg, dict) and msg.get("content")]
+    split = max(0, len(messages) - full_turns)
+    summarized = [f"- {msg.get('sender', 'user')}: {_shorten(msg['content'])}" for msg in messages[:split]]
+    full = [f"{msg.get('sender', 'user')}: {msg['content']}" for msg in messages[split:]]
+    return summarized, full
+
+
+def render_history(summarized, full):
+    header = ["Earlier in the conversation (summarized):"] if summarized else []
+    return "\n".join(header + summarized + full)
+
+
+def fit_history(recent_history, max_tokens):
+    """Drops the oldest entries first, the latest message is truncated (keeping its end) if needed."""
+    summarized, full = history_entries(recent_history)
+    while summarized and estimate_tokens(render_history(summarized, full)) > max_tokens:
+        summarized.pop(0)
+    while len(full) > 1 and estimate_tokens(render_history(summarized, full)) > max_tokens:
+        full.pop(0)
+    return truncate_to_tokens(render_history(summarized, full), max_tokens, keep_end=True)
+
+
+def fit_lines(text, max_tokens):
+    """Keeps the first lines (the catalog is ranked by relevance) within max_tokens."""
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        tokens = estimate_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept)
+
+
+def fit_sources(context, max_tokens):
+    """Keeps the first SOURCE blocks (the latest retrieved) within max_tokens, a block never is cut."""
+    blocks = [match.group(0) for match in SOURCE_BLOCK.finditer(context)]
+    if not blocks:
+        return truncate_to_tokens(context, max_tokens)
+    kept = ""
+    for block in blocks:
+        if estimate_tokens(kept + block) > max_tokens:
+            break
+        kept += block
+    return kept
+
+
+def budget_sections(template_tokens, user_input, recent_history, available_docs_text, context,
+                    budget=PROMPT_TOKEN_BUDGET):
+    """
+    Fits the variable sections of the determine_action prompt into the budget.
+
+    :param template_tokens: estimated tokens of the prompt with empty sections.
+    :return: (history, available_docs, sources, usage) with usage the estimated tokens per section.
+    """
+    remaining = max(0, budget - template_tokens - estimate_tokens(user_input))
+
+    sources = fit_sources(context, min(SOURCES_MAX_TOKENS, remaining))
+    remaining -= estimate_tokens(sources)
+    available_docs = fit_lines(available_docs_text, min(CATALOG_MAX_TOKENS, remaining))
+    remaining -= estimate_tokens(available_docs)
+    history = fit_history(recent_history, min(HISTORY_MAX_TOKENS, max(0, remaining)))
+
+    usage = {
+        "template": template_tokens,
+        "query": estimate_tokens(user_input),
+        "history": estimate_tokens(history),
+        "catalog": estimate_tokens(available_docs),
+        "sources": estimate_tokens(sources)
+    }
+    usage["total"] = sum(usage.values())
+    return history, available_docs, sources, usage
@@ -0,0 +1,25 @@
+# Constant of reciprocal rank fusion, dampens the advantage of the very first ranks
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(ranked_lists, weights=None, k=RRF_K, key="_id"):
+    """
+    Fuses several ranked result lists: every result scores sum(weight / (k + rank)) over
+    the lists it appears in, ranks starting at 1. Results are merged by `key`, compared as
+    strings (the local index stores the ObjectId of a chunk as its string), the first
+    occurrence keeps its fields and "score" is replaced by the fused score.
+
+    :param ranked_lists: list of result lists, each sorted from best to worst.
+    :param weights: optional weight per list (defaults to 1.0 each).
+    :return: fused results sorted by score, best first.
+    """
+    scores = {}
+    results = {}
+    for i, ranked in enumerate(ranked_lists):
+        weight = weights[i] if weights else 1.0
+        for rank, result in enumerate(ranked, start=1):
+            result_key = str(result[key])
+            scores[result_key] = scores.get(result_key, 0.0) + weight / (k + rank)
+            results.setdefault(result_key, result)
+    fused = sorted(results, key=lambda result_key: -scores[result_key])
+    return [{**results[result_key], "score": scores[result_key]} for result_key in fused]
@@ -0,0 +1,70 @@
+import os
+import json
+import threading
+
+
+# Connections kept per boto3 client, enough for the parallel page structuring and hybrid search threads
+BOTO3_MAX_POOL_CONNECTIONS = int(os.environ.get("BOTO3_MAX_POOL_CONNECTIONS", "16"))
+
+# MongoClient pool size per container
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", "20"))
+
+_lock = threading.RLock()
+_secrets = None
+_mongo_client = None
+_voyage_client = None
+_boto3_session = None
+_boto3_clients = {}
+
+
+def _session():
+    global _boto3_session
+    with _lock:
+        if _boto3_session is None:
+            import boto3
+            _boto3_session = boto3.session.Session()
+        return _boto3_session
+
+
+def get_client(service_name, region_name=None, max_pool_connections=BOTO3_MAX_POOL_CONNECTIONS):
+    """
+    Returns a boto3 client created once per container and shared by all threads
+    (clients are thread-safe, creating them is slow and not thread-safe).
+    """
+    key = (service_name, region_name, max_pool_connections)
+    with _lock:
+        if key not in _boto3_clients:
+            from botocore.config import Config
+            config = Config(max_pool_connections=max_pool_connections, tcp_keepalive=True)
+            _boto3_clients[key] = _session().client(service_name, region_name=region_name, config=config)
+        return _boto3_clients[key]
+
+
+def get_secrets():
+    """The SECRET_NAME secret, fetched from Secrets Manager on first use only."""
+    global _secrets
+    with _lock:
+        if _secrets is None:
+            region_name = os.environ.get("AWS_REGION", "us-west-2")  # fallback default
+            response = get_client("secretsmanager", region_name).get_secret_value(SecretId=os.environ["SECRET_NAME"])
+            _secrets = json.loads(response["SecretString"])
+        return _secrets
+
+
+def get_mongo_client():
+    global _mongo_client
+    with _lock:
+        if _mongo_client is None:
+            from pymongo.mongo_client import MongoClient
+            from pymongo.server_api import ServerApi
+            _mongo_client = MongoClient(get_secrets()["MONGODB_URI"], server_api=ServerApi('1'), maxPoolSize=MONGODB_MAX_POOL_SIZE)
+        return _mongo_client
+
+
+def get_voyage_client():
+    global _voyage_client
+    with _lock:
+        if _voyage_client is None:
+            import voyageai
+            _voyage_client = voyageai.Client(api_key=get_secrets()["VOYAGE_API_KEY"])
+        return _voyage_client
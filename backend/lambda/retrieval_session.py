@@ -0,0 +1,107 @@
+import os
+import prompt_budget
+from embedding_cache import normalize_text
+
+
+# Token budget of the VALID_SOURCES block accumulated over the agent loop
+RETRIEVAL_CONTEXT_TOKENS = int(os.environ.get("RETRIEVAL_CONTEXT_TOKENS", "6000"))
+
+# Chunks retrieved per QUERY_DOCS action
+RETRIEVAL_LIMIT = 5
+
+# Longest excerpt quoted per source (~3 characters per token), longer chunks are cut
+EXCERPT_MAX_TOKENS = int(os.environ.get("EXCERPT_MAX_TOKENS", "1500"))
+
+
+def _default_embed(texts):
+    from embedding import create_embeddings_batch
+    return create_embeddings_batch(texts)
+
+
+def _default_search(search_embedding, document_list, limit, search_text):
+    from mongodb_tools import search_chunks
+    return search_chunks(search_embedding, document_list, limit, search_text=search_text)
+
+
+def format_source(result, max_tokens=EXCERPT_MAX_TOKENS):
+    text = result['text']
+    if len(text) > max_tokens * 3:
+        text = text[:max_tokens * 3] + "…"
+    return f"""
+                            <SOURCE doc="{result['file_name']}" page="{result['page']}">
+                            <EXCERPT>
+                            {text}
+                            </EXCERPT>
+                            </SOURCE>
+                            """
+
+
+class RetrievalSession:
+    """
+    Retrieval state for one user request, shared by the iterations of agent_loop.
+
+    Query embeddings and search results are memoized on the normalized search text
+    (plus the document filter), so a repeated SEARCH_FOR costs no embedding or search call.
+    Hits are merged by _id across iterations; the context lists the latest hits first
+    and drops the oldest ones once the token budget is used.
+    """
+
+    def __init__(self, embed=None, search=None, estimate_tokens=None,
+                 token_budget=RETRIEVAL_CONTEXT_TOKENS, limit=RETRIEVAL_LIMIT):
+        self.embed = embed or _default_embed
+        self.search = search or _default_search
+        self.estimate_tokens = estimate_tokens or prompt_budget.estimate_tokens
+        self.token_budget = token_budget
+        self.limit = limit
+        self.embeddings = {}
+        self.searches = {}
+        self.hits = {}
+        self.iteration = 0
+        self.embed_calls = 0
+        self.search_calls = 0
+
+    def retrieve(self, search_text, document_list):
+        """Returns the hits for this search and the number of them not seen before in the session."""
+        self.iteration += 1
+        text_key = normalize_text(search_text or "")
+        search_key = (text_key, tuple(sorted(document_list or [])))
+
+        results = self.searches.get(search_key)
+        if results is None:
+            if text_key not in self.embeddings:
+                self.embeddings[text_key] = self.embed([search_text])[0]
+                self.embed_calls += 1
+            results = self.search(self.embeddings[text_key], document_list, self.limit, search_text)
+            self.search_calls += 1
+            self.searches[search_key] = results
+
+        new_hits = 0
+        for rank, result in enumerate(results):
+            key = str(result["_id"])
+            if key not in self.hits:
+                new_hits += 1
+            # Re-retrieved chunks move up with the latest search
+            self.hits[key] = {"result": result, "iteration": self.iteration, "rank": rank}
+        return results, new_hits
+
+    def context(self):
+        """VALID_SOURCES text: latest hits first, within the token budget."""
+        ordered = sorted(self.hits.values(), key=lambda hit: (-hit["iteration"], hit["rank"]))
+        context = ""
+        used = 0
+        for hit in ordered:
+            source = format_source(hit["result"])
+            tokens = self.estimate_tokens(source)
+            if used + tokens > self.token_budget and context:
+                break
+            context += source
+            used += tokens
+        return context
+
+    def stats(self):
+        return {
+            "iterations": self.iteration,
+            "embed_calls": self.embed_calls,
+            "search_calls": self.search_calls,
+            "unique_hits": len(self.hits)
+        }
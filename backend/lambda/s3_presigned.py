@@ -1,22 +1,35 @@
 import os
-import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
 import re
+import time
+import threading
+from collections import OrderedDict
+from botocore.exceptions import NoCredentialsError, ClientError
+from resources import get_client
+
+
+# Lifetime of the pre-signed URLs
+PRESIGNED_URL_EXPIRATION = 3600
+
+# A cached URL is only served while it stays valid at least this long, older ones are signed again
+PRESIGNED_URL_MIN_VALIDITY = 1800
+
+# Documents whose URL is kept, least recently cited ones are dropped first
+PRESIGNED_URL_CACHE_SIZE = int(os.environ.get("PRESIGNED_URL_CACHE_SIZE", "256"))
 
-# Cache for pre-signed URLs to avoid generating duplicates
-presigned_url_cache = {}
+# Seconds before a document that could not be signed is tried again
+FAILED_SIGNING_RETRY_SECONDS = 60
 
-def generate_presigned_s3_url(filename, expiration=3600):
-    import os
-    import boto3
-    from botocore.exceptions import NoCredentialsError, ClientError
+SOURCE_PATTERN = re.compile(r'<SOURCE doc_file_name=[\'"]([^\'"]+)[\'"] page=[\'"]?([^\'"> ]+)[\'"]?>(.*?)</SOURCE>', re.DOTALL)
 
+
+def generate_presigned_s3_url(filename, expiration=PRESIGNED_URL_EXPIRATION):
     bucket_name = os.environ.get("BUCKET_NAME")
     if not bucket_name:
         print("Environment variable BUCKET_NAME is not set.")
         return None
 
-    s3_client = boto3.client('s3')
+    # Signing is local, the shared client only provides the credentials and endpoint
+    s3_client = get_client('s3')
     try:
         url = s3_client.generate_presigned_url(
             'get_object',
@@ -27,35 +40,82 @@ def generate_presigned_s3_url(filename, expiration=3600):
     except (NoCredentialsError, ClientError) as e:
         print(f"Error generating pre-signed URL: {e}")
         return None
-    
 
-def replace_sources_with_links(text, expiration=3600):
+
+class PresignedUrlCache:
+    """
+    LRU of pre-signed URLs per document (the #page fragment is added per citation, the signature
+    does not depend on it). An entry is signed again once less than min_validity seconds of its
+    expiration remain, so a link in an answer stays usable for at least that long.
+    """
+
+    def __init__(self, sign=generate_presigned_s3_url, max_entries=PRESIGNED_URL_CACHE_SIZE,
+                 expiration=PRESIGNED_URL_EXPIRATION, min_validity=PRESIGNED_URL_MIN_VALIDITY, clock=time.time):
+        self.sign = sign
+        self.max_entries = max_entries
+        self.expiration = expiration
+        self.min_validity = min_validity
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.signed = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, docs):
+        """Returns {doc: url or None} for the documents, signing only the missing or expiring ones."""
+        now = self.clock()
+        urls = {}
+        with self._lock:
+            for doc in docs:
+                entry = self.entries.get(doc)
+                if entry and entry[1] - now >= self.min_validity:
+                    self.entries.move_to_end(doc)
+                    urls[doc] = entry[0]
+                    self.hits += 1
+
+        for doc in docs:
+            if doc in urls:
+                continue
+            url = self.sign(doc, expiration=self.expiration)
+            # A failed signature is retried after a short while instead of at every citation
+            expires_at = now + self.expiration if url else now + self.min_validity + FAILED_SIGNING_RETRY_SECONDS
+            urls[doc] = url
+            with self._lock:
+                self.signed += 1
+                self.entries[doc] = (url, expires_at)
+                self.entries.move_to_end(doc)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return urls
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self.entries), "hits": self.hits, "signed": self.signed}
+
+
+# Shared by the warm invocations of the container
+presigned_url_cache = PresignedUrlCache()
+
+
+def replace_sources_with_links(text, cache=None):
     """
     Replace <SOURCE doc_file_name="..." page="...">...</SOURCE> with markdown links using pre-signed S3 URLs.
     The link text is the original content inside the <SOURCE> tag.
+    The documents cited in the text are signed together, once each.
     """
-    pattern = r'<SOURCE doc_file_name=[\'"]([^\'"]+)[\'"] page=[\'"]?([^\'"> ]+)[\'"]?>(.*?)</SOURCE>'
+    cache = cache or presigned_url_cache
+    docs = list(dict.fromkeys(match.group(1) for match in SOURCE_PATTERN.finditer(text)))
+    urls = cache.get_many(docs) if docs else {}
 
     def replacer(match):
         doc = match.group(1)
         page = match.group(2)
         inner_text = match.group(3).strip()
 
-        key = f"{doc}#page={page}"
-        if key not in presigned_url_cache:
-            base_url = generate_presigned_s3_url(doc, expiration=expiration)
-            if base_url:
-                presigned_url_cache[key] = f"{base_url}#page={page}"
-            else:
-                presigned_url_cache[key] = None  # Avoid retrying
-
-        presigned_url = presigned_url_cache.get(key)
-        if presigned_url:
-            return f'{inner_text} [source 📄]({presigned_url})'
+        base_url = urls.get(doc)
+        if base_url:
+            return f'{inner_text} [source 📄]({base_url}#page={page})'
         else:
             return inner_text  # Fallback: plain text
 
-    return re.sub(pattern, replacer, text, flags=re.DOTALL)
-
-
-
+    return SOURCE_PATTERN.sub(replacer, text)
@@ -0,0 +1,182 @@
+import os
+import re
+import math
+from bisect import bisect_right
+from prompt_budget import estimate_tokens
+
+
+# Estimated tokens per chunk: smaller sections are merged up to the target, larger than the max are split into pieces of about the target
+CHUNK_TARGET_TOKENS = int(os.environ.get("CHUNK_TARGET_TOKENS", "512"))
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "1024"))
+
+# Sections below this are merged with their neighbors under the same H1 and H2
+CHUNK_MIN_TOKENS = int(os.environ.get("CHUNK_MIN_TOKENS", "128"))
+
+# Tokens of a piece repeated at the start of the next piece of the same section
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "64"))
+
+PARAGRAPHS = re.compile(r"[^\n]*\S[^\n]*")
+SENTENCES = re.compile(r"\S.*?(?:[.!?](?=\s)|$)", re.MULTILINE)
+WORDS = re.compile(r"\S+")
+
+
+def _spans(pattern, text, start, end):
+    return [(match.start(), match.end()) for match in pattern.finditer(text, start, end)]
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class SectionChunker:
+    """
+    Turns the sections of a document (see section_grouping), in document order, into chunks
+    of a bounded estimated token count:
+
+    - a section above max_tokens is split at paragraph boundaries, then sentence boundaries,
+      then between words, into pieces of about target_tokens; each piece after the first
+      starts with the last overlap_tokens of the previous one (whole sentences when they fit).
+      A piece keeps the page where its own text starts (from the section page_offsets).
+    - contiguous sections under the same H1 and H2 are merged, up to target_tokens, while one
+      of them is below min_tokens. The chunk keeps the headings and page of its first section,
+      the H3 of the others is kept as a line of the text.
+
+    Chunks are dicts like the sections, with first_section the index of their first section.
+    """
+
+    def __init__(self, target_tokens=CHUNK_TARGET_TOKENS, max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS,
+                 overlap_tokens=CHUNK_OVERLAP_TOKENS, count_tokens=None):
+        if count_tokens is None:
+            count_tokens = estimate_tokens
+        self.target_tokens = target_tokens
+        self.max_tokens = max(max_tokens, target_tokens)
+        self.min_tokens = min_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = count_tokens
+        self.sections_added = 0
+        # Whether the last section added started a chunk whatever the sections before the previous one
+        self.restarted = False
+        self.last_heads = None
+        self.pending = []
+        self.pending_index = 0
+        self.pending_tokens = 0
+        self.sizes = []
+        self.split_sections = 0
+        self.merged_sections = 0
+
+    def add(self, section):
+        """Returns the chunks completed by this section."""
+        index = self.sections_added
+        self.sections_added += 1
+        heads = (section["H1"], section["H2"])
+        tokens = self.count_tokens(section["text"])
+        self.restarted = tokens > self.max_tokens or heads != self.last_heads
+        self.last_heads = heads
+
+        if tokens > self.max_tokens:
+            chunks = self._flush()
+            chunks.extend(self._split(section, index, tokens))
+            return chunks
+        if self.pending and not self.restarted and self.pending_tokens + tokens <= self.target_tokens \
+                and (self.pending_tokens < self.min_tokens or tokens < self.min_tokens):
+            self.pending.append(section)
+            self.pending_tokens += tokens
+            return []
+        chunks = self._flush()
+        self.pending = [section]
+        self.pending_tokens = tokens
+        self.pending_index = index
+        return chunks
+
+    def finish(self):
+        """Returns the last chunk, once the last section has been added."""
+        return self._flush()
+
+    def _chunk(self, section, text, page, first_section):
+        self.sizes.append(self.count_tokens(text))
+        return {"H1": section["H1"], "H2": section["H2"], "H3": section["H3"], "page": str(page), "text": text,
+                "first_section": first_section}
+
+    def _flush(self):
+        if not self.pending:
+            return []
+        first = self.pending[0]
+        lines = [first["text"]]
+        for section in self.pending[1:]:
+            lines.append(f"{section['H3']}\n{section['text']}" if section["H3"] and section["H3"] != first["H3"] else section["text"])
+        self.merged_sections += len(self.pending) - 1
+        chunk = self._chunk(first, "\n".join(lines), first["page"], self.pending_index)
+        self.pending = []
+        self.pending_tokens = 0
+        return [chunk]
+
+    def _units(self, text, budget):
+        """(start, end) spans of the text, each within budget tokens unless it is a single word."""
+        units = []
+        for paragraph in _spans(PARAGRAPHS, text, 0, len(text)):
+            if self.count_tokens(text[paragraph[0]:paragraph[1]]) <= budget:
+                units.append(paragraph)
+                continue
+            for sentence in _spans(SENTENCES, text, *paragraph):
+                if self.count_tokens(text[sentence[0]:sentence[1]]) <= budget:
+                    units.append(sentence)
+                    continue
+                # A sentence longer than a piece (tables, OCR runs) is cut between words
+                units.extend(self._pack(text, _spans(WORDS, text, *sentence), budget))
+        return units
+
+    def _pack(self, text, units, budget):
+        """Greedily joins contiguous units into spans within budget tokens."""
+        packed = []
+        for start, end in units:
+            if packed and self.count_tokens(text[packed[-1][0]:end]) <= budget:
+                packed[-1] = (packed[-1][0], end)
+            else:
+                packed.append((start, end))
+        return packed
+
+    def _overlap_start(self, text, previous, start):
+        """Start of the tail of the previous piece within overlap_tokens, on a sentence boundary if possible."""
+        if self.overlap_tokens <= 0:
+            return start
+        for pattern in (SENTENCES, WORDS):
+            tail = start
+            for span_start, _ in reversed(_spans(pattern, text, previous[0], previous[1])):
+                if self.count_tokens(text[span_start:start]) > self.overlap_tokens:
+                    break
+                tail = span_start
+            if tail < start:
+                return tail
+        return start
+
+    def _split(self, section, index, tokens):
+        self.split_sections += 1
+        text = section["text"]
+        offsets = section.get("page_offsets") or [[0, int(section["page"])]]
+        pieces = math.ceil(tokens / self.target_tokens)
+        budget = math.ceil(tokens / pieces)
+
+        chunks = []
+        previous = None
+        for start, end in self._pack(text, self._units(text, budget), budget):
+            page = offsets[bisect_right([offset for offset, _ in offsets], start) - 1][1]
+            overlap_start = self._overlap_start(text, previous, start) if previous else start
+            chunks.append(self._chunk(section, text[overlap_start:end].strip(), page, index))
+            previous = (start, end)
+        return chunks
+
+    def stats(self):
+        """Distribution of the estimated tokens of the chunks made so far."""
+        if not self.sizes:
+            return {"chunks": 0}
+        sizes = sorted(self.sizes)
+        return {
+            "chunks": len(sizes),
+            "min": sizes[0],
+            "p50": _percentile(sizes, 0.5),
+            "p90": _percentile(sizes, 0.9),
+            "max": sizes[-1],
+            "mean": round(sum(sizes) / len(sizes)),
+            "split_sections": self.split_sections,
+            "merged_sections": self.merged_sections
+        }
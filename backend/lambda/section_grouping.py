@@ -0,0 +1,59 @@
+from tag_parser import iter_tag_events
+
+
+class SectionGrouper:
+    """
+    Groups the structured pages of a document into sections, one page at a time: contiguous
+    <BODY> elements under the same H1, H2 and H3 form a section, which keeps the page where it starts.
+    A section is complete once a BODY under other headings follows it, or at finish().
+
+    A grouper started in the middle of a document (known_start=False) does not know the headings
+    set on earlier pages: they are None until the pages added set them.
+
+    With track_pages=True, a section also has page_offsets: [text_offset, page_number] of every
+    page its text continues on (see section_chunker).
+    """
+
+    def __init__(self, known_start=True, track_pages=False):
+        self.H1 = self.H2 = self.H3 = "" if known_start else None
+        self.track_pages = track_pages
+        self.current = None
+
+    def add_page(self, page_number, response):
+        """Returns the sections completed by this page, pages must be added in document order."""
+        completed = []
+        for tag, text in iter_tag_events(response):
+            if tag == "H1":
+                self.H1 = text
+            elif tag == "H2":
+                self.H2 = text
+            elif tag == "H3":
+                self.H3 = text
+            elif tag == "BODY":
+                current = self.current
+                if current and (current["H1"], current["H2"], current["H3"]) == (self.H1, self.H2, self.H3):
+                    if self.track_pages and current["page_offsets"][-1][1] != page_number:
+                        current["page_offsets"].append([len(current["text"]) + 1, page_number])
+                    current["text"] += "\n" + text
+                    continue
+                if current and current["text"]:
+                    completed.append(current)
+                self.current = {"H1": self.H1, "H2": self.H2, "H3": self.H3, "page": str(page_number), "text": text}
+                if self.track_pages:
+                    self.current["page_offsets"] = [[0, page_number]]
+        return completed
+
+    def finish(self):
+        """Returns the last section, once the last page has been added."""
+        current, self.current = self.current, None
+        return [current] if current and current["text"] else []
+
+
+def group_sections(responses):
+    """Sections of a whole document, from the structured page responses in page order."""
+    grouper = SectionGrouper()
+    sections = []
+    for i, response in enumerate(responses):
+        sections.extend(grouper.add_page(i + 1, response))
+    sections.extend(grouper.finish())
+    return sections
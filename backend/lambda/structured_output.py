@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import threading
+from common import document_types
+
+
+# "tool": prompts answer through a tool call validated against its JSON schema, "tags": the original XML-like tags
+LLM_OUTPUT_MODE = os.environ.get("LLM_OUTPUT_MODE", "tool")
+
+DOCUMENT_TYPE_NAMES = re.findall(r"^(\w+):", document_types, re.MULTILINE)
+
+ACTION_TOOL = {
+    "name": "choose_action",
+    "description": "Reports the improved user query and the single action chosen for it, with the fields that action needs.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "improved_user_query": {"type": "string"},
+            "action": {"type": "string", "enum": ["QUERY_DOCS", "INVALID", "QUESTION", "RESPOND"]},
+            "docs": {"type": "array", "items": {"type": "string"}, "description": "doc_names to search, empty for all documents (QUERY_DOCS)"},
+            "search_for": {"type": "string", "description": "search text (QUERY_DOCS)"},
+            "question": {"type": "string", "description": "clarifying question (QUESTION)"},
+            "answer": {"type": "string", "description": "markdown answer with <SOURCE> citations (RESPOND)"}
+        },
+        "required": ["improved_user_query", "action"]
+    }
+}
+
+STRUCTURE_PAGE_TOOL = {
+    "name": "structure_page",
+    "description": "Reports the content of the page, in order, as headings and body text blocks.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "elements": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "type": {"type": "string", "enum": ["H1", "H2", "H3", "BODY"]},
+                        "text": {"type": "string"}
+                    },
+                    "required": ["type", "text"]
+                }
+            }
+        },
+        "required": ["elements"]
+    }
+}
+
+DOCUMENT_METADATA_TOOL = {
+    "name": "document_metadata",
+    "description": "Reports the metadata of the document, empty strings when not available.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string"},
+            "type": {"type": "string", "enum": DOCUMENT_TYPE_NAMES + [""]},
+            "description": {"type": "string"},
+            "manufacturer": {"type": "string"},
+            "model": {"type": "string"}
+        },
+        "required": ["name", "type", "description", "manufacturer", "model"]
+    }
+}
+
+JSON_TYPES = {"object": dict, "array": list, "string": str, "integer": int, "number": (int, float), "boolean": bool}
+
+
+def validate(value, schema, path="$"):
+    """
+    Checks value against the JSON schema subset used by the tools above (type, properties,
+    required, enum, items). Returns the first error found, or None.
+    """
+    expected = schema.get("type")
+    if expected and (not isinstance(value, JSON_TYPES[expected]) or (expected != "boolean" and isinstance(value, bool))):
+        return f"{path}: expected {expected}, got {type(value).__name__}"
+    if "enum" in schema and value not in schema["enum"]:
+        return f"{path}: {value!r} is not one of {schema['enum']}"
+    if expected == "object":
+        for field in schema.get("required", []):
+            if field not in value:
+                return f"{path}: missing required field '{field}'"
+        for field, field_schema in schema.get("properties", {}).items():
+            if field in value:
+                error = validate(value[field], field_schema, f"{path}.{field}")
+                if error:
+                    return error
+    if expected == "array" and "items" in schema:
+        for i, item in enumerate(value):
+            error = validate(item, schema["items"], f"{path}[{i}]")
+            if error:
+                return error
+    return None
+
+
+def parse_tool_output(raw, schema):
+    """
+    Parses the tool input returned by the model (or JSON written as text, possibly in a code fence).
+    Returns (data, None) when valid, otherwise (None, error).
+    """
+    text = raw.strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # Text around the JSON object, e.g. ```json fences
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None, "no JSON object in the output"
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError as e:
+            return None, f"invalid JSON: {e}"
+    error = validate(data, schema)
+    return (None, error) if error else (data, None)
+
+
+def build_repair_prompt(prompt, tool, raw, error):
+    return f"""{prompt}
+
+        <PREVIOUS_OUTPUT>
+        {raw}
+        </PREVIOUS_OUTPUT>
+
+        Your previous output (in tags <PREVIOUS_OUTPUT>) was rejected: {error}.
+        Call the {tool['name']} tool again, with an input that follows its schema exactly.
+        """
+
+
+class StructuredOutputMetrics:
+    """Per tool counts of responses that were valid, valid after repair, or still invalid."""
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, tool_name, outcome):
+        with self._lock:
+            counts = self.counts.setdefault(tool_name, {"valid": 0, "repaired": 0, "failed": 0, "errors": 0})
+            counts[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for tool_name, counts in self.counts.items():
+                parsed = counts["valid"] + counts["repaired"] + counts["failed"]
+                stats[tool_name] = {**counts, "parse_failure_rate": round((counts["repaired"] + counts["failed"]) / parsed, 3) if parsed else 0.0}
+            return stats
+
+
+structured_metrics = StructuredOutputMetrics()
+
+
+def invoke_structured(prompt, tool, invoke_tool, repair_tool=None, metrics=structured_metrics):
+    """
+    Calls invoke_tool(prompt) (returns the tool input as JSON text, or "ERROR: ..."), validates
+    the output against the tool schema and asks for a corrected call once if it is invalid.
+    repair_tool, when given, is used for that second call instead of invoke_tool.
+
+    :return: (data, raw) with data None when the call failed or the output stayed invalid.
+    """
+    raw = invoke_tool(prompt)
+    if raw.startswith("ERROR:"):
+        metrics.record(tool["name"], "errors")
+        return None, raw
+    data, error = parse_tool_output(raw, tool["input_schema"])
+    if data is not None:
+        metrics.record(tool["name"], "valid")
+        return data, raw
+
+    print(f"⚠️ Invalid {tool['name']} output ({error}), asking for a repair")
+    repaired = (repair_tool or invoke_tool)(build_repair_prompt(prompt, tool, raw, error))
+    if not repaired.startswith("ERROR:"):
+        data, error = parse_tool_output(repaired, tool["input_schema"])
+        if data is not None:
+            metrics.record(tool["name"], "repaired")
+            return data, repaired
+    metrics.record(tool["name"], "failed")
+    print(f"❌ {tool['name']} output still invalid after repair: {error}")
+    return None, f"ERROR: Invalid {tool['name']} output: {error}"
+
+
+def elements_to_tags(data):
+    """structure_page output as the tagged text stored per page and read by tag_parser."""
+    return "\n".join(f"<{element['type']}>{element['text']}</{element['type']}>" for element in data["elements"])
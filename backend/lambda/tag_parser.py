@@ -0,0 +1,82 @@
+def extract_first_xml_element(input_str):
+    """
+    Extracts:
+    1. Text within the first pair of XML-like tags.
+    2. The tag name.
+    3. The remaining string after the closing tag.
+    
+    Args:
+        input_str (str): The input string to process.
+        
+    Returns:
+        tuple: (inner_text, tag_name, remaining_text) or (None, None, None) if not found
+    """
+    # Find the first opening tag
+    start_tag_open = input_str.find('<')
+    if start_tag_open == -1:
+        return None, None, None
+    
+    start_tag_close = input_str.find('>', start_tag_open)
+    if start_tag_close == -1:
+        return None, None, None
+    
+    # Extract potential tag name
+    tag_name = input_str[start_tag_open + 1:start_tag_close]
+    
+    # Validate tag name (must be non-empty and contain only word characters)
+    if not tag_name or not all(char.isalnum() or char == '_' for char in tag_name):
+        return None, None, None
+    
+    # Find closing tag
+    closing_tag = f"</{tag_name}>"
+    end_tag_open = input_str.find(closing_tag, start_tag_close)
+    if end_tag_open == -1:
+        return None, None, None
+    
+    # Extract inner text
+    inner_text = input_str[start_tag_close + 1:end_tag_open]
+    
+    # Extract remaining text
+    end_tag_close = end_tag_open + len(closing_tag)
+    remaining_text = input_str[end_tag_close:]
+    
+    return inner_text, tag_name, remaining_text
+
+
+
+def iter_tag_events(text):
+    """
+    Scans a model response once and lazily yields (tag, inner_text) for every
+    <TAG>...</TAG> element, in order. Same elements as calling extract_first_xml_element
+    on the remaining text until it finds none: text outside tags is skipped, and the scan
+    stops at the first invalid or unclosed tag. Positions are tracked instead of slicing
+    the remaining text, so a response is scanned in linear time.
+    """
+    position = 0
+    while True:
+        start_tag_open = text.find("<", position)
+        if start_tag_open == -1:
+            return
+        start_tag_close = text.find(">", start_tag_open)
+        if start_tag_close == -1:
+            return
+        tag_name = text[start_tag_open + 1:start_tag_close]
+        if not tag_name or not all(char.isalnum() or char == "_" for char in tag_name):
+            return
+        closing_tag = f"</{tag_name}>"
+        end_tag_open = text.find(closing_tag, start_tag_close)
+        if end_tag_open == -1:
+            return
+        yield tag_name, text[start_tag_close + 1:end_tag_open]
+        position = end_tag_open + len(closing_tag)
+
+
+def iter_document_events(page_responses):
+    """
+    Yields ("PAGE", page_number) followed by the tag events of each page response,
+    one page at a time, so the formatted document never needs to be concatenated.
+    An invalid or unclosed tag only ends the events of its own page.
+    """
+    for i, response in enumerate(page_responses):
+        yield "PAGE", str(i + 1)
+        yield from iter_tag_events(response)
@@ -0,0 +1,62 @@
+import re
+import codecs
+
+
+# Pages of plain text uploads, in characters
+TEXT_PAGE_CHAR_LIMIT = 1800
+
+# Bytes read from S3 at a time
+TEXT_READ_CHUNK_BYTES = 1024 * 1024
+
+NON_SPACE = re.compile(r"\S")
+
+
+def _next_page(buffer, position, page_char_limit, text_len):
+    """
+    One step of the page splitter: returns (page, next_position). text_len is the length of
+    the stripped text, or None when it is only known to be longer than position + page_char_limit.
+    A page ends at the last space before the limit when the limit falls inside a word.
+    """
+    end = position + page_char_limit if text_len is None else min(position + page_char_limit, text_len)
+
+    # Look backward to the last space to avoid breaking a word
+    if (text_len is None or end < text_len) and buffer[end].isalnum():
+        last_space = buffer.rfind(" ", position, end)
+        if last_space > position:
+            end = last_space
+
+    return buffer[position:end].strip(), end + 1  # move past the space
+
+
+def iter_text_pages(chunks, page_char_limit=TEXT_PAGE_CHAR_LIMIT):
+    """
+    Lazily splits UTF-8 text received as byte chunks into pages, with the same page boundaries
+    as splitting the whole stripped text at once. A multibyte character split between two
+    chunks is decoded once both are read. Memory is bounded by one chunk plus one page.
+
+    :param chunks: iterable of bytes (e.g. the S3 body's iter_chunks()).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if not started:
+            # Leading whitespace of the file is stripped, even across chunks
+            text = text.lstrip()
+            started = bool(text)
+        buffer = buffer[position:] + text
+        position = 0
+        # A page can be cut while text (not only trailing whitespace) follows its limit
+        while NON_SPACE.search(buffer, position + page_char_limit):
+            page, position = _next_page(buffer, position, page_char_limit, None)
+            yield page
+
+    text = decoder.decode(b"", final=True)
+    buffer = (buffer[position:] + (text if started else text.lstrip())).rstrip()
+    position = 0
+    while position < len(buffer):
+        page, position = _next_page(buffer, position, page_char_limit, len(buffer))
+        yield page
@@ -0,0 +1,79 @@
+import threading
+from queue import Queue, Full
+
+
+# Textract result pages fetched ahead of the consumer (each holds up to 1000 blocks)
+TEXTRACT_LOOKAHEAD = 2
+
+# Seconds between two checks of the stop event while the queue is full
+STOP_CHECK_SECONDS = 0.5
+
+_DONE = object()
+
+
+def _put(results, item, stop):
+    """Puts item in the queue once there is room, returns False when the consumer stopped first."""
+    while not stop.is_set():
+        try:
+            results.put(item, timeout=STOP_CHECK_SECONDS)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _fetch_results(get_results, results, stop):
+    """Follows NextToken through all the result pages, putting each in the queue until the consumer stops."""
+    try:
+        next_token = None
+        while True:
+            response = get_results(next_token)
+            if not _put(results, response, stop):
+                return
+            next_token = response.get("NextToken")
+            if not next_token:
+                break
+    except Exception as e:
+        if not _put(results, e, stop):
+            return
+    _put(results, _DONE, stop)
+
+
+def iter_textract_pages(get_results, lookahead=TEXTRACT_LOOKAHEAD):
+    """
+    Yields (page_number, page_text) for every document page with text, in page order, as soon
+    as its lines are complete: Textract returns blocks in page order, so a page is complete once
+    any block of a later page arrives (or the results end). Up to `lookahead` result pages are
+    fetched in a background thread while the current one is parsed, the thread ends when the
+    generator is closed.
+
+    :param get_results: function(next_token) returning a get_document_text_detection response
+                        (next_token is None for the first call).
+    """
+    results = Queue(maxsize=max(1, lookahead))
+    # Set when the consumer stops early (e.g. the pipeline aborted), so the fetcher does not stay
+    # blocked on the queue holding result pages in the warm container
+    stop = threading.Event()
+    fetcher = threading.Thread(target=_fetch_results, args=(get_results, results, stop), name="textract-fetcher", daemon=True)
+    fetcher.start()
+
+    try:
+        lines = {}
+        while True:
+            response = results.get()
+            if response is _DONE:
+                break
+            if isinstance(response, Exception):
+                raise response
+            for block in response.get("Blocks", []):
+                page = block.get("Page", 1)
+                # Any block of a later page (its PAGE block comes first) completes the earlier ones
+                for done in sorted(number for number in lines if number < page):
+                    yield done, "\n".join(lines.pop(done))
+                if block["BlockType"] == "LINE":
+                    lines.setdefault(page, []).append(block["Text"])
+
+        for page in sorted(lines):
+            yield page, "\n".join(lines[page])
+    finally:
+        stop.set()
@@ -0,0 +1,107 @@
+import os
+import sys
+from bson.binary import Binary, BinaryVectorDtype
+
+
+# How chunk vectors are stored in documents_chunks:
+# - array: BSON array of doubles (~13 KB per voyage-3 vector)
+# - float32: BSON binary vector of float32 (~4 KB)
+# - int8: BSON binary vector of int8, scaled per vector (~1 KB), for an Atlas index with cosine similarity
+# - packed_bit: BSON binary vector of sign bits (128 bytes), for an Atlas index with euclidean similarity
+# The Atlas "vector_index" must be defined for the same type, queries are encoded to match.
+VECTOR_STORAGE = os.environ.get("VECTOR_STORAGE", "array")
+VECTOR_STORAGES = ["array", "float32", "int8", "packed_bit"]
+
+
+def quantize_int8(vector):
+    # Cosine similarity ignores the scale, so every vector can use its own
+    largest = max((abs(x) for x in vector), default=0.0) or 1.0
+    return [max(-127, min(127, round(x * 127 / largest))) for x in vector]
+
+
+def pack_bits(vector):
+    """Packs the sign of every dimension, first dimension in the most significant bit."""
+    packed = []
+    for start in range(0, len(vector), 8):
+        byte = 0
+        for i, x in enumerate(vector[start:start + 8]):
+            if x > 0:
+                byte |= 0x80 >> i
+        packed.append(byte)
+    return packed, (8 - len(vector) % 8) % 8
+
+
+def encode_vector(vector, storage=VECTOR_STORAGE):
+    if storage == "array":
+        return list(vector)
+    if storage == "float32":
+        return Binary.from_vector([float(x) for x in vector], BinaryVectorDtype.FLOAT32)
+    if storage == "int8":
+        return Binary.from_vector(quantize_int8(vector), BinaryVectorDtype.INT8)
+    if storage == "packed_bit":
+        packed, padding = pack_bits(vector)
+        return Binary.from_vector(packed, BinaryVectorDtype.PACKED_BIT, padding)
+    raise ValueError(f"Unknown vector storage: {storage}")
+
+
+def decode_vector(value):
+    """
+    Returns the stored vector as a list of numbers. Packed bits are expanded
+    to +1/-1 per dimension, int8 values are returned unscaled.
+    """
+    if not isinstance(value, Binary):
+        return list(value)
+    vector = value.as_vector()
+    if vector.dtype != BinaryVectorDtype.PACKED_BIT:
+        return list(vector.data)
+    bits = []
+    for byte in vector.data:
+        bits.extend(1.0 if byte & (0x80 >> i) else -1.0 for i in range(8))
+    return bits[:len(bits) - vector.padding]
+
+
+def storage_of(value):
+    if not isinstance(value, Binary):
+        return "array"
+    return {
+        BinaryVectorDtype.FLOAT32: "float32",
+        BinaryVectorDtype.INT8: "int8",
+        BinaryVectorDtype.PACKED_BIT: "packed_bit"
+    }[value.as_vector().dtype]
+
+
+def migrate_vectors(storage, collection=None, batch_size=500):
+    """
+    Rewrites the vectors of the existing chunks to `storage`, in batches of bulk updates.
+    Chunks already stored in that format are skipped, so it can be stopped and run again.
+    Vectors can only be converted from a higher precision to a lower one.
+    """
+    from pymongo import UpdateOne
+    if collection is None:
+        from resources import get_mongo_client
+        collection = get_mongo_client()["manufacturing_database"]["documents_chunks"]
+
+    precision = VECTOR_STORAGES.index(storage)
+    converted = skipped = 0
+    updates = []
+    for chunk in collection.find({"vector_storage": {"$ne": storage}}, {"vector": 1}).batch_size(batch_size):
+        if VECTOR_STORAGES.index(storage_of(chunk["vector"])) > precision:
+            skipped += 1
+            continue
+        updates.append(UpdateOne(
+            {"_id": chunk["_id"]},
+            {"$set": {"vector": encode_vector(decode_vector(chunk["vector"]), storage), "vector_storage": storage}}
+        ))
+        if len(updates) == batch_size:
+            converted += collection.bulk_write(updates, ordered=False).modified_count
+            updates = []
+            print(f"Converted {converted} chunks to {storage}")
+    if updates:
+        converted += collection.bulk_write(updates, ordered=False).modified_count
+    print(f"Migration to {storage} done: {converted} converted, {skipped} skipped (lower precision)")
+    return converted, skipped
+
+
+if __name__ == "__main__":
+    # python vector_codec.py <array|float32|int8|packed_bit>
+    migrate_vectors(sys.argv[1])
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+
+# SQS queue of the page range work items (set by the stack), or a SQLite file to run the workers locally
+WORK_QUEUE_URL = os.environ.get("WORK_QUEUE_URL", "")
+WORK_QUEUE_PATH = os.environ.get("WORK_QUEUE_PATH", "")
+
+# Seconds a received message stays invisible to other workers before it is delivered again
+DEFAULT_VISIBILITY_TIMEOUT = 960
+
+
+class SqsWorkQueue:
+    """Work queue on Amazon SQS. In Lambda, the SQS event source receives and deletes the messages."""
+
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from resources import get_client
+            self._client = get_client("sqs")
+        return self._client
+
+    def send(self, item):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(item))
+
+    def receive(self, max_items=1, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        """Returns [(receipt, item)], waiting up to 20 s for messages."""
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_items, 10),
+            VisibilityTimeout=visibility_timeout,
+            WaitTimeSeconds=20
+        )
+        return [(message["ReceiptHandle"], json.loads(message["Body"])) for message in response.get("Messages", [])]
+
+    def delete(self, receipt):
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=receipt)
+
+
+class SqliteWorkQueue:
+    """
+    Local stand-in for SqsWorkQueue with the same at-least-once semantics: a received item
+    is hidden for visibility_timeout seconds and delivered again unless it is deleted.
+    path=":memory:" keeps the queue in the process (one connection shared by its threads).
+    """
+
+    def __init__(self, path=":memory:", clock=time.time):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS work_items (id TEXT PRIMARY KEY, body TEXT, visible_at REAL, receipt TEXT, receives INTEGER DEFAULT 0)"
+        )
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def send(self, item):
+        with self._lock:
+            self.connection.execute(
+                "INSERT INTO work_items (id, body, visible_at) VALUES (?, ?, ?)",
+                (str(uuid.uuid4()), json.dumps(item), self.clock())
+            )
+
+    def receive(self, max_items=1, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        """Returns [(receipt, item)] of the visible items, oldest first (no waiting)."""
+        with self._lock:
+            now = self.clock()
+            rows = self.connection.execute(
+                "SELECT id, body FROM work_items WHERE visible_at <= ? ORDER BY rowid LIMIT ?", (now, max_items)
+            ).fetchall()
+            received = []
+            for item_id, body in rows:
+                receipt = str(uuid.uuid4())
+                self.connection.execute(
+                    "UPDATE work_items SET visible_at = ?, receipt = ?, receives = receives + 1 WHERE id = ?",
+                    (now + visibility_timeout, receipt, item_id)
+                )
+                received.append((receipt, json.loads(body)))
+            return received
+
+    def delete(self, receipt):
+        with self._lock:
+            self.connection.execute("DELETE FROM work_items WHERE receipt = ?", (receipt,))
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM work_items").fetchone()[0]
+
+
+def get_work_queue():
+    """The configured work queue, None when fan-out is not configured."""
+    if WORK_QUEUE_URL:
+        return SqsWorkQueue(WORK_QUEUE_URL)
+    if WORK_QUEUE_PATH:
+        return SqliteWorkQueue(WORK_QUEUE_PATH)
+    return None
+
+
+def run_worker(work_queue, handle, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, stop_when_empty=True):
+    """
+    Receives and handles items until the queue is empty (local workers; in Lambda the SQS
+    event source does this). An item whose handler raises is left to be delivered again.
+
+    :return: number of items handled successfully.
+    """
+    handled = 0
+    while True:
+        received = work_queue.receive(1, visibility_timeout)
+        if not received:
+            if stop_when_empty:
+                return handled
+            continue
+        for receipt, item in received:
+            try:
+                handle(item)
+            except Exception as e:
+                print(f"❌ Work item failed, it will be retried: {str(e)}")
+                continue
+            work_queue.delete(receipt)
+            handled += 1
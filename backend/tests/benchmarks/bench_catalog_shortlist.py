@@ -0,0 +1,72 @@
+"""
+Prompt size and assembly latency of AVAILABLE_DOCS as the catalog grows,
+full catalog versus the top-K shortlist.
+
+    python -m tests.benchmarks.bench_catalog_shortlist
+"""
+import math
+import random
+import time
+
+from catalog import format_catalog, shortlist_documents, CATALOG_TOP_K
+
+
+MANUFACTURERS = ["FANUC", "ABB", "KUKA", "Yaskawa", "Ligent", "Siemens", "Omron", "Denso"]
+TOPICS = ["safety information", "servo alarms", "installation", "maintenance schedule", "error codes", "spare parts"]
+DIMENSIONS = 256
+
+
+def synthetic_catalog(size, rng):
+    documents, vectors = [], {}
+    for i in range(size):
+        manufacturer = rng.choice(MANUFACTURERS)
+        model = f"{manufacturer[:2].upper()}-{rng.randint(100, 999)}"
+        topic = rng.choice(TOPICS)
+        name = f"{manufacturer} {model} {topic} manual {i}"
+        documents.append({
+            "doc_name": name,
+            "manufacturer": manufacturer,
+            "model": model,
+            "doc_description": f"{topic.capitalize()} for the {manufacturer} {model}, covering procedures, warnings and reference tables for technicians."
+        })
+        vectors[name] = [rng.gauss(0, 1) for _ in range(DIMENSIONS)]
+    return documents, vectors
+
+
+def brute_force_search(vectors, rng):
+    # Stand-in for $vectorSearch: exact cosine similarity against a random query vector
+    query_vector = [rng.gauss(0, 1) for _ in range(DIMENSIONS)]
+    query_norm = math.sqrt(sum(x * x for x in query_vector))
+
+    def search(query, limit):
+        scores = []
+        for name, vector in vectors.items():
+            dot = sum(a * b for a, b in zip(query_vector, vector))
+            scores.append((dot / (query_norm * math.sqrt(sum(x * x for x in vector))), name))
+        return [name for _, name in sorted(scores, reverse=True)[:limit]]
+    return search
+
+
+if __name__ == "__main__":
+    rng = random.Random(7)
+    query = "FANUC FA-123 servo alarm SRVO-062 safety information"
+    print(f"K = {CATALOG_TOP_K}, ~4 characters per token")
+    print(f"{'documents':>10} {'full tokens':>12} {'full build ms':>14} {'shortlist tokens':>17} {'shortlist ms':>13} {'local search ms':>16}")
+    for size in (50, 200, 1000, 5000):
+        documents, vectors = synthetic_catalog(size, rng)
+        search = brute_force_search(vectors, rng)
+
+        start = time.perf_counter()
+        full_text = format_catalog(documents)
+        full_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        ranked = search(query, 2 * CATALOG_TOP_K)
+        search_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        shortlist_text = format_catalog(shortlist_documents(query, documents, CATALOG_TOP_K, lambda q, limit: ranked))
+        shortlist_ms = (time.perf_counter() - start) * 1000
+
+        print(f"{size:>10} {len(full_text) // 4:>12} {full_ms:>14.2f} {len(shortlist_text) // 4:>17} {shortlist_ms:>13.2f} {search_ms:>16.1f}")
+    print("local search ms is the in-process exact search used here in place of Atlas $vectorSearch")
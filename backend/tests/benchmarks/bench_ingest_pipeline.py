@@ -0,0 +1,91 @@
+"""
+Wall clock of the staged ingestion pipeline against running the phases one after another,
+with simulated LLM, embedding and write latencies.
+
+    python -m tests.benchmarks.bench_ingest_pipeline
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.fakes import FakeCollection
+from page_structuring import PageStructurer
+from section_grouping import group_sections
+from ingestion_state import IngestionState
+from ingest_pipeline import DocumentIngestion
+from mongodb_tools import ChunkWriter
+from section_chunker import SectionChunker
+
+
+PAGES = 120
+MAX_IN_FLIGHT = 8
+STRUCTURE_LATENCY = 0.05
+EMBED_LATENCY = 0.08
+METADATA_LATENCY = 0.3
+EMBED_BATCH = 16
+METADATA = {"doc_name": "Manual", "doc_type": "service_manual", "doc_description": "", "manufacturer": "", "model": ""}
+
+
+# Steps of about 200 tokens, so the chunker merges a few of them per chunk as in a real manual
+STEP_TEXT = "Disconnect the pulse coder cable and check the battery voltage. " * 15
+
+
+def invoke(prompt):
+    time.sleep(STRUCTURE_LATENCY)
+    return "<H2>Section</H2><BODY>text</BODY>" + "".join(f"<H3>Step {i}</H3><BODY>step {i} {STEP_TEXT}</BODY>" for i in range(3))
+
+
+def embed(texts):
+    time.sleep(EMBED_LATENCY)
+    return [[0.1] * 8 for _ in texts]
+
+
+def sequential(pages):
+    start = time.perf_counter()
+    time.sleep(METADATA_LATENCY)
+    structurer = PageStructurer(invoke, max_in_flight=MAX_IN_FLIGHT)
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as executor:
+        responses = list(executor.map(structurer.structure, range(len(pages)), pages))
+    # Split and merged into chunks like the pipeline does (see section_chunker)
+    chunker = SectionChunker()
+    chunks = [chunk for section in group_sections(responses) for chunk in chunker.add(section)] + chunker.finish()
+    writer = ChunkWriter(FakeCollection())
+    for batch_start in range(0, len(chunks), EMBED_BATCH):
+        batch = chunks[batch_start:batch_start + EMBED_BATCH]
+        for chunk, vector in zip(batch, embed([c["text"] for c in batch])):
+            writer.add({**chunk, "vector": vector})
+        writer.flush()
+    return time.perf_counter() - start, len(chunks)
+
+
+def pipelined(pages):
+    state = IngestionState("manual.pdf", FakeCollection(), FakeCollection(), FakeCollection())
+    metadata_ready = time.perf_counter() + METADATA_LATENCY
+
+    def get_metadata():
+        time.sleep(max(0.0, metadata_ready - time.perf_counter()))
+        return METADATA
+
+    start = time.perf_counter()
+    ingestion = DocumentIngestion(
+        "manual.pdf", iter(pages), state,
+        structure=lambda i, page_text: invoke(page_text),
+        embed=embed, writer=ChunkWriter(FakeCollection()), get_metadata=get_metadata,
+        structure_workers=MAX_IN_FLIGHT, embed_batch=EMBED_BATCH
+    )
+    assert ingestion.run()
+    return time.perf_counter() - start, ingestion.section_count, ingestion.pipeline.stats()
+
+
+if __name__ == "__main__":
+    pages = [f"page {i} text" for i in range(PAGES)]
+    sequential_s, chunks = sequential(pages)
+    pipelined_s, pipelined_chunks, stats = pipelined(pages)
+    assert chunks == pipelined_chunks
+
+    print(f"\n{PAGES} pages, {chunks} chunks, {STRUCTURE_LATENCY * 1000:.0f} ms per page call ({MAX_IN_FLIGHT} in flight), "
+          f"{EMBED_LATENCY * 1000:.0f} ms per embedding batch of {EMBED_BATCH}")
+    print(f"{'sequential phases':>20} {sequential_s:>7.2f} s")
+    print(f"{'staged pipeline':>20} {pipelined_s:>7.2f} s ({sequential_s / pipelined_s:.1f}x)")
+    print(f"\n{'stage':>10} {'items':>6} {'busy (s)':>9} {'blocked (s)':>12} {'util':>5} {'queue avg':>10} {'queue max':>10}")
+    for name, stage in stats.items():
+        print(f"{name:>10} {stage['items_in']:>6} {stage['busy_s']:>9.2f} {stage['blocked_s']:>12.2f} {stage['utilization']:>5.2f} {stage['queue_avg']:>10.1f} {stage['queue_max']:>10}")
@@ -0,0 +1,56 @@
+"""
+Latency of the local NumPy vector index, exact versus IVF, with and without the
+doc_name filter, and IVF recall@10 against the exact results.
+
+    python -m tests.benchmarks.bench_local_vector_search [rows]
+"""
+import sys
+import time
+import tempfile
+import numpy as np
+
+from local_vector_search import LocalVectorIndex
+
+
+DIMENSIONS = 1024
+DOCUMENTS = 200
+QUERIES = 50
+LIMIT = 10
+
+
+def synthetic_index(rows, clusters, rng):
+    # Clustered vectors, closer to real embeddings than uniform noise
+    topics = rng.standard_normal((64, DIMENSIONS)).astype(np.float32)
+    vectors = topics[rng.integers(0, len(topics), rows)] + 0.5 * rng.standard_normal((rows, DIMENSIONS)).astype(np.float32)
+    chunks = [{"_id": str(i), "doc_name": f"doc {i % DOCUMENTS}", "file_name": f"doc_{i % DOCUMENTS}.pdf", "page": "1", "text": ""} for i in range(rows)]
+    return LocalVectorIndex.build(tempfile.mkdtemp(), chunks, vectors, clusters), vectors
+
+
+def measure(index, queries, doc_list, nprobe):
+    start = time.perf_counter()
+    results = [index.search(query, doc_list, LIMIT, nprobe) for query in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def recall(results, exact):
+    hits = sum(len({r["_id"] for r in got} & {r["_id"] for r in expected}) for got, expected in zip(results, exact))
+    return hits / sum(len(expected) for expected in exact)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(0)
+    clusters = int(np.sqrt(rows))
+    start = time.perf_counter()
+    index, vectors = synthetic_index(rows, clusters, rng)
+    print(f"{rows} x {DIMENSIONS} float32 ({rows * DIMENSIONS * 4 / 1e6:.0f} MB), {clusters} IVF clusters, built in {time.perf_counter() - start:.1f} s")
+    queries = vectors[rng.integers(0, rows, QUERIES)] + 0.3 * rng.standard_normal((QUERIES, DIMENSIONS)).astype(np.float32)
+
+    print(f"{'search':>24} {'ms/query':>9} {'recall@10':>10}")
+    for doc_list in ([], [f"doc {i}" for i in range(5)]):
+        label = "filtered" if doc_list else "all docs"
+        exact_ms, exact = measure(index, queries, doc_list, None)
+        print(f"{'exact, ' + label:>24} {exact_ms:>9.2f} {1.0:>10.3f}")
+        for nprobe in (1, 4, 16):
+            ivf_ms, results = measure(index, queries, doc_list, nprobe)
+            print(f"{f'ivf nprobe={nprobe}, ' + label:>24} {ivf_ms:>9.2f} {recall(results, exact):>10.3f}")
@@ -0,0 +1,44 @@
+"""
+Wall-clock scaling of the page structuring stage against a fake Bedrock client.
+
+    python -m tests.benchmarks.bench_page_structuring
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.fakes import FakeBedrockClient, invoke_with
+from page_structuring import PageStructurer
+
+
+PAGES = 100
+LATENCY = 0.05
+
+
+def run(max_in_flight, capacity=None):
+    client = FakeBedrockClient(latency=LATENCY, capacity=capacity)
+    pages = [f"page {i} text" for i in range(PAGES)]
+    start = time.perf_counter()
+    structurer = PageStructurer(invoke_with(client), max_in_flight=max_in_flight, base_backoff=0.01)
+    # As many threads as the structure stage of the ingestion, the limiter bounds the calls in flight
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        responses = list(executor.map(structurer.structure, range(PAGES), pages))
+    elapsed = time.perf_counter() - start
+    assert len(responses) == PAGES
+    return elapsed, client
+
+
+if __name__ == "__main__":
+    rows = []
+    baseline = None
+    for max_in_flight in (1, 2, 4, 8, 16, 32):
+        elapsed, client = run(max_in_flight)
+        baseline = baseline or elapsed
+        rows.append((f"{max_in_flight}", elapsed, baseline / elapsed, client.throttles))
+    # Bedrock only accepts 6 concurrent calls: the limiter must back off and still finish
+    elapsed, client = run(32, capacity=6)
+    rows.append(("32 (capacity 6)", elapsed, baseline / elapsed, client.throttles))
+
+    print(f"\n{PAGES} pages, {LATENCY * 1000:.0f} ms simulated Bedrock latency")
+    print(f"{'max in flight':>16} {'wall clock (s)':>15} {'speedup':>8} {'throttles':>10}")
+    for name, elapsed, speedup, throttles in rows:
+        print(f"{name:>16} {elapsed:>15.2f} {speedup:>7.1f}x {throttles:>10}")
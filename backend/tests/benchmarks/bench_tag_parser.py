@@ -0,0 +1,56 @@
+"""
+Compares the quadratic extract_first_xml_element loop used on the concatenated
+document with the single-pass iter_document_events tokenizer.
+
+    python -m tests.benchmarks.bench_tag_parser [pages]
+"""
+import sys
+import time
+
+from tag_parser import extract_first_xml_element, iter_document_events
+
+
+def synthetic_page_response(page):
+    body = "Check the servo amplifier connection and reset the alarm before restarting the robot. " * 2
+    return (
+        f"<H1>Chapter {page // 50 + 1}</H1>\n"
+        f"<H2>Section {page // 5 + 1}</H2>\n"
+        + "".join(f"<H3>Step {page}.{step}</H3>\n<BODY>{body}</BODY>\n" for step in range(4))
+    )
+
+
+def parse_concatenated(responses):
+    formated_doc = ""
+    for i, response in enumerate(responses):
+        formated_doc += f"\n<PAGE>{i+1}</PAGE>\n"
+        formated_doc += response
+    events = []
+    doc = formated_doc
+    while (doc):
+        text, tag, doc = extract_first_xml_element(doc)
+        if tag:
+            events.append((tag, text))
+    return events
+
+
+def parse_streaming(responses):
+    return list(iter_document_events(responses))
+
+
+if __name__ == "__main__":
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    responses = [synthetic_page_response(page) for page in range(pages)]
+    size_mb = sum(len(r) for r in responses) / 1e6
+
+    start = time.perf_counter()
+    old_events = parse_concatenated(responses)
+    old_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_events = parse_streaming(responses)
+    new_elapsed = time.perf_counter() - start
+
+    assert old_events == new_events, "tokenizers disagree"
+    print(f"{pages} pages, {size_mb:.1f} MB of responses, {len(new_events)} events")
+    print(f"extract_first_xml_element loop: {old_elapsed:8.3f} s")
+    print(f"iter_document_events:           {new_elapsed:8.3f} s  ({old_elapsed / new_elapsed:.0f}x faster)")
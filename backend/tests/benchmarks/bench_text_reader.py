@@ -0,0 +1,46 @@
+"""
+Peak memory and time of splitting a large .txt upload into pages: whole object in memory
+against the streaming reader, with the S3 body simulated by an in-memory stream.
+
+    python -m tests.benchmarks.bench_text_reader
+"""
+import io
+import time
+import tracemalloc
+
+from tests.unit.test_text_reader import split_whole_text
+from text_reader import iter_text_pages, TEXT_PAGE_CHAR_LIMIT, TEXT_READ_CHUNK_BYTES
+
+
+SIZE_MB = 50
+LINE = "2024-03-02 14:07:55 SRVO-062 BZAL alarm (Group:1 Axis:3) — técnico: batería reemplazada\n"
+
+
+def measure(split):
+    tracemalloc.start()
+    start = time.perf_counter()
+    pages = split()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return pages, elapsed, peak
+
+
+def body(data):
+    stream = io.BytesIO(data)
+    return iter(lambda: stream.read(TEXT_READ_CHUNK_BYTES), b"")
+
+
+if __name__ == "__main__":
+    data = (LINE * (SIZE_MB * 1024 * 1024 // len(LINE.encode("utf-8")))).encode("utf-8")
+    rows = [
+        ("whole object", lambda: split_whole_text(data, TEXT_PAGE_CHAR_LIMIT)),
+        ("streamed, list", lambda: list(iter_text_pages(body(data)))),  # what handle_text_file returned before it was lazy
+        ("streamed, lazy", lambda: sum(1 for _ in iter_text_pages(body(data))))
+    ]
+    print(f"\n{len(data) / 1024 / 1024:.0f} MB of text, {TEXT_PAGE_CHAR_LIMIT}-character pages, {TEXT_READ_CHUNK_BYTES // 1024} KB reads")
+    print(f"{'reader':>16} {'pages':>8} {'time (s)':>9} {'peak MB (excl. input)':>22}")
+    for name, split in rows:
+        pages, elapsed, peak = measure(split)
+        count = pages if isinstance(pages, int) else len(pages)
+        print(f"{name:>16} {count:>8} {elapsed:>9.2f} {peak / 1024 / 1024:>22.1f}")
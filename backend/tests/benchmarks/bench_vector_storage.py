@@ -0,0 +1,49 @@
+"""
+Per-chunk BSON size of each vector storage format and its recall@10 against
+float64 cosine search, on synthetic clustered voyage-3 sized vectors.
+
+    python -m tests.benchmarks.bench_vector_storage [rows]
+"""
+import sys
+import bson
+import numpy as np
+
+from vector_codec import encode_vector, decode_vector, VECTOR_STORAGES
+
+
+DIMENSIONS = 1024
+QUERIES = 50
+LIMIT = 10
+
+
+def top_k(matrix, queries):
+    scores = queries @ matrix.T
+    return [set(np.argsort(-row)[:LIMIT]) for row in scores]
+
+
+def normalize(matrix):
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = np.random.default_rng(0)
+    topics = rng.standard_normal((64, DIMENSIONS))
+    vectors = topics[rng.integers(0, len(topics), rows)] + 0.5 * rng.standard_normal((rows, DIMENSIONS))
+    queries = vectors[rng.integers(0, rows, QUERIES)] + 0.3 * rng.standard_normal((QUERIES, DIMENSIONS))
+    exact = top_k(normalize(vectors), normalize(queries))
+
+    print(f"{rows} x {DIMENSIONS} vectors, {QUERIES} queries")
+    print(f"{'storage':>10} {'bytes/chunk':>12} {'recall@10':>10}")
+    for storage in VECTOR_STORAGES:
+        encoded = [encode_vector(vector.tolist(), storage) for vector in vectors]
+        size = np.mean([len(bson.encode({"vector": value})) for value in encoded[:100]])
+        decoded = np.array([decode_vector(value) for value in encoded], dtype=np.float64)
+        if storage == "packed_bit":
+            # Atlas scores bit vectors by hamming distance, so the query is binarized as well
+            query_matrix = np.array([decode_vector(encode_vector(query.tolist(), storage)) for query in queries])
+        else:
+            query_matrix = queries
+        found = top_k(normalize(decoded), normalize(query_matrix))
+        hits = sum(len(got & expected) for got, expected in zip(found, exact))
+        print(f"{storage:>10} {size:>12.0f} {hits / (QUERIES * LIMIT):>10.3f}")
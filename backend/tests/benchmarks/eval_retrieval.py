@@ -0,0 +1,141 @@
+"""
+Offline evaluation of chunk retrieval: recall@k and latency of vector, full-text and
+hybrid (reciprocal rank fusion) search against the fixture corpus in
+tests/fixtures/retrieval_corpus.json.
+
+The Atlas indexes are replaced by offline stand-ins: a hashed character n-gram
+embedder with the local NumPy vector index (exact and IVF) for $vectorSearch,
+and BM25 with an exact phrase boost for $search. The fusion is the production
+reciprocal_rank_fusion.
+
+    python -m tests.benchmarks.eval_retrieval
+"""
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import tempfile
+from collections import Counter
+
+from rank_fusion import reciprocal_rank_fusion
+from local_vector_search import LocalVectorIndex
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fixtures", "retrieval_corpus.json")
+DIMENSIONS = 512
+KS = (1, 3, 5)
+
+
+def load_fixture(path=FIXTURE):
+    with open(path) as f:
+        return json.load(f)
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def hashed_embedding(text, dimensions=DIMENSIONS):
+    """Deterministic stand-in for an embedding model: hashed word and character trigram counts, L2-normalized."""
+    vector = [0.0] * dimensions
+    for word in tokenize(text):
+        padded = f" {word} "
+        features = [word] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+        for feature in features:
+            vector[int(hashlib.md5(feature.encode()).hexdigest(), 16) % dimensions] += 1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class OfflineVectorSearch:
+    """Local NumPy index over the hashed embeddings of the fixture chunks."""
+
+    def __init__(self, chunks, embed=hashed_embedding, clusters=0, nprobe=None):
+        self.index = LocalVectorIndex.build(tempfile.mkdtemp(), chunks, [embed(chunk["text"]) for chunk in chunks], clusters)
+        self.nprobe = nprobe
+
+    def __call__(self, query_vector, doc_list, limit):
+        return self.index.search(query_vector, doc_list, limit, self.nprobe)
+
+
+class OfflineTextSearch:
+    """BM25 over the chunk text, with a boost for chunks containing the exact query phrase."""
+
+    def __init__(self, chunks, k1=1.2, b=0.75, phrase_boost=3.0):
+        self.chunks = chunks
+        self.k1, self.b, self.phrase_boost = k1, b, phrase_boost
+        self.term_counts = [Counter(tokenize(chunk["text"])) for chunk in chunks]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths)
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    def __call__(self, search_text, doc_list, limit):
+        terms = tokenize(search_text)
+        phrase = search_text.lower().strip()
+        scored = []
+        for chunk, counts, length in zip(self.chunks, self.term_counts, self.lengths):
+            if doc_list and chunk["doc_name"] not in doc_list:
+                continue
+            score = 0.0
+            for term in terms:
+                tf = counts.get(term, 0)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / self.average_length))
+            if score and phrase in chunk["text"].lower():
+                score *= self.phrase_boost
+            if score:
+                scored.append((score, chunk))
+        scored.sort(key=lambda item: -item[0])
+        return [{**chunk, "score": score} for score, chunk in scored[:limit]]
+
+
+def hybrid(vector_search, text_search, vector_weight=1.0, text_weight=1.0, candidates=20):
+    def search(query_vector, search_text, doc_list, limit):
+        ranked_lists = [vector_search(query_vector, doc_list, candidates), text_search(search_text, doc_list, candidates)]
+        return reciprocal_rank_fusion(ranked_lists, [vector_weight, text_weight])[:limit]
+    return search
+
+
+def evaluate(search, queries, embed=hashed_embedding, ks=KS):
+    """
+    :param search: function(query_vector, search_text, doc_list, limit) returning ranked chunks with "_id".
+    :return: {"recall@k": ..., "latency_ms": mean search latency}
+    """
+    recalls = {k: 0.0 for k in ks}
+    elapsed = 0.0
+    for item in queries:
+        query_vector = embed(item["query"])
+        start = time.perf_counter()
+        results = search(query_vector, item["query"], [], max(ks))
+        elapsed += time.perf_counter() - start
+        ids = [result["_id"] for result in results]
+        relevant = set(item["relevant"])
+        for k in ks:
+            recalls[k] += len(relevant & set(ids[:k])) / len(relevant)
+    report = {f"recall@{k}": round(recalls[k] / len(queries), 3) for k in ks}
+    report["latency_ms"] = round(elapsed / len(queries) * 1000, 3)
+    return report
+
+
+if __name__ == "__main__":
+    fixture = load_fixture()
+    vector_search = OfflineVectorSearch(fixture["chunks"])
+    ivf_search = OfflineVectorSearch(fixture["chunks"], clusters=4, nprobe=2)
+    text_search = OfflineTextSearch(fixture["chunks"])
+    configurations = {
+        "vector": lambda qv, text, docs, limit: vector_search(qv, docs, limit),
+        "vector ivf 2/4": lambda qv, text, docs, limit: ivf_search(qv, docs, limit),
+        "text": lambda qv, text, docs, limit: text_search(text, docs, limit),
+        "hybrid 1:1": hybrid(vector_search, text_search),
+        "hybrid 2:1 (vector)": hybrid(vector_search, text_search, vector_weight=2.0),
+        "hybrid 1:2 (text)": hybrid(vector_search, text_search, text_weight=2.0),
+    }
+    print(f"{len(fixture['chunks'])} chunks, {len(fixture['queries'])} queries")
+    print(f"{'mode':>20} " + " ".join(f"{f'recall@{k}':>9}" for k in KS) + f" {'latency ms':>11}")
+    for name, search in configurations.items():
+        report = evaluate(search, fixture["queries"])
+        print(f"{name:>20} " + " ".join(f"{report[f'recall@{k}']:>9.3f}" for k in KS) + f" {report['latency_ms']:>11.3f}")
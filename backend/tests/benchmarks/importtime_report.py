@@ -0,0 +1,48 @@
+"""
+Import-time (cold start) cost of each Lambda handler module, from `python -X importtime`.
+Handlers must import without touching the network: secrets and clients are created on
+first use (see lambda/resources.py), so the report only measures module loading.
+
+    python -m tests.benchmarks.importtime_report [top]
+"""
+import os
+import sys
+import subprocess
+
+
+HANDLERS = ["process_message", "index_new_document"]
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "lambda")
+
+
+def import_times(module):
+    """Returns [(cumulative_us, self_us, name)] for every module imported by `module`."""
+    env = {**os.environ, "PYTHONPATH": os.path.abspath(LAMBDA_DIR)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return times
+
+
+if __name__ == "__main__":
+    top = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for handler in HANDLERS:
+        try:
+            times = import_times(handler)
+        except RuntimeError as e:
+            print(f"{handler}: {e}\n")
+            continue
+        total = next(cumulative for cumulative, _, name in times if name.strip() == handler)
+        print(f"{handler}: {total / 1000:.0f} ms, {len(times)} modules")
+        print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+        for cumulative, self_us, name in sorted(times, reverse=True)[:top]:
+            print(f"{cumulative / 1000:>14.1f} {self_us / 1000:>8.1f}  {name.strip()}")
+        print()
@@ -0,0 +1,208 @@
+import io
+import json
+import time
+import threading
+
+
+THROTTLING_ERROR = "An error occurred (ThrottlingException) when calling the InvokeModel operation: Too many requests, please wait before trying again."
+
+
+class FakeBedrockClient:
+    """
+    Minimal stand-in for boto3's bedrock-runtime client.
+    Every call sleeps `latency` seconds (or model_latency[modelId]), calls above `capacity`
+    concurrent requests are throttled and so is every call to a model in `throttled_models`.
+    """
+
+    def __init__(self, latency=0.05, capacity=None, respond=None, model_latency=None, throttled_models=()):
+        self.latency = latency
+        self.capacity = capacity
+        self.respond = respond or (lambda prompt: "<BODY>ok</BODY>")
+        self.model_latency = model_latency or {}
+        self.throttled_models = set(throttled_models)
+        self.model_calls = {}
+        self.calls = 0
+        self.throttles = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body):
+        with self._lock:
+            self.calls += 1
+            self.model_calls[modelId] = self.model_calls.get(modelId, 0) + 1
+            if modelId in self.throttled_models or (self.capacity is not None and self.in_flight >= self.capacity):
+                self.throttles += 1
+                raise Exception(THROTTLING_ERROR)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.model_latency.get(modelId, self.latency))
+            prompt = json.loads(body)["messages"][0]["content"][0]["text"]
+            payload = {"content": [{"type": "text", "text": self.respond(prompt)}]}
+            return {"body": io.BytesIO(json.dumps(payload).encode("utf-8"))}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def invoke_with(client, model_id="us.anthropic.claude-3-7-sonnet-20250219-v1:0"):
+    """Returns an invoke(prompt) function with the same error contract as embedding.invoke_claude_x."""
+
+    def invoke(prompt):
+        native_request = {"messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}]}
+        try:
+            response = client.invoke_model(modelId=model_id, body=json.dumps(native_request))
+            return json.loads(response["body"].read())["content"][0]["text"]
+        except Exception as e:
+            if "ThrottlingException" in str(e):
+                return "ERROR: All models throttled or unavailable."
+            return f"ERROR: {str(e)}"
+
+    return invoke
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def _matches(document, filter):
+    for key, condition in filter.items():
+        value = document.get(key)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$gte" and (value is None or value < operand):
+                    return False
+                if op == "$lt" and (value is None or value >= operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+_COMPARISONS = {"$gt": lambda a, b: a > b, "$gte": lambda a, b: a >= b, "$lt": lambda a, b: a < b, "$lte": lambda a, b: a <= b}
+
+
+def _evaluate(expression, document):
+    # Projection expressions: {"$filter": {"input": "$field", "cond": {"$gt": ["$$this.key", value]}}}
+    spec = expression["$filter"]
+    (operator, (field, value)), = spec["cond"].items()
+    key = field[len("$$this."):]
+    return [item for item in document.get(spec["input"][1:]) or [] if _COMPARISONS[operator](item.get(key), value)]
+
+
+class FakeCollection:
+    """In-memory stand-in for the subset of the pymongo collection API used by the Lambdas."""
+
+    def __init__(self):
+        self.documents = []
+        self._next_id = 1
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id - 1
+
+    def find_one(self, filter=None, projection=None):
+        return next(iter(self.find(filter, projection)), None)
+
+    def find(self, filter=None, projection=None, sort=None):
+        documents = [d for d in self.documents if _matches(d, filter or {})]
+        for key, direction in reversed(sort or []):
+            documents.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        if projection and any(v for k, v in projection.items() if k != "_id"):
+            computed = {k: v for k, v in projection.items() if isinstance(v, dict)}
+            documents = [{**{k: v for k, v in d.items() if k not in computed and projection.get(k, k == "_id")},
+                          **{k: _evaluate(expression, d) for k, expression in computed.items()}} for d in documents]
+        elif projection:
+            # Exclusion projection
+            documents = [{k: v for k, v in d.items() if projection.get(k, 1)} for d in documents]
+        return [dict(d) for d in documents]
+
+    def count_documents(self, filter):
+        return len(self.find(filter))
+
+    def insert_one(self, document):
+        document.setdefault("_id", self._new_id())
+        self.documents.append(dict(document))
+        return _Result(inserted_id=document["_id"])
+
+    def insert_many(self, documents, ordered=True):
+        ids = [self.insert_one(document).inserted_id for document in documents]
+        return _Result(inserted_ids=ids)
+
+    def update_one(self, filter, update, upsert=False):
+        document = next((d for d in self.documents if _matches(d, filter)), None)
+        upserted_id = None
+        if document is None:
+            if not upsert:
+                return _Result(matched_count=0, upserted_id=None)
+            document = {k: v for k, v in filter.items() if not isinstance(v, dict)}
+            document["_id"] = upserted_id = self._new_id()
+            document.update(update.get("$setOnInsert", {}))
+            self.documents.append(document)
+        document.update(update.get("$set", {}))
+        for key, amount in update.get("$inc", {}).items():
+            document[key] = document.get(key, 0) + amount
+        for key in update.get("$unset", {}):
+            document.pop(key, None)
+        for key, value in update.get("$push", {}).items():
+            document.setdefault(key, []).append(value)
+        for key, value in update.get("$addToSet", {}).items():
+            if value not in document.setdefault(key, []):
+                document[key].append(value)
+        return _Result(matched_count=0 if upserted_id else 1, upserted_id=upserted_id)
+
+    def update_many(self, filter, update):
+        matched = [d for d in self.documents if _matches(d, filter)]
+        for document in matched:
+            document.update(update.get("$set", {}))
+        return _Result(matched_count=len(matched), modified_count=len(matched))
+
+    def bulk_write(self, requests, ordered=True):
+        # pymongo UpdateOne requests
+        matched = sum(self.update_one(request._filter, request._doc, upsert=request._upsert).matched_count for request in requests)
+        return _Result(matched_count=matched, modified_count=matched)
+
+    def create_index(self, keys, **kwargs):
+        return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        self.delete_many(filter)
+        if upsert:
+            self.insert_one(dict(replacement))
+        return _Result(upserted_id=None)
+
+    def delete_many(self, filter):
+        before = len(self.documents)
+        self.documents = [d for d in self.documents if not _matches(d, filter)]
+        return _Result(deleted_count=before - len(self.documents))
+
+
+class RejectingCollection(FakeCollection):
+    """FakeCollection whose insert_many rejects the documents matched by reject(document), like an unordered bulk write."""
+
+    def __init__(self, reject):
+        super().__init__()
+        self.reject = reject
+        self.insert_calls = []
+
+    def insert_many(self, documents, ordered=True):
+        from pymongo.errors import BulkWriteError
+        self.insert_calls.append(len(documents))
+        rejected = [i for i, document in enumerate(documents) if self.reject(document)]
+        for i, document in enumerate(documents):
+            if i not in rejected:
+                self.insert_one(document)
+        if rejected:
+            raise BulkWriteError({
+                "nInserted": len(documents) - len(rejected),
+                "writeErrors": [{"index": i, "code": 11000, "errmsg": "E11000 duplicate key error"} for i in rejected]
+            })
+        return _Result(inserted_ids=[document["_id"] for document in documents])
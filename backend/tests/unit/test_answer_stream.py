@@ -0,0 +1,54 @@
+import json
+from answer_stream import AnswerStream, display_text
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_answer_is_relayed_once_the_tag_opens():
+    clock = Clock()
+    published = []
+    stream = AnswerStream(published.append, interval=0.5, clock=clock)
+    for delta in ["<IMPROVED_USER_QUERY>q</IMPROVED_USER_QUERY>\n<ANS", "WER>Check the ", "encoder cable"]:
+        stream.feed(delta)
+        clock.now += 0.3
+    assert published == ["Check the"]
+
+    stream.feed(" and reset.</ANSWER>\n<ACTION>RESPOND</ACTION>")
+    stream.flush()
+    assert published == ["Check the", "Check the encoder cable and reset."]
+    assert stream.first_answer_at == 0.3
+
+
+def test_other_actions_publish_nothing():
+    published = []
+    stream = AnswerStream(published.append)
+    stream.feed("<DOCS>*</DOCS><SEARCH_FOR>SRVO-062</SEARCH_FOR><ACTION>QUERY_DOCS</ACTION>")
+    stream.flush()
+    assert published == []
+
+
+def test_display_text_strips_sources_and_unfinished_tags():
+    answer = "Replace the battery: <SOURCE doc_file_name='r30ib.pdf' page='12'>back up the pulse coder</SOURCE> then <SOURCE doc_file"
+    assert display_text(answer) == "Replace the battery: back up the pulse coder then"
+
+
+def test_answer_decoded_in_any_deltas_matches_the_whole_response():
+    response = "<ACTION>RESPOND</ACTION>\n<ANSWER>Check the <SOURCE doc_file_name='a.pdf' page='2'>fuse</SOURCE> first.</ANSWER>\n<DOCS>*</DOCS>"
+    tool_input = json.dumps({"action": "RESPOND", "answer": "Torque to 12 N·m \"dry\" 🔧\nthen reset"})
+    for size in (1, 2, 3, 5, 8):
+        published = []
+        stream = AnswerStream(published.append, interval=0.0)
+        for i in range(0, len(response), size):
+            stream.feed(response[i:i + size])
+        assert stream.answer() == "Check the <SOURCE doc_file_name='a.pdf' page='2'>fuse</SOURCE> first."
+
+        stream = AnswerStream(published.append, interval=0.0, json_field="answer")
+        for i in range(0, len(tool_input), size):
+            stream.feed(tool_input[i:i + size])
+        assert stream.answer() == "Torque to 12 N·m \"dry\" 🔧\nthen reset"
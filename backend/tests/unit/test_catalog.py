@@ -0,0 +1,38 @@
+import catalog
+from catalog import shortlist_documents, format_document
+
+
+DOCUMENTS = [
+    {"doc_name": "R-30iB Operator Manual", "manufacturer": "FANUC", "model": "R-30iB", "doc_description": "Controller operation"},
+    {"doc_name": "FANUC Safety Handbook", "manufacturer": "FANUC", "model": "", "doc_description": "Safety information"},
+    {"doc_name": "inCube20 Installation", "manufacturer": "Ligent", "model": "inCube20", "doc_description": "Installation"},
+    {"doc_name": "IRB 6700 Service Manual", "manufacturer": "ABB", "model": "IRB 6700", "doc_description": "Service"},
+]
+
+
+def test_model_matches_come_first_then_vector_hits():
+    ranked = ["IRB 6700 Service Manual", "FANUC Safety Handbook", "inCube20 Installation"]
+    shortlist = shortlist_documents("R-30iB alarm after FANUC safety check", DOCUMENTS, 3, lambda query, limit: ranked)
+    assert [doc["doc_name"] for doc in shortlist] == ["R-30iB Operator Manual", "FANUC Safety Handbook", "IRB 6700 Service Manual"]
+
+
+def test_keyword_matches_fill_in_without_vector_search():
+    shortlist = shortlist_documents("ligent incube20 setup", DOCUMENTS, 2)
+    assert [doc["doc_name"] for doc in shortlist] == ["inCube20 Installation"]
+
+
+def test_format_document():
+    assert format_document(DOCUMENTS[2]) == "doc_name:'inCube20 Installation' (Ligent inCube20) : Installation"
+
+
+def test_failed_vector_search_lists_the_full_catalog(monkeypatch):
+    def failing_search(query, limit):
+        raise Exception("$vectorSearch index catalog_vector_index not found")
+
+    monkeypatch.setattr(catalog, "_load_catalog", lambda: 1)
+    monkeypatch.setitem(catalog._cache, "documents", DOCUMENTS)
+    monkeypatch.setitem(catalog._cache, "text", catalog.format_catalog(DOCUMENTS))
+    monkeypatch.setattr(catalog, "search_catalog_by_vector", failing_search)
+
+    assert catalog.get_catalog_text("IRB 6700 axis 3 fault", k=2) == catalog.format_catalog(DOCUMENTS)
+    assert ("IRB 6700 axis 3 fault", 2) not in catalog._shortlists
@@ -0,0 +1,54 @@
+import embedding
+from embedding import pack_embedding_batches, create_embeddings_batch
+from prompt_budget import estimate_tokens
+from embedding_cache import EmbeddingCache
+
+
+class FakeVoyage:
+    def __init__(self):
+        self.requests = []
+
+    def embed(self, texts, model):
+        self.requests.append(list(texts))
+        # The vector tells which text it was made from
+        return type("Result", (), {"embeddings": [[float(len(text)), float(ord(text[-1]))] for text in texts]})()
+
+
+def vector(text):
+    return [float(len(text)), float(ord(text[-1]))]
+
+
+def test_batches_respect_item_and_token_limits():
+    texts = [f"step {i} " + "torque the bolts " * (i % 5) for i in range(40)]
+    max_tokens = 60
+    batches = pack_embedding_batches(texts, max_items=7, max_tokens=max_tokens)
+
+    assert [i for batch in batches for i in batch] == list(range(40))
+    assert all(len(batch) <= 7 for batch in batches)
+    assert all(sum(estimate_tokens(texts[i]) for i in batch) <= max_tokens for batch in batches)
+    # A batch is only closed when the next text would not fit
+    for batch, next_batch in zip(batches, batches[1:]):
+        assert len(batch) == 7 or sum(estimate_tokens(texts[i]) for i in batch + next_batch[:1]) > max_tokens
+
+
+def test_text_above_the_token_limit_is_sent_alone():
+    texts = ["short", "long " * 200, "short again"]
+    assert pack_embedding_batches(texts, max_tokens=50) == [[0], [1], [2]]
+
+
+def test_duplicate_and_cached_texts_are_embedded_once_in_input_order(monkeypatch):
+    voyage = FakeVoyage()
+    cache = EmbeddingCache(use_store=False)
+    cache.put_many(["Replace the battery"], [[0.5, 0.5]], embedding.EMBEDDING_MODEL)
+    monkeypatch.setattr(embedding, "embedding_cache", cache)
+    monkeypatch.setattr(embedding, "get_voyage_client", lambda: voyage)
+
+    texts = ["SRVO-062 BZAL alarm", "Replace the battery", "MOTN-017 limit error", "SRVO-062 BZAL alarm", "Check the fuse"]
+    embeddings = create_embeddings_batch(texts)
+
+    assert embeddings == [vector(texts[0]), [0.5, 0.5], vector(texts[2]), vector(texts[0]), vector(texts[4])]
+    assert voyage.requests == [["SRVO-062 BZAL alarm", "MOTN-017 limit error", "Check the fuse"]]
+
+    # Now all cached
+    assert create_embeddings_batch(texts[::-1]) == embeddings[::-1]
+    assert len(voyage.requests) == 1
@@ -0,0 +1,26 @@
+from tests.fakes import FakeCollection
+from embedding_cache import EmbeddingCache
+
+
+def test_lookups_fall_back_from_memory_to_store():
+    collection = FakeCollection()
+    warm = EmbeddingCache(collection)
+    warm.put_many(["FANUC safety information"], [[0.1, 0.2]], "voyage-3")
+
+    # A new container only has the shared collection
+    cold = EmbeddingCache(collection)
+    assert cold.get_many(["  fanuc   SAFETY information", "SRVO-062"], "voyage-3") == [[0.1, 0.2], None]
+    assert cold.get_many(["fanuc safety information"], "voyage-3") == [[0.1, 0.2]]
+    assert cold.stats() == {"memory_hits": 1, "store_hits": 1, "misses": 1, "hit_rate": 0.667}
+
+
+def test_model_is_part_of_the_key():
+    cache = EmbeddingCache(use_store=False)
+    cache.put_many(["text"], [[1.0]], "voyage-3")
+    assert cache.get_many(["text"], "voyage-3-large") == [None]
+
+
+def test_memory_tier_is_bounded():
+    cache = EmbeddingCache(use_store=False, max_memory_entries=2)
+    cache.put_many(["a", "b", "c"], [[1.0], [2.0], [3.0]], "voyage-3")
+    assert cache.get_many(["a", "b", "c"], "voyage-3") == [None, [2.0], [3.0]]
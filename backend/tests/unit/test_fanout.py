@@ -0,0 +1,157 @@
+import random
+from tests.fakes import FakeCollection
+from work_queue import SqliteWorkQueue, run_worker
+from fanout import FanOut, iter_ranges
+from ingestion_state import IngestionState
+from ingest_pipeline import DocumentIngestion
+from mongodb_tools import ChunkWriter
+from section_chunker import SectionChunker
+
+
+METADATA = {"doc_name": "Manual", "doc_type": "service_manual", "doc_description": "", "manufacturer": "", "model": ""}
+
+
+def tagged_pages(count, seed=7, sentences=0):
+    """Pages already in the structured format: sections often continue on the next page."""
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        page = ""
+        if rng.random() < 0.3:
+            page += f"<H1>Chapter {i}</H1>"
+        if rng.random() < 0.4:
+            page += f"<H2>Section {i}</H2>"
+        if rng.random() < 0.3:
+            page += f"<H3>Step {i}</H3>"
+        page += "".join(f"<BODY>page {i} block {b}{' Check the cable.' * sentences}</BODY>" for b in range(rng.randint(1, 2)))
+        pages.append(page)
+    return pages
+
+
+class Store:
+    def __init__(self):
+        self.state_collections = (FakeCollection(), FakeCollection(), FakeCollection())
+        self.chunks = FakeCollection()
+        self.embedded = 0
+
+    def new_state(self, file_name):
+        return IngestionState(file_name, *self.state_collections)
+
+    def new_writer(self):
+        return ChunkWriter(self.chunks)
+
+    def embed(self, texts):
+        self.embedded += len(texts)
+        return [[0.5, 0.5] for _ in texts]
+
+    def sections(self):
+        return sorted((c["page"], c["H1"], c["H2"], c["H3"], c["text"]) for c in self.chunks.find({}))
+
+
+def extract_metadata(state, document_head, file_name):
+    state.save_metadata(METADATA)
+    return METADATA
+
+
+def fanout(store, work_queue, structure=lambda i, page_text: page_text, new_chunker=SectionChunker):
+    return FanOut(work_queue, structure, store.embed, extract_metadata, new_state=store.new_state,
+                  new_writer=store.new_writer, new_chunker=new_chunker, pages_per_item=7)
+
+
+def single_run(pages, new_chunker=SectionChunker):
+    store = Store()
+    DocumentIngestion("manual.pdf", pages, store.new_state("manual.pdf"), lambda i, page_text: page_text, store.embed,
+                      store.new_writer(), lambda: METADATA, chunker=new_chunker()).run()
+    return store
+
+
+def test_ranges_respect_page_and_size_limits():
+    assert [(first, len(pages)) for first, pages in iter_ranges(iter(["p"] * 10), pages_per_item=4)] == [(0, 4), (4, 4), (8, 2)]
+    assert [(first, len(pages)) for first, pages in iter_ranges(["x" * 60] * 3, pages_per_item=10, max_bytes=130)] == [(0, 2), (2, 1)]
+
+
+def test_fanned_out_ingestion_matches_a_single_run():
+    pages = tagged_pages(40)
+    store = Store()
+    work_queue = SqliteWorkQueue()
+    assert fanout(store, work_queue).start(iter(pages), "manual.pdf") == 6
+
+    assert run_worker(work_queue, fanout(store, work_queue).process) == 6
+    assert len(work_queue) == 0
+    assert store.sections() == single_run(pages).sections()
+    # Workers write the inner sections, the finalizer only the ones at the range boundaries
+    assert store.embedded == len(store.sections())
+    assert store.new_state("manual.pdf").status == "completed"
+
+
+def test_split_and_merged_chunks_match_a_single_run():
+    # Sections span up to a few pages: long ones are split into several chunks, short ones merged
+    pages = tagged_pages(40, seed=3, sentences=6)
+    new_chunker = lambda: SectionChunker(target_tokens=90, max_tokens=120, min_tokens=45, overlap_tokens=10)
+    store = Store()
+    work_queue = SqliteWorkQueue()
+    fanout(store, work_queue, new_chunker=new_chunker).start(pages, "manual.pdf")
+
+    run_worker(work_queue, fanout(store, work_queue, new_chunker=new_chunker).process)
+    assert store.sections() == single_run(pages, new_chunker).sections()
+    assert store.embedded == len(store.sections())
+
+
+def test_failed_work_item_is_retried_after_its_visibility_timeout():
+    pages = tagged_pages(20)
+    store = Store()
+    now = [0.0]
+    work_queue = SqliteWorkQueue(clock=lambda: now[0])
+    fanout(store, work_queue).start(pages, "manual.pdf")
+
+    failed = []
+
+    def flaky_structure(i, page_text):
+        # Page 13 (in the second range) fails once
+        if not failed and "page 12 " in page_text:
+            failed.append(i)
+            return "ERROR: All models throttled or unavailable."
+        return page_text
+
+    assert run_worker(work_queue, fanout(store, work_queue, flaky_structure).process, visibility_timeout=60) == 2
+    assert store.new_state("manual.pdf").status == "in_progress"
+
+    now[0] += 61
+    assert run_worker(work_queue, fanout(store, work_queue, flaky_structure).process, visibility_timeout=60) == 1
+    assert store.sections() == single_run(pages).sections()
+    assert store.new_state("manual.pdf").status == "completed"
+
+
+def test_work_items_of_a_replaced_upload_are_skipped():
+    store = Store()
+    work_queue = SqliteWorkQueue()
+    fanout(store, work_queue).start(tagged_pages(10), "manual.pdf")
+    fanout(store, work_queue).start(tagged_pages(10, seed=8), "manual.pdf")
+
+    run_worker(work_queue, fanout(store, work_queue).process)
+    assert store.sections() == single_run(tagged_pages(10, seed=8)).sections()
+
+
+def test_reupload_only_sends_the_changed_ranges():
+    pages = tagged_pages(40)
+    store = Store()
+    work_queue = SqliteWorkQueue()
+    fanout(store, work_queue).start(iter(pages), "manual.pdf")
+    run_worker(work_queue, fanout(store, work_queue).process)
+
+    assert fanout(store, work_queue).start(iter(pages), "manual.pdf") == 0
+    assert len(work_queue) == 0
+
+    # Page 10 is revised: only its range is sent again
+    pages[9] = "<BODY>page 9 revised</BODY>"
+    embedded = store.embedded
+    assert fanout(store, work_queue).start(iter(pages), "manual.pdf") == 1
+    assert run_worker(work_queue, fanout(store, work_queue).process) == 1
+    assert store.sections() == single_run(pages).sections()
+    assert store.embedded - embedded <= 3
+    assert store.new_state("manual.pdf").status == "completed"
+
+    # The last pages are removed: every range is structured already, the finalizer deletes their chunks
+    assert fanout(store, work_queue).start(iter(pages[:30]), "manual.pdf") == 1
+    assert run_worker(work_queue, fanout(store, work_queue).process) == 1
+    assert store.sections() == single_run(pages[:30]).sections()
@@ -0,0 +1,115 @@
+import os
+import json
+import index_new_document
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fixtures", "textract_pages.json")
+
+
+class FakeTextract:
+    def __init__(self):
+        with open(FIXTURE) as f:
+            responses = json.load(f)
+        tokens = [None] + [response.get("NextToken") for response in responses[:-1]]
+        self.results = dict(zip(tokens, responses))
+        self.calls = 0
+
+    def get_document_text_detection(self, JobId, NextToken=None):
+        self.calls += 1
+        return self.results[NextToken]
+
+
+def test_textract_pages_are_read_as_the_ingestion_consumes_them(monkeypatch):
+    textract = FakeTextract()
+    monkeypatch.setattr(index_new_document, "get_client", lambda name: textract)
+
+    pages, file_name = index_new_document.handle_textract_completion({"JobId": "job", "Status": "SUCCEEDED", "JobTag": "scan.pdf"})
+    assert file_name == "scan.pdf"
+    # Nothing is fetched until the ingestion reads the first page
+    assert textract.calls == 0
+    assert next(pages).startswith("R-30iB Controller Maintenance Manual")
+    assert list(pages)[-1] == "3 ALARM CODES\nSRVO-062 BZAL alarm"
+
+
+class Recorder:
+    def __init__(self, read):
+        self.read = read
+        self.started = []
+
+    def start(self, pages, file_name):
+        self.started.append((len(self.read), list(pages)))
+        return True
+
+
+def test_only_the_first_pages_are_read_to_choose_a_fan_out(monkeypatch):
+    read = []
+
+    def pages(count):
+        for i in range(count):
+            read.append(i)
+            yield f"page {i}"
+
+    recorder = Recorder(read)
+    monkeypatch.setattr(index_new_document, "FANOUT_MIN_PAGES", 5)
+    monkeypatch.setattr(index_new_document, "get_work_queue", lambda: "queue")
+    monkeypatch.setattr(index_new_document, "build_fanout", lambda work_queue: recorder)
+    monkeypatch.setattr(index_new_document, "chuck_document", lambda pages, file_name, time_left: recorder.start(pages, file_name))
+
+    assert index_new_document.index_document(pages(8), "large.pdf", lambda: 900)
+    assert recorder.started[-1] == (5, [f"page {i}" for i in range(8)])
+
+    read.clear()
+    assert index_new_document.index_document(pages(3), "small.pdf", lambda: 900)
+    assert recorder.started[-1] == (3, ["page 0", "page 1", "page 2"])
+
+
+class FakeS3:
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    def get_object(self, Bucket, Key):
+        return {"Body": self}
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            self.reads += 1
+            yield self.data[start:start + chunk_size]
+
+
+def test_text_pages_are_read_as_the_ingestion_consumes_them(monkeypatch):
+    s3 = FakeS3(("SRVO-062 BZAL alarm, battery replaced\n" * 2000).encode("utf-8"))
+    monkeypatch.setattr(index_new_document, "get_client", lambda name: s3)
+    monkeypatch.setattr(index_new_document, "TEXT_READ_CHUNK_BYTES", 1024)
+
+    pages = index_new_document.handle_text_file("bucket", "log.txt", page_char_limit=4000)
+    assert s3.reads == 0
+    assert next(pages).startswith("SRVO-062 BZAL alarm")
+    # Only the reads needed for the first page
+    assert s3.reads <= 5
+    assert list(pages)[-1].endswith("battery replaced")
+    assert s3.reads == -(-len(s3.data) // 1024)
+
+
+def test_reader_is_closed_when_the_ingestion_stops_early(monkeypatch):
+    closed = []
+
+    def pages():
+        try:
+            for i in range(10):
+                yield f"page {i}"
+        finally:
+            closed.append(True)
+
+    def stopping_ingestion(pages, file_name, time_left):
+        next(iter(pages))
+        raise RuntimeError("pipeline aborted")
+
+    monkeypatch.setattr(index_new_document, "get_work_queue", lambda: None)
+    monkeypatch.setattr(index_new_document, "chuck_document", stopping_ingestion)
+    reader = pages()
+    try:
+        index_new_document.index_document(reader, "manual.pdf", lambda: 900)
+    except RuntimeError:
+        pass
+    assert closed == [True]
@@ -0,0 +1,251 @@
+import time
+import threading
+import pytest
+from tests.fakes import FakeCollection, RejectingCollection
+from pipeline import Pipeline, Stage
+from section_grouping import group_sections
+from ingestion_state import IngestionState, hash_text
+from ingest_pipeline import DocumentIngestion
+from mongodb_tools import ChunkWriter
+
+
+METADATA = {"doc_name": "R-30iB Manual", "doc_type": "service_manual", "doc_description": "", "manufacturer": "FANUC", "model": "R-30iB"}
+
+
+def test_stages_run_concurrently_with_bounded_queues():
+    def slow_double(item, emit):
+        time.sleep(0.01)
+        emit(item * 2)
+
+    pipeline = Pipeline([
+        Stage("double", slow_double, workers=4),
+        Stage("keep_even", lambda item, emit: emit(item) if item % 4 == 0 else None)
+    ], queue_size=2)
+    outputs = pipeline.run(range(40))
+
+    assert sorted(outputs) == list(range(0, 80, 4))
+    stats = pipeline.stats()
+    assert stats["double"]["items_in"] == 40 and stats["keep_even"]["items_out"] == 20
+    assert stats["double"]["queue_max"] <= 2
+
+
+def test_stage_error_stops_the_pipeline():
+    def fail_on_five(item, emit):
+        if item == 5:
+            raise ValueError("bad page")
+        emit(item)
+
+    pipeline = Pipeline([Stage("check", fail_on_five), Stage("sink", lambda item, emit: time.sleep(0.01))], queue_size=1)
+    with pytest.raises(ValueError, match="bad page"):
+        pipeline.run(range(1000))
+
+
+def test_sections_continue_across_pages():
+    responses = [
+        "<BODY>Cover</BODY><H1>Alarms</H1><H2>SRVO</H2><BODY>SRVO-062</BODY>",
+        "<BODY>BZAL alarm</BODY><H2>MOTN</H2><BODY>MOTN-017</BODY>"
+    ]
+    assert group_sections(responses) == [
+        {"H1": "", "H2": "", "H3": "", "page": "1", "text": "Cover"},
+        {"H1": "Alarms", "H2": "SRVO", "H3": "", "page": "1", "text": "SRVO-062\nBZAL alarm"},
+        {"H1": "Alarms", "H2": "MOTN", "H3": "", "page": "2", "text": "MOTN-017"}
+    ]
+
+
+def structure(i, page_text):
+    time.sleep(0.001 * (i % 3))
+    return f"<H1>{page_text.split(':')[0]}</H1><BODY>{page_text}</BODY>"
+
+
+class Ingestion:
+    def __init__(self, file_name="manual.pdf"):
+        self.file_name = file_name
+        self.state_collections = (FakeCollection(), FakeCollection(), FakeCollection())
+        self.chunks = FakeCollection()
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return [[0.1, 0.2, 0.3] for _ in texts]
+
+    def run(self, pages, should_stop=None, structure=structure, **kwargs):
+        state = IngestionState(self.file_name, *self.state_collections)
+        ingestion = DocumentIngestion(
+            self.file_name, pages, state, structure, self.embed, ChunkWriter(self.chunks),
+            should_stop=should_stop, structure_workers=4, embed_batch=3, queue_size=2,
+            **(kwargs or {"get_metadata": lambda: METADATA})
+        )
+        done = ingestion.run()
+        if done and not ingestion.unchanged:
+            state.complete(ingestion.page_count)
+        return done, ingestion
+
+
+def test_document_is_indexed_in_page_order():
+    ingestion = Ingestion()
+    pages = [f"Section {i}: text {i}" for i in range(10)]
+    done, run = ingestion.run(pages)
+
+    assert done
+    stored = sorted(ingestion.chunks.find({}), key=lambda chunk: int(chunk["page"]))
+    assert [chunk["text"] for chunk in stored] == pages
+    assert all(chunk["manufacturer"] == "FANUC" for chunk in stored)
+    assert run.pipeline.stats()["write"]["items_in"] == 4
+
+
+def test_reupload_embeds_changed_sections_and_deletes_stale_ones():
+    ingestion = Ingestion()
+    pages = [f"Section {i}: text {i}" for i in range(6)]
+    ingestion.run(pages)
+    ingestion.embedded.clear()
+
+    pages = pages[:2] + ["Section 2: revised"] + pages[3:5]
+    done, _ = ingestion.run(pages)
+
+    assert done
+    assert ingestion.embedded == ["Section 2   Section 2: revised"]
+    assert sorted(chunk["text"] for chunk in ingestion.chunks.find({})) == sorted(pages)
+
+
+def test_stopped_ingestion_resumes_without_losing_sections():
+    ingestion = Ingestion()
+    pages = [f"Section {i}: text {i}" for i in range(12)]
+    started = []
+    lock = threading.Lock()
+
+    def should_stop():
+        with lock:
+            started.append(1)
+            return len(started) > 5
+
+    done, _ = ingestion.run(pages, should_stop=should_stop)
+    assert not done
+
+    done, _ = ingestion.run(pages)
+    assert done
+    assert sorted(chunk["text"] for chunk in ingestion.chunks.find({})) == sorted(pages)
+
+
+def test_failed_page_keeps_the_document_incomplete_and_its_chunks():
+    ingestion = Ingestion()
+    pages = [f"Section {i}: text {i}" for i in range(6)]
+    ingestion.run(pages)
+
+    def failing_structure(i, page_text):
+        return "ERROR: All models throttled or unavailable." if "revised" in page_text else structure(i, page_text)
+
+    pages = pages[:2] + ["Section 2: revised"] + pages[3:]
+    done, run = ingestion.run(pages, structure=failing_structure)
+    assert not done and run.failed_pages == 1
+    # Nothing is deleted as stale while a page is missing, the old chunk of page 3 is still there
+    assert "Section 2: text 2" in [chunk["text"] for chunk in ingestion.chunks.find({})]
+
+    done, _ = ingestion.run(pages)
+    assert done
+    assert sorted(chunk["text"] for chunk in ingestion.chunks.find({})) == sorted(pages)
+
+
+def test_failed_chunk_insert_keeps_the_document_incomplete_and_its_chunks():
+    ingestion = Ingestion()
+    pages = [f"Section {i}: text {i}" for i in range(6)]
+    ingestion.run(pages)
+    rejecting = [True]
+    chunks = RejectingCollection(lambda chunk: rejecting[0] and "revised" in chunk["text"])
+    chunks.documents = ingestion.chunks.documents
+    ingestion.chunks = chunks
+
+    pages = pages[:2] + ["Section 2: revised"] + pages[3:]
+    done, run = ingestion.run(pages)
+    assert not done and run.failed_chunks == 1
+    # The chunk replaced by the one not written is not deleted as stale
+    assert "Section 2: text 2" in [chunk["text"] for chunk in ingestion.chunks.find({})]
+    assert IngestionState(ingestion.file_name, *ingestion.state_collections).chunks_written == 0
+
+    rejecting[0] = False
+    done, _ = ingestion.run(pages)
+    assert done
+    assert sorted(chunk["text"] for chunk in ingestion.chunks.find({})) == sorted(pages)
+
+
+def test_inserted_page_moves_later_chunks_without_embedding_them():
+    ingestion = Ingestion()
+    pages = [f"Section {i}: text {i}" for i in range(5)] + ["Section 0: text 0"]
+    ingestion.run(pages)
+    ingestion.embedded.clear()
+
+    pages = ["Section N: new page"] + pages
+    done, _ = ingestion.run(pages)
+
+    assert done
+    assert ingestion.embedded == ["Section N   Section N: new page"]
+    stored = sorted((int(chunk["page"]), chunk["text"]) for chunk in ingestion.chunks.find({}))
+    assert stored == [(i + 1, text) for i, text in enumerate(pages)]
+    assert all(chunk["page_hash"] == hash_text(pages[int(chunk["page"]) - 1]) for chunk in ingestion.chunks.find({}))
+
+
+def test_pages_are_structured_while_they_are_read():
+    ingestion = Ingestion()
+    structured = []
+    structured_before_the_end = []
+
+    def pages():
+        for i in range(8):
+            if i == 5:
+                # The first pages go through the pipeline while the reader still has pages to yield
+                deadline = time.time() + 5
+                while len(structured) < 3 and time.time() < deadline:
+                    time.sleep(0.01)
+                structured_before_the_end.append(len(structured))
+            yield f"Section {i}: text {i}"
+
+    def recording_structure(i, page_text):
+        structured.append(i)
+        return structure(i, page_text)
+
+    done, _ = ingestion.run(pages(), structure=recording_structure)
+    assert done and len(structured) == 8
+    assert structured_before_the_end[0] >= 3
+    assert ingestion.chunks.count_documents({}) == 8
+
+
+def test_unchanged_reupload_is_only_read():
+    ingestion = Ingestion()
+    pages = [f"Section {i}: text {i}" for i in range(6)]
+    ingestion.run(pages)
+    ingestion.embedded.clear()
+
+    def failing_structure(i, page_text):
+        raise AssertionError("an unchanged page is structured again")
+
+    done, run = ingestion.run(iter(pages), structure=failing_structure)
+    assert done and run.unchanged
+    assert run.pipeline.stats()["structure"]["items_in"] == 0
+    assert ingestion.embedded == []
+
+    # A page appended at the end releases the pages held back, only the new one is structured and embedded
+    done, run = ingestion.run(iter(pages + ["Section 6: text 6"]))
+    assert done and not run.unchanged
+    assert ingestion.embedded == ["Section 6   Section 6: text 6"]
+    assert ingestion.chunks.count_documents({}) == 7
+
+
+def test_metadata_is_extracted_from_the_first_pages_once():
+    ingestion = Ingestion()
+    heads = []
+
+    def extract_metadata(document_head):
+        heads.append(document_head)
+        return METADATA
+
+    pages = [f"Section {i}: " + "x" * 3000 for i in range(8)]
+    done, _ = ingestion.run(iter(pages), extract_metadata=extract_metadata)
+    assert done
+    # Pages are read until the head is longer than METADATA_HEAD_CHARACTERS
+    assert heads == [pages[:4]]
+    assert all(chunk["manufacturer"] == "FANUC" for chunk in ingestion.chunks.find({}))
+
+    # A change after the first pages reuses the metadata
+    state = IngestionState(ingestion.file_name, *ingestion.state_collections)
+    state.save_metadata(METADATA)
+    done, _ = ingestion.run(iter(pages[:6] + ["Section 6: revised"]), extract_metadata=extract_metadata)
+    assert done and len(heads) == 1
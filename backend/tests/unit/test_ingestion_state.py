@@ -0,0 +1,127 @@
+from tests.fakes import FakeCollection
+from ingestion_state import IngestionState, hash_text
+from page_structuring import PageStructurer
+
+
+def new_collections():
+    return FakeCollection(), FakeCollection(), FakeCollection()
+
+
+def new_state(collections, file_name="manual.pdf"):
+    return IngestionState(file_name, *collections)
+
+
+def counting_invoke(invoked):
+    def invoke(prompt):
+        invoked.append(prompt)
+        return f"<BODY>{len(invoked)}</BODY>"
+    return invoke
+
+
+def structure(state, pages, invoke, should_stop=None):
+    """Structures the pages not checkpointed yet, like the structure stage of the ingestion."""
+    page_hashes = [hash_text(page_text) for page_text in pages]
+    responses = state.load_pages(page_hashes)
+    structurer = PageStructurer(invoke, max_in_flight=1)
+    for i, page_text in enumerate(pages):
+        if i in responses or (should_stop and should_stop()):
+            continue
+        responses[i] = structurer.structure(i, page_text)
+        state.save_page(page_hashes[i], responses[i])
+    return [responses.get(i) for i in range(len(pages))]
+
+
+def read(state, pages):
+    """Reads the pages like the ingestion does, returns whether the file is the same as when last read."""
+    tracker = state.track_pages()
+    for page_text in pages:
+        tracker.add(page_text)
+    return tracker.finish()
+
+
+def test_interrupted_structuring_resumes_from_checkpoint():
+    collections = new_collections()
+    pages = [f"page {i}" for i in range(10)]
+    invoked = []
+
+    state = new_state(collections)
+    state.start()
+    read(state, pages)
+    responses = structure(state, pages, counting_invoke(invoked), should_stop=lambda: len(invoked) >= 4)
+    assert sum(r is not None for r in responses) == 4
+
+    # A new invocation sees the checkpoints and only structures the remaining pages
+    state = new_state(collections)
+    assert state.status == "in_progress"
+    assert read(state, pages)
+    responses = structure(state, pages, counting_invoke(invoked))
+    assert len(invoked) == 10
+    assert responses == [f"<BODY>{i}</BODY>" for i in range(1, 11)]
+
+
+def test_reupload_only_structures_changed_pages():
+    collections = new_collections()
+    pages = [f"page {i}" for i in range(5)]
+    invoked = []
+
+    state = new_state(collections)
+    state.start()
+    read(state, pages)
+    structure(state, pages, counting_invoke(invoked))
+    state.complete(len(pages))
+    assert read(new_state(collections), pages)
+
+    # Page 3 is edited and page 5 removed
+    new_pages = pages[:2] + ["page 2, revised"] + pages[3:4]
+    state = new_state(collections)
+    tracker = state.track_pages()
+    assert [tracker.add(page_text)[1] for page_text in new_pages] == [True, True, False, True]
+    assert not tracker.finish()
+    state.start()
+    responses = structure(state, new_pages, counting_invoke(invoked))
+    state.complete(len(new_pages))
+
+    assert len(invoked) == 6
+    assert responses == ["<BODY>1</BODY>", "<BODY>2</BODY>", "<BODY>6</BODY>", "<BODY>4</BODY>"]
+    # The response of the removed page is no longer kept, and neither are the hashes of pages 3 and 5
+    assert collections[1].count_documents({}) == 4
+    assert [page_hash for _, page_hash in state.iter_page_hashes()] == [hash_text(page_text) for page_text in new_pages]
+    assert read(new_state(collections), new_pages)
+
+
+def test_page_hashes_are_stored_one_record_per_page():
+    collections = new_collections()
+    state = new_state(collections)
+    tracker = state.track_pages()
+    tracker.batch = 100
+    for i in range(250):
+        tracker.add(f"page {i}")
+    # Written in batches while the pages are read
+    assert collections[2].count_documents({}) == 200
+    assert not tracker.finish()
+    assert collections[2].count_documents({}) == 250
+
+    # A re-upload with one more page at the end only writes that one
+    tracker = new_state(collections).track_pages()
+    assert all(tracker.add(f"page {i}")[1] for i in range(250))
+    tracker.add("page 250")
+    assert not tracker.finish() and tracker.changed_pages == 1
+
+
+def test_start_discards_previous_progress():
+    collections = new_collections()
+    state = new_state(collections)
+    state.start()
+    state.save_metadata({"doc_name": "Manual"})
+    state.save_chunks_written(200)
+    first_id = state.ingestion_id
+
+    state = new_state(collections)
+    assert state.metadata == {"doc_name": "Manual"}
+    assert state.chunks_written == 200
+
+    state.start()
+    assert state.ingestion_id != first_id
+    # Kept until the first pages are found to have changed
+    assert state.metadata == {"doc_name": "Manual"}
+    assert new_state(collections).chunks_written == 0
@@ -0,0 +1,62 @@
+from llm_cache import ResponseCache, MemoryCacheStore
+
+
+def test_repeated_prompts_are_answered_from_cache():
+    calls = []
+    cache = ResponseCache(MemoryCacheStore())
+    invoke = cache.wrap(lambda prompt: calls.append(prompt) or f"<BODY>{prompt}</BODY>", "claude")
+
+    assert invoke("page 1") == "<BODY>page 1</BODY>"
+    assert invoke("page 1") == "<BODY>page 1</BODY>"
+    assert invoke("page 2") == "<BODY>page 2</BODY>"
+    assert calls == ["page 1", "page 2"]
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 0.333}
+
+
+def test_model_family_is_part_of_the_key():
+    cache = ResponseCache(MemoryCacheStore())
+    cache.put("claude-3", "prompt", "old")
+    assert cache.get("claude-4", "prompt") is None
+    assert cache.get("claude-3", "prompt") == "old"
+
+
+def test_errors_are_not_cached():
+    cache = ResponseCache(MemoryCacheStore())
+    cache.put("claude", "prompt", "ERROR: All models throttled or unavailable.")
+    assert cache.get("claude", "prompt") is None
+
+
+def test_expired_and_least_recently_used_entries_are_evicted():
+    store = MemoryCacheStore()
+    cache = ResponseCache(store, ttl_seconds=-1)
+    cache.put("claude", "prompt", "response")
+    assert cache.get("claude", "prompt") is None
+
+    cache = ResponseCache(store, max_entries=2, evict_every=1)
+    cache.put("claude", "a", "1")
+    cache.put("claude", "b", "2")
+    cache.get("claude", "a")
+    cache.put("claude", "c", "3")
+    assert cache.get("claude", "b") is None
+    assert cache.get("claude", "a") == "1"
+    assert cache.get("claude", "c") == "3"
+
+
+def test_only_valid_responses_are_cached():
+    calls = []
+    cache = ResponseCache(MemoryCacheStore())
+    responses = iter(['{"elements": ', '{"elements": []}', "unused"])
+    invoke = cache.wrap(lambda prompt: calls.append(prompt) or next(responses), "claude/tool:structure_page",
+                        is_valid=lambda raw: raw.endswith("}"))
+
+    # The invalid output is returned (and repaired by the caller), but a retry asks the model again
+    assert invoke("page 1") == '{"elements": '
+    assert invoke("page 1") == '{"elements": []}'
+    assert invoke("page 1") == '{"elements": []}'
+    assert len(calls) == 2
+
+    # An invalid response stored before is not reused
+    cache.put("claude/tool:structure_page", "page 2", "{")
+    invoke = cache.wrap(lambda prompt: '{"elements": []}', "claude/tool:structure_page", is_valid=lambda raw: raw.endswith("}"))
+    assert invoke("page 2") == '{"elements": []}'
+    assert cache.get("claude/tool:structure_page", "page 2") == '{"elements": []}'
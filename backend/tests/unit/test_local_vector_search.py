@@ -0,0 +1,51 @@
+from local_vector_search import LocalVectorIndex
+
+
+CHUNKS = [
+    {"_id": "a", "doc_name": "FANUC Manual", "file_name": "fanuc.pdf", "page": "1", "text": "battery"},
+    {"_id": "b", "doc_name": "FANUC Manual", "file_name": "fanuc.pdf", "page": "2", "text": "grease"},
+    {"_id": "c", "doc_name": "ABB Manual", "file_name": "abb.pdf", "page": "7", "text": "oil"},
+]
+VECTORS = [[1.0, 0.0, 0.0], [0.6, 0.8, 0.0], [0.9, 0.1, 0.0]]
+
+
+def test_exact_search_ranks_by_cosine(tmp_path):
+    index = LocalVectorIndex.build(str(tmp_path), CHUNKS, VECTORS)
+    results = index.search([2.0, 0.0, 0.0], [], 2)
+    assert [r["_id"] for r in results] == ["a", "c"]
+    assert results[0]["score"] == 1.0
+    assert results[0]["page"] == "1"
+
+
+def test_doc_filter_uses_only_listed_documents(tmp_path):
+    index = LocalVectorIndex.build(str(tmp_path), CHUNKS, VECTORS)
+    assert [r["_id"] for r in index.search([1.0, 0.0, 0.0], ["FANUC Manual"], 5)] == ["a", "b"]
+    assert index.search([1.0, 0.0, 0.0], ["Unknown"], 5) == []
+
+
+def test_ivf_index_is_reloaded_from_disk(tmp_path):
+    LocalVectorIndex.build(str(tmp_path), CHUNKS, VECTORS, clusters=2)
+    index = LocalVectorIndex(str(tmp_path))
+    assert len(index.centroids) == 2
+    assert [r["_id"] for r in index.search([0.0, 1.0, 0.0], [], 1, nprobe=2)] == ["b"]
+
+
+def test_text_search_ranks_exact_error_codes_first(tmp_path):
+    chunks = CHUNKS + [
+        {"_id": "d", "doc_name": "FANUC Manual", "file_name": "fanuc.pdf", "page": "9", "text": "SRVO-062 BZAL alarm: replace the battery"},
+        {"_id": "e", "doc_name": "ABB Manual", "file_name": "abb.pdf", "page": "3", "text": "alarm list and battery alarm"},
+    ]
+    index = LocalVectorIndex.build(str(tmp_path), chunks, VECTORS + [[0.0, 0.0, 1.0], [0.0, 1.0, 0.0]])
+    assert [r["_id"] for r in index.text_search("SRVO-062 alarm", [], 5)] == ["d", "e"]
+    assert [r["_id"] for r in index.text_search("battery alarm", ["ABB Manual"], 5)] == ["e"]
+    assert index.text_search("coolant", [], 5) == []
+
+
+def test_hybrid_search_runs_on_the_local_index(tmp_path, monkeypatch):
+    import mongodb_tools
+    import local_vector_search
+    monkeypatch.setattr(mongodb_tools, "VECTOR_SEARCH_BACKEND", "local")
+    monkeypatch.setattr(local_vector_search, "_index", LocalVectorIndex.build(str(tmp_path), CHUNKS, VECTORS))
+
+    results = mongodb_tools.search_chunks([0.6, 0.8, 0.0], [], 2, search_text="grease")
+    assert [r["_id"] for r in results][0] == "b"
@@ -0,0 +1,101 @@
+import json
+from tests.fakes import FakeBedrockClient
+from model_router import ModelRouter, PartialResponseError, classify_error, inference_profile_ids
+
+
+MODELS = ["us.model-a", "us.model-b", "us.model-c"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def call_with(client):
+    def call(model_id):
+        body = json.dumps({"messages": [{"role": "user", "content": [{"type": "text", "text": "page"}]}]})
+        response = client.invoke_model(modelId=model_id, body=body)
+        return json.loads(response["body"].read())["content"][0]["text"]
+    return call
+
+
+def test_throttled_model_is_skipped_once_its_circuit_opens():
+    client = FakeBedrockClient(latency=0, throttled_models={"us.model-a"})
+    router = ModelRouter(MODELS, sleep=lambda seconds: None)
+    for _ in range(50):
+        assert router.invoke(call_with(client)) == "<BODY>ok</BODY>"
+    # The throttled model is at most tried until its circuit opens
+    assert client.model_calls.get("us.model-a", 0) <= 3
+    assert client.calls <= 53
+
+
+def test_circuit_closes_after_cooldown_and_reopens_for_longer():
+    clock = Clock()
+    client = FakeBedrockClient(latency=0, throttled_models={"us.model-a"})
+    router = ModelRouter(["us.model-a"], max_rounds=1, clock=clock, sleep=lambda seconds: None)
+    for _ in range(3):
+        assert router.invoke(call_with(client)).startswith("ERROR: All models throttled")
+    first_open = router.models["us.model-a"].open_until
+    assert first_open == 30.0
+
+    clock.now = 31.0
+    router.invoke(call_with(client))
+    # One failed trial call is enough to open it again, for twice as long
+    assert router.models["us.model-a"].open_until == 31.0 + 60.0
+
+    client.throttled_models.clear()
+    clock.now = 100.0
+    assert router.invoke(call_with(client)) == "<BODY>ok</BODY>"
+    assert not router.stats()["us.model-a"]["circuit_open"]
+
+
+def test_fastest_model_is_preferred():
+    client = FakeBedrockClient(model_latency={"us.model-a": 0.03, "us.model-b": 0.0, "us.model-c": 0.03})
+    router = ModelRouter(MODELS, sleep=lambda seconds: None)
+    for _ in range(12):
+        router.invoke(call_with(client))
+    assert client.model_calls["us.model-b"] >= 9
+
+
+def test_all_models_throttled_backs_off_then_reports_throttling():
+    sleeps = []
+    client = FakeBedrockClient(latency=0, throttled_models=set(MODELS))
+    router = ModelRouter(MODELS, max_rounds=3, base_backoff=1.0, sleep=sleeps.append)
+    assert router.invoke(call_with(client)) == "ERROR: All models throttled or unavailable."
+    assert len(sleeps) == 2 and 0.5 <= sleeps[0] <= 1.5 and 1.0 <= sleeps[1] <= 3.0
+
+
+def test_fatal_errors_are_not_retried():
+    calls = []
+
+    def call(model_id):
+        calls.append(model_id)
+        raise Exception("ValidationException: prompt is too long")
+
+    router = ModelRouter(MODELS, sleep=lambda seconds: None)
+    assert router.invoke(call) == "ERROR: ValidationException: prompt is too long"
+    assert len(calls) == 1
+    assert classify_error(Exception("ServiceUnavailableException")) == "transient"
+
+
+def test_interrupted_stream_is_a_failure_of_the_model():
+    calls = []
+
+    def call(model_id):
+        calls.append(model_id)
+        raise PartialResponseError("modelStreamErrorException")
+
+    router = ModelRouter(MODELS, sleep=lambda seconds: None)
+    assert router.invoke(call) == "ERROR: modelStreamErrorException"
+    # Part of the response was relayed already, no other model is tried
+    assert len(calls) == 1
+    assert router.stats()[calls[0]]["errors"] == 1
+
+
+def test_inference_profiles_follow_the_region():
+    assert inference_profile_ids(["us.anthropic.claude", "anthropic.claude-v2"], "eu-west-1") == ["eu.anthropic.claude", "anthropic.claude-v2"]
+    assert inference_profile_ids(["us.anthropic.claude"], "ap-northeast-1") == ["apac.anthropic.claude"]
+    assert inference_profile_ids(["us.anthropic.claude"], "us-east-1") == ["us.anthropic.claude"]
@@ -0,0 +1,42 @@
+import bson
+from tests.fakes import RejectingCollection
+from mongodb_tools import ChunkWriter
+
+
+def chunk(i, text="Check the encoder cable."):
+    return {"file_name": "manual.pdf", "page": str(i), "text": text}
+
+
+def test_chunks_are_flushed_every_max_docs():
+    collection = RejectingCollection(lambda document: False)
+    writer = ChunkWriter(collection, max_docs=3)
+    for i in range(7):
+        writer.add(chunk(i))
+    assert collection.insert_calls == [3, 3]
+
+    writer.flush()
+    assert collection.insert_calls == [3, 3, 1]
+    assert writer.flush() is None
+    assert writer.totals()["inserted"] == 7 and collection.count_documents({}) == 7
+
+
+def test_chunks_are_flushed_above_max_bytes():
+    collection = RejectingCollection(lambda document: False)
+    size = len(bson.encode(chunk(0, "x" * 1000)))
+    writer = ChunkWriter(collection, max_docs=500, max_bytes=size * 2)
+    for i in range(5):
+        writer.add(chunk(i, "x" * 1000))
+    assert collection.insert_calls == [2, 2]
+    assert writer.flushes[0]["bytes"] >= size * 2
+
+
+def test_rejected_chunks_are_reported_as_failed():
+    collection = RejectingCollection(lambda document: document["page"] in ("2", "4"))
+    writer = ChunkWriter(collection)
+    for i in range(6):
+        writer.add(chunk(i))
+
+    summary = writer.flush()
+    assert summary["documents"] == 6 and summary["inserted"] == 4 and summary["failed"] == 2
+    assert sorted(d["page"] for d in collection.find({})) == ["0", "1", "3", "5"]
+    assert writer.totals()["failed"] == 2
@@ -0,0 +1,70 @@
+import threading
+import page_structuring
+from page_structuring import AdaptiveLimiter, PageStructurer, is_throttled
+from tests.fakes import THROTTLING_ERROR
+
+
+def test_limit_is_halved_on_throttling_and_grows_back_by_one():
+    limiter = AdaptiveLimiter(8, min_in_flight=1, increase_after=3)
+    for throttled, limit in [(True, 4), (True, 2), (True, 1), (True, 1)]:
+        limiter.acquire()
+        limiter.release(throttled=throttled)
+        assert limiter.limit == limit
+    assert limiter.throttles == 4
+
+    for calls, limit in [(2, 1), (1, 2), (3, 3), (15, 8), (3, 8)]:
+        for _ in range(calls):
+            limiter.acquire()
+            limiter.release()
+        assert limiter.limit == limit
+    assert limiter.in_flight == 0
+
+
+def test_calls_above_the_limit_wait_for_a_release():
+    limiter = AdaptiveLimiter(2)
+    limiter.acquire()
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.05)
+
+    limiter.release()
+    assert acquired.wait(1)
+    waiter.join()
+    assert limiter.in_flight == 2
+
+
+def scripted_invoke(responses):
+    calls = []
+
+    def invoke(prompt):
+        calls.append(prompt)
+        return responses[min(len(calls), len(responses)) - 1]
+    return invoke, calls
+
+
+def test_throttled_page_is_retried_with_backoff_until_it_succeeds(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(page_structuring.time, "sleep", sleeps.append)
+    invoke, calls = scripted_invoke([f"ERROR: {THROTTLING_ERROR}", f"ERROR: {THROTTLING_ERROR}", "<BODY>ok</BODY>"])
+    structurer = PageStructurer(invoke, max_in_flight=4, max_retries=5, base_backoff=1.0)
+
+    assert structurer.structure(0, "page") == "<BODY>ok</BODY>"
+    assert len(calls) == 3
+    # Jittered exponential backoff: within [backoff / 2, backoff] of 1 s, then 2 s
+    assert 0.5 <= sleeps[0] <= 1.0 and 1.0 <= sleeps[1] <= 2.0 and len(sleeps) == 2
+    assert structurer.limiter.throttles == 2 and structurer.limiter.limit == 1
+
+
+def test_page_fails_after_max_retries_or_on_other_errors(monkeypatch):
+    monkeypatch.setattr(page_structuring.time, "sleep", lambda seconds: None)
+    invoke, calls = scripted_invoke([f"ERROR: {THROTTLING_ERROR}"])
+    structurer = PageStructurer(invoke, max_retries=2)
+    assert is_throttled(structurer.structure(0, "page"))
+    assert len(calls) == 3
+
+    # Only throttling is worth retrying
+    invoke, calls = scripted_invoke(["ERROR: ValidationException: prompt is too long"])
+    assert PageStructurer(invoke).structure(0, "page").startswith("ERROR: ValidationException")
+    assert len(calls) == 1
@@ -0,0 +1,89 @@
+import json
+import pytest
+import mongodb_tools
+import process_message
+from tests.fakes import FakeCollection
+
+
+class Context:
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:process-message"
+
+
+class FakeLambda:
+    def __init__(self, error=None):
+        self.error = error
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.error:
+            raise self.error
+        self.payloads.append(json.loads(Payload))
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(mongodb_tools, "get_user_requests_collection", lambda: collection)
+    return collection
+
+
+def test_history_is_stored_and_only_ids_are_sent(monkeypatch, requests):
+    client = FakeLambda()
+    monkeypatch.setattr(process_message, "get_client", lambda name: client)
+    history = [{"sender": "user", "content": "x" * 300_000}]
+
+    request_id = process_message.enqueue_request("u1", "How do I reset SRVO-062?", history, Context(), "r1")
+    assert request_id == "r1"
+    assert client.payloads == [{"async_request": {"user_id": "u1", "request_id": "r1"}}]
+
+    received = []
+    monkeypatch.setattr(process_message, "new_request", lambda *args: received.append(args))
+    process_message.handler(client.payloads[0], Context())
+    assert received == [("u1", "How do I reset SRVO-062?", history, "r1")]
+    assert "history" not in mongodb_tools.get_request("u1", "r1")
+
+
+def test_failed_invoke_completes_the_request(monkeypatch, requests):
+    monkeypatch.setattr(process_message, "get_client", lambda name: FakeLambda(RuntimeError("Request must be smaller than 262144 bytes")))
+    event = {"httpMethod": "POST", "body": json.dumps({"user_id": "u1", "request_id": "r1", "request": "q"})}
+
+    assert process_message.handler(event, Context())["statusCode"] == 500
+    messages, _, completed = process_message.search_inflight_request("u1", "r1")
+    assert completed
+    assert messages[-1]["message"] == "Apologies, the AI agent could not start processing your request."
+
+
+def poll(since=None):
+    query = {"user_id": "u1", "request_id": "r1"}
+    if since is not None:
+        query["since"] = since
+    return process_message.handler({"httpMethod": "GET", "queryStringParameters": query}, Context())
+
+
+def test_poll_returns_only_the_updates_after_since(monkeypatch, requests):
+    now = [1760000000.0]
+    monkeypatch.setattr(mongodb_tools.time, "time", lambda: now[0])
+    mongodb_tools.save_request_input("u1", "r1", "How do I reset SRVO-062?", [{"sender": "user", "content": "hi"}])
+    for message in ("Request received", "Searching all documents", "Found 5 excerpts"):
+        process_message.update_inflight_request("u1", "r1", message)
+        now[0] += 0.25
+
+    body = json.loads(poll()["body"])
+    assert [m["message"] for m in body["messages"]] == ["Request received", "Searching all documents", "Found 5 excerpts"]
+    assert not body["completed"]
+
+    body = json.loads(poll(str(body["messages"][0]["time_stamp"]))["body"])
+    assert [m["message"] for m in body["messages"]] == ["Searching all documents", "Found 5 excerpts"]
+    # Neither the request nor its history is read back by the poller
+    assert set(mongodb_tools.get_request("u1", "r1", 1760000000.0)) == {"completed", "updates"}
+
+    assert json.loads(poll(str(now[0]))["body"])["messages"] == []
+
+
+def test_invalid_since_is_a_bad_request(requests):
+    for since in ("abc", "nan", "inf", "-inf"):
+        response = poll(since)
+        assert response["statusCode"] == 400
+        assert json.loads(response["body"]) == {"error": "'since' must be the time_stamp of an update"}
+    assert process_message.parse_since("1760000000.5") == 1760000000.5
+    assert process_message.parse_since(None) is None
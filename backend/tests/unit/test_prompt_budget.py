@@ -0,0 +1,41 @@
+from prompt_budget import budget_sections, fit_history, fit_sources, fit_lines, estimate_tokens
+from retrieval_session import format_source
+
+
+def conversation(turns, length=60):
+    return [{"sender": "user" if i % 2 == 0 else "bot", "content": f"message {i} " + "x" * length} for i in range(turns)]
+
+
+def test_old_turns_are_summarized():
+    history = fit_history(conversation(10, length=400), 10000)
+    lines = history.splitlines()
+    assert lines[0] == "Earlier in the conversation (summarized):"
+    assert lines[1].startswith("- user: message 0") and lines[1].endswith("…")
+    assert lines[-1].startswith("bot: message 9") and len(lines[-1]) > 400
+
+
+def test_history_drops_oldest_turns_first():
+    history = fit_history(conversation(10), 80)
+    assert estimate_tokens(history) <= 80
+    assert "message 9" in history and "message 0" not in history
+
+
+def test_sources_keep_whole_blocks_latest_first():
+    context = "".join(format_source({"file_name": "r30ib.pdf", "page": str(i), "text": "y" * 300}) for i in range(5))
+    fitted = fit_sources(context, 400)
+    assert fitted.count("<SOURCE") == fitted.count("</SOURCE>") == 2
+    assert 'page="0"' in fitted and 'page="2"' not in fitted
+
+
+def test_catalog_keeps_the_most_relevant_lines():
+    catalog = "\n".join(f"doc_name:'manual {i}'" for i in range(100))
+    assert fit_lines(catalog, 30).splitlines() == ["doc_name:'manual 0'", "doc_name:'manual 1'", "doc_name:'manual 2'", "doc_name:'manual 3'"]
+
+
+def test_sections_fit_the_budget_in_priority_order():
+    catalog = "\n".join(f"doc_name:'manual {i}'" for i in range(500))
+    context = "".join(format_source({"file_name": "r30ib.pdf", "page": str(i), "text": "y" * 3000}) for i in range(10))
+    history, docs, sources, usage = budget_sections(1500, "How do I reset SRVO-062?", conversation(40, 3000), catalog, context, budget=6000)
+    assert usage["total"] <= 6000
+    assert usage["sources"] > usage["catalog"] > 0
+    assert set(usage) == {"template", "query", "history", "catalog", "sources", "total"}
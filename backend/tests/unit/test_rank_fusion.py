@@ -0,0 +1,27 @@
+from rank_fusion import reciprocal_rank_fusion
+
+
+def test_results_found_by_both_searches_rank_first():
+    vector = [{"_id": "a", "score": 0.9}, {"_id": "b", "score": 0.8}, {"_id": "c", "score": 0.7}]
+    text = [{"_id": "c", "score": 12.0}, {"_id": "d", "score": 9.0}]
+    fused = reciprocal_rank_fusion([vector, text])
+    assert [result["_id"] for result in fused] == ["c", "a", "b", "d"]
+    assert fused[0]["score"] == 1 / 63 + 1 / 61
+
+
+def test_weights_favour_one_list():
+    vector = [{"_id": "a"}, {"_id": "b"}]
+    text = [{"_id": "b"}, {"_id": "a"}]
+    assert reciprocal_rank_fusion([vector, text], [1.0, 2.0])[0]["_id"] == "b"
+    assert reciprocal_rank_fusion([vector, text], [2.0, 1.0])[0]["_id"] == "a"
+
+
+def test_object_ids_and_their_strings_are_the_same_result():
+    from bson import ObjectId
+    chunk_id = ObjectId()
+    # $search results next to the local vector index, used when $vectorSearch fails
+    vector = [{"_id": str(chunk_id), "text": "SRVO-062"}, {"_id": "65f0c0ffee0000000000000b"}]
+    text = [{"_id": chunk_id, "text": "SRVO-062"}]
+    fused = reciprocal_rank_fusion([vector, text])
+    assert len(fused) == 2
+    assert fused[0]["_id"] == str(chunk_id) and fused[0]["score"] == 2 / 61
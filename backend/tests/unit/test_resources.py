@@ -0,0 +1,28 @@
+import json
+import resources
+
+
+class FakeSecretsManager:
+    def __init__(self):
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        return {"SecretString": json.dumps({"MONGODB_URI": "mongodb://localhost", "VOYAGE_API_KEY": "key"})}
+
+
+def test_clients_are_created_once():
+    s3 = resources.get_client("s3", "us-west-2")
+    assert resources.get_client("s3", "us-west-2") is s3
+    assert resources.get_client("s3", "us-east-1") is not s3
+
+
+def test_secrets_are_fetched_once(monkeypatch):
+    fake = FakeSecretsManager()
+    monkeypatch.setenv("SECRET_NAME", "mongoagent_secrets")
+    monkeypatch.setenv("AWS_REGION", "us-west-2")
+    monkeypatch.setattr(resources, "_secrets", None)
+    monkeypatch.setitem(resources._boto3_clients, ("secretsmanager", "us-west-2", resources.BOTO3_MAX_POOL_CONNECTIONS), fake)
+    assert resources.get_secrets()["MONGODB_URI"] == "mongodb://localhost"
+    assert resources.get_secrets()["VOYAGE_API_KEY"] == "key"
+    assert fake.calls == 1
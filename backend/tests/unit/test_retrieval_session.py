@@ -0,0 +1,47 @@
+from retrieval_session import RetrievalSession
+
+
+def chunk(_id, text="excerpt"):
+    return {"_id": _id, "file_name": "r30ib.pdf", "page": "1", "text": text}
+
+
+def session_with(results_by_text, **kwargs):
+    calls = {"embed": [], "search": []}
+
+    def embed(texts):
+        calls["embed"].extend(texts)
+        return [[float(len(text))] for text in texts]
+
+    def search(search_embedding, document_list, limit, search_text):
+        calls["search"].append(search_text)
+        return results_by_text[search_text.strip().lower()]
+
+    return RetrievalSession(embed=embed, search=search, estimate_tokens=len, **kwargs), calls
+
+
+def test_repeated_searches_are_memoized():
+    session, calls = session_with({"srvo-062 alarm": [chunk("a"), chunk("b")]})
+    assert session.retrieve("SRVO-062 alarm", ["R-30iB"])[1] == 2
+    assert session.retrieve("  srvo-062   ALARM", ["R-30iB"])[1] == 0
+    assert calls == {"embed": ["SRVO-062 alarm"], "search": ["SRVO-062 alarm"]}
+    # Another document filter searches again, with the same embedding
+    session.retrieve("srvo-062 alarm", [])
+    assert len(calls["embed"]) == 1 and len(calls["search"]) == 2
+
+
+def test_hits_are_merged_latest_first():
+    session, _ = session_with({"first": [chunk("a", "A"), chunk("b", "B")], "second": [chunk("c", "C"), chunk("a", "A")]})
+    session.retrieve("first", [])
+    session.retrieve("second", [])
+    context = session.context()
+    assert context.count("<SOURCE") == 3
+    assert context.index("C") < context.index("A") < context.index("B")
+    assert session.stats()["unique_hits"] == 3
+
+
+def test_context_drops_oldest_hits_over_budget():
+    session, _ = session_with({"first": [chunk("a", "old")], "second": [chunk("b", "new")]}, token_budget=300)
+    session.retrieve("first", [])
+    session.retrieve("second", [])
+    context = session.context()
+    assert "new" in context and "old" not in context
@@ -0,0 +1,80 @@
+from s3_presigned import PresignedUrlCache, replace_sources_with_links
+
+
+class FakeSigner:
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = set(failing)
+
+    def __call__(self, doc, expiration):
+        self.calls.append(doc)
+        if doc in self.failing:
+            return None
+        return f"https://bucket.s3.amazonaws.com/{doc}?sig={len(self.calls)}"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+ANSWER = (
+    'Check the cable <SOURCE doc_file_name="r30ib.pdf" page="12">SRVO-062</SOURCE>, then reset '
+    '<SOURCE doc_file_name=\'r30ib.pdf\' page=40>BZAL alarm</SOURCE> and see '
+    '<SOURCE doc_file_name="safety.pdf" page="3">lockout</SOURCE>.'
+)
+
+
+def test_citations_are_signed_once_per_document():
+    signer = FakeSigner()
+    cache = PresignedUrlCache(sign=signer, clock=FakeClock())
+    text = replace_sources_with_links(ANSWER, cache)
+
+    assert signer.calls == ["r30ib.pdf", "safety.pdf"]
+    assert "SRVO-062 [source 📄](https://bucket.s3.amazonaws.com/r30ib.pdf?sig=1#page=12)" in text
+    assert "BZAL alarm [source 📄](https://bucket.s3.amazonaws.com/r30ib.pdf?sig=1#page=40)" in text
+    assert "lockout [source 📄](https://bucket.s3.amazonaws.com/safety.pdf?sig=2#page=3)" in text
+
+    replace_sources_with_links(ANSWER, cache)
+    assert signer.calls == ["r30ib.pdf", "safety.pdf"]
+    assert cache.stats() == {"entries": 2, "hits": 2, "signed": 2}
+
+
+def test_urls_are_signed_again_before_they_expire():
+    signer = FakeSigner()
+    clock = FakeClock()
+    cache = PresignedUrlCache(sign=signer, expiration=3600, min_validity=1800, clock=clock)
+    first = cache.get_many(["r30ib.pdf"])["r30ib.pdf"]
+
+    clock.now += 1800
+    assert cache.get_many(["r30ib.pdf"])["r30ib.pdf"] == first
+    clock.now += 1
+    assert cache.get_many(["r30ib.pdf"])["r30ib.pdf"] != first
+    assert len(signer.calls) == 2
+
+
+def test_cache_is_bounded():
+    signer = FakeSigner()
+    cache = PresignedUrlCache(sign=signer, max_entries=2, clock=FakeClock())
+    cache.get_many(["a.pdf", "b.pdf"])
+    cache.get_many(["a.pdf", "c.pdf"])
+    cache.get_many(["a.pdf", "b.pdf"])
+    assert signer.calls == ["a.pdf", "b.pdf", "c.pdf", "b.pdf"]
+    assert cache.stats()["entries"] == 2
+
+
+def test_failed_signing_falls_back_to_text_and_is_retried_later():
+    signer = FakeSigner(failing={"safety.pdf"})
+    clock = FakeClock()
+    cache = PresignedUrlCache(sign=signer, clock=clock)
+    text = replace_sources_with_links(ANSWER, cache)
+    assert "see lockout." in text
+
+    replace_sources_with_links(ANSWER, cache)
+    assert signer.calls.count("safety.pdf") == 1
+    clock.now += 61
+    replace_sources_with_links(ANSWER, cache)
+    assert signer.calls.count("safety.pdf") == 2
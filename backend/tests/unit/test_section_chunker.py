@@ -0,0 +1,54 @@
+from section_grouping import SectionGrouper
+from section_chunker import SectionChunker
+
+
+def words(count):
+    return " ".join(f"word{i}" for i in range(count))
+
+
+def chunker():
+    # One token per word, so sizes are easy to follow
+    return SectionChunker(target_tokens=10, max_tokens=15, min_tokens=4, overlap_tokens=3,
+                          count_tokens=lambda text: len(text.split()))
+
+
+def test_oversized_section_is_split_at_sentences_with_overlap_and_pages():
+    grouper = SectionGrouper(track_pages=True)
+    grouper.add_page(4, "<H1>Maintenance</H1><H2>Battery</H2><BODY>Remove the cover. Disconnect the cable from CN1. Check the fuse.</BODY>")
+    grouper.add_page(5, "<BODY>Replace the battery. Turn the power on. Reset the alarm and verify the position.</BODY>")
+    section = grouper.finish()[0]
+    assert section["page_offsets"] == [[0, 4], [section["text"].index("Replace"), 5]]
+
+    chunks = chunker().add(section)
+    assert [(chunk["page"], chunk["text"]) for chunk in chunks] == [
+        ("4", "Remove the cover. Disconnect the cable from CN1."),
+        ("4", "cable from CN1. Check the fuse.\nReplace the battery."),
+        ("5", "Replace the battery. Turn the power on."),
+        ("5", "the power on. Reset the alarm and verify the position.")
+    ]
+    assert all(chunk["H2"] == "Battery" for chunk in chunks)
+
+
+def test_long_sentence_is_cut_between_words():
+    chunks = chunker().add({"H1": "Table", "H2": "", "H3": "", "page": "1", "text": words(25)})
+    assert [len(chunk["text"].split()) for chunk in chunks] == [9, 12, 10]
+    assert chunks[1]["text"].startswith("word6 word7 word8 word9")
+
+
+def test_small_sections_are_merged_under_the_same_h1_and_h2():
+    sections = [
+        {"H1": "Alarms", "H2": "SRVO", "H3": "", "page": "1", "text": "SRVO-062 BZAL alarm"},
+        {"H1": "Alarms", "H2": "SRVO", "H3": "Remedy", "page": "2", "text": "Replace the battery"},
+        {"H1": "Alarms", "H2": "SRVO", "H3": "Cause", "page": "2", "text": words(8)},
+        {"H1": "Alarms", "H2": "MOTN", "H3": "", "page": "3", "text": "MOTN-017"}
+    ]
+    section_chunker = chunker()
+    chunks = [chunk for section in sections for chunk in section_chunker.add(section)] + section_chunker.finish()
+
+    assert [(chunk["H2"], chunk["H3"], chunk["page"], chunk["text"]) for chunk in chunks] == [
+        ("SRVO", "", "1", "SRVO-062 BZAL alarm\nRemedy\nReplace the battery"),
+        ("SRVO", "Cause", "2", words(8)),
+        ("MOTN", "", "3", "MOTN-017")
+    ]
+    assert section_chunker.stats() == {"chunks": 3, "min": 1, "p50": 7, "p90": 8, "max": 8, "mean": 5,
+                                       "split_sections": 0, "merged_sections": 1}
@@ -0,0 +1,63 @@
+import json
+from structured_output import (
+    ACTION_TOOL, STRUCTURE_PAGE_TOOL, StructuredOutputMetrics, validate, parse_tool_output,
+    invoke_structured, elements_to_tags
+)
+from answer_stream import AnswerStream, partial_json_string
+from tag_parser import iter_document_events
+
+
+def test_validate_reports_the_first_schema_error():
+    schema = ACTION_TOOL["input_schema"]
+    assert validate({"improved_user_query": "q", "action": "RESPOND", "answer": "a"}, schema) is None
+    assert "missing required field 'action'" in validate({"improved_user_query": "q"}, schema)
+    assert "is not one of" in validate({"improved_user_query": "q", "action": "SEARCH"}, schema)
+    assert "$.docs[1]: expected string" in validate({"improved_user_query": "q", "action": "QUERY_DOCS", "docs": ["a", 2]}, schema)
+
+
+def test_parse_tool_output_accepts_fenced_json():
+    data, error = parse_tool_output('```json\n{"elements": [{"type": "H1", "text": "Alarms"}]}\n```', STRUCTURE_PAGE_TOOL["input_schema"])
+    assert error is None
+    assert data["elements"][0]["text"] == "Alarms"
+    assert parse_tool_output("<H1>Alarms</H1>", STRUCTURE_PAGE_TOOL["input_schema"]) == (None, "no JSON object in the output")
+
+
+def test_invalid_output_is_repaired_once():
+    metrics = StructuredOutputMetrics()
+    prompts = []
+    outputs = iter(['{"elements": [{"type": "H4", "text": "x"}]}', '{"elements": [{"type": "H3", "text": "x"}]}'])
+
+    def invoke(prompt):
+        prompts.append(prompt)
+        return next(outputs)
+
+    data, _ = invoke_structured("structure this", STRUCTURE_PAGE_TOOL, invoke, metrics=metrics)
+    assert data == {"elements": [{"type": "H3", "text": "x"}]}
+    assert "'H4' is not one of" in prompts[1]
+    assert metrics.stats()["structure_page"]["repaired"] == 1
+
+
+def test_output_still_invalid_after_repair_is_an_error():
+    metrics = StructuredOutputMetrics()
+    data, response = invoke_structured("p", STRUCTURE_PAGE_TOOL, lambda prompt: "{}", metrics=metrics)
+    assert data is None
+    assert response.startswith("ERROR: Invalid structure_page output")
+    assert metrics.stats()["structure_page"] == {"valid": 0, "repaired": 0, "failed": 1, "errors": 0, "parse_failure_rate": 1.0}
+
+
+def test_elements_convert_to_the_tags_read_by_the_parser():
+    text = elements_to_tags({"elements": [{"type": "H1", "text": "Alarms"}, {"type": "BODY", "text": "SRVO-062 BZAL"}]})
+    assert list(iter_document_events([text])) == [("PAGE", "1"), ("H1", "Alarms"), ("BODY", "SRVO-062 BZAL")]
+
+
+def test_answer_streams_from_the_tool_input_json():
+    tool_input = json.dumps({"improved_user_query": "q", "action": "RESPOND", "answer": "Replace the \"BT\" battery\nnow"})
+    assert partial_json_string(tool_input[:-10], "answer") == 'Replace the "BT" batt'
+    assert partial_json_string('{"answer": "a\\', "answer") == "a"
+
+    published = []
+    stream = AnswerStream(published.append, json_field="answer")
+    for i in range(0, len(tool_input), 7):
+        stream.feed(tool_input[i:i + 7])
+    stream.flush()
+    assert published[-1] == 'Replace the "BT" battery\nnow'
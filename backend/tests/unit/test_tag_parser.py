@@ -0,0 +1,63 @@
+import random
+from tag_parser import extract_first_xml_element, iter_tag_events, iter_document_events
+
+
+def extract_all(text):
+    """The loop over extract_first_xml_element used before the tokenizer."""
+    events = []
+    while text:
+        inner_text, tag, text = extract_first_xml_element(text)
+        if tag:
+            events.append((tag, inner_text))
+    return events
+
+
+CASES = {
+    "valid": "<H1>Alarms</H1>\n<H2>SRVO</H2><BODY>SRVO-062 BZAL alarm</BODY>",
+    "text outside tags": "Here is the page:\n<BODY>Check the fuse</BODY> done.",
+    "nested": "<BODY>Torque <B>12 N·m</B> dry</BODY><BODY>next</BODY>",
+    "same tag nested": "<BODY>a <BODY>b</BODY> c</BODY><H2>x</H2>",
+    "multiline": "<BODY>line 1\nline 2\n</BODY>",
+    "unclosed": "<H1>Alarms</H1><BODY>SRVO-062 BZAL alarm<H2>MOTN</H2><BODY>MOTN-017</BODY>",
+    "unclosed at the end": "<H1>Alarms</H1><BODY>cut",
+    "no closing bracket": "<H1>Alarms</H1><BODY",
+    "invalid tag name": "<H1>Alarms</H1><H 2>SRVO</H 2><BODY>kept?</BODY>",
+    "comparison in text": "<BODY>Voltage < 3.0 V</BODY><BODY>replace</BODY>",
+    "stray bracket outside": "x < y <BODY>lost</BODY>",
+    "empty tag": "<>text</><BODY>b</BODY>",
+    "empty": ""
+}
+
+
+def test_events_match_the_previous_parser():
+    for name, text in CASES.items():
+        assert list(iter_tag_events(text)) == extract_all(text), name
+
+
+def test_nested_unclosed_and_invalid_tags():
+    assert list(iter_tag_events(CASES["nested"])) == [("BODY", "Torque <B>12 N·m</B> dry"), ("BODY", "next")]
+    # The first closing tag ends the element, the one left over is not a valid tag and stops the scan
+    assert list(iter_tag_events(CASES["same tag nested"])) == [("BODY", "a <BODY>b")]
+    # An unclosed BODY ends at the next </BODY>, a missing one or an invalid tag stops the scan
+    assert list(iter_tag_events(CASES["unclosed"])) == [("H1", "Alarms"), ("BODY", "SRVO-062 BZAL alarm<H2>MOTN</H2><BODY>MOTN-017")]
+    assert list(iter_tag_events(CASES["unclosed at the end"])) == [("H1", "Alarms")]
+    assert list(iter_tag_events(CASES["invalid tag name"])) == [("H1", "Alarms")]
+    assert list(iter_tag_events(CASES["comparison in text"])) == [("BODY", "Voltage < 3.0 V"), ("BODY", "replace")]
+    assert list(iter_tag_events(CASES["stray bracket outside"])) == []
+
+
+def test_events_match_the_previous_parser_on_random_responses():
+    rng = random.Random(4)
+    pieces = ["<H1>", "</H1>", "<H2>", "</H2>", "<BODY>", "</BODY>", "<H 3>", "<", ">", "</", "text ", "\n", "a<b", "N·m "]
+    for _ in range(2000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+        assert list(iter_tag_events(text)) == extract_all(text), text
+
+
+def test_an_invalid_tag_only_ends_its_own_page():
+    responses = ["<H1>Alarms</H1><BODY>cut", "<BODY>SRVO-062</BODY>"]
+    assert list(iter_document_events(responses)) == [("PAGE", "1"), ("H1", "Alarms"), ("PAGE", "2"), ("BODY", "SRVO-062")]
+
+    valid = [CASES["valid"], CASES["nested"]]
+    concatenated = "".join(f"\n<PAGE>{i + 1}</PAGE>\n{response}" for i, response in enumerate(valid))
+    assert list(iter_document_events(valid)) == extract_all(concatenated)
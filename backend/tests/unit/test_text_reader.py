@@ -0,0 +1,52 @@
+import random
+from text_reader import iter_text_pages
+
+
+def split_whole_text(data, page_char_limit):
+    """The previous in-memory splitter of handle_text_file, the reference for the page boundaries."""
+    text = data.decode("utf-8").strip()
+    pages = []
+    position = 0
+    while position < len(text):
+        end = min(position + page_char_limit, len(text))
+        if end < len(text) and text[end].isalnum():
+            last_space = text.rfind(" ", position, end)
+            if last_space > position:
+                end = last_space
+        pages.append(text[position:end].strip())
+        position = end + 1
+    return pages
+
+
+def byte_chunks(data, sizes):
+    position = 0
+    while position < len(data):
+        size = next(sizes)
+        yield data[position:position + size]
+        position += size
+
+
+def random_text(rng, length):
+    words = ["SRVO-062", "alarm", "encoder", "Überprüfung", "温度", "—", "ok.", "\n", "  ", "\t", "x" * 40, "🔧"]
+    return "".join(rng.choice(words) + rng.choice([" ", "", "\n"]) for _ in range(length))
+
+
+def test_pages_match_the_whole_text_splitter():
+    rng = random.Random(3)
+    for case in range(200):
+        text = rng.choice(["", "  \n", " \t "]) + random_text(rng, rng.randint(0, 400)) + rng.choice(["", "\n\n  ", " "])
+        data = text.encode("utf-8")
+        limit = rng.choice([7, 20, 64, 1800])
+        sizes = iter(lambda: rng.randint(1, 50), None)
+        assert list(iter_text_pages(byte_chunks(data, sizes), limit)) == split_whole_text(data, limit), case
+
+
+def test_multibyte_characters_split_across_chunks():
+    data = ("温度 " * 10).encode("utf-8")
+    pages = list(iter_text_pages((data[i:i + 1] for i in range(len(data))), 6))
+    assert pages == split_whole_text(data, 6)
+    assert "".join(pages).count("温度") == 10
+
+
+def test_whitespace_only_input_has_no_pages():
+    assert list(iter_text_pages([b"  \n", b"\t ", b""], 10)) == []
@@ -0,0 +1,72 @@
+import os
+import json
+import time
+import threading
+import pytest
+import textract_reader
+from textract_reader import iter_textract_pages
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fixtures", "textract_pages.json")
+
+
+def recorded_results():
+    with open(FIXTURE) as f:
+        responses = json.load(f)
+    tokens = [None] + [response.get("NextToken") for response in responses[:-1]]
+    return dict(zip(tokens, responses))
+
+
+def test_pages_match_the_blocks_of_every_result_page():
+    results = recorded_results()
+    pages = list(iter_textract_pages(results.__getitem__))
+    assert pages == [
+        (1, "R-30iB Controller Maintenance Manual\n1 SAFETY PRECAUTIONS"),
+        (2, "2 BATTERY REPLACEMENT\nBack up the pulse coder data before replacing the battery."),
+        (4, "3 ALARM CODES\nSRVO-062 BZAL alarm")
+    ]
+
+
+def test_page_is_yielded_before_the_last_result_page_is_fetched():
+    results = recorded_results()
+    release_last = threading.Event()
+
+    def get_results(next_token):
+        if next_token == "token-2":
+            assert release_last.wait(5)
+        return results[next_token]
+
+    pages = iter_textract_pages(get_results, lookahead=1)
+    assert next(pages)[0] == 1
+    assert next(pages)[0] == 2
+    release_last.set()
+    assert [page for page, _ in pages] == [4]
+
+
+def test_fetch_errors_are_raised_to_the_consumer():
+    results = recorded_results()
+
+    def get_results(next_token):
+        if next_token == "token-1":
+            raise Exception("ThrottlingException")
+        return results[next_token]
+
+    with pytest.raises(Exception, match="ThrottlingException"):
+        list(iter_textract_pages(get_results))
+
+
+def fetchers_alive():
+    return [thread for thread in threading.enumerate() if thread.name == "textract-fetcher"]
+
+
+def test_fetcher_ends_when_the_consumer_stops_early(monkeypatch):
+    monkeypatch.setattr(textract_reader, "STOP_CHECK_SECONDS", 0.01)
+    results = recorded_results()
+    pages = iter_textract_pages(results.__getitem__, lookahead=1)
+    assert next(pages)[0] == 1
+    # The fetcher is blocked on the full queue until the generator is closed (e.g. the pipeline aborted)
+    pages.close()
+    deadline = time.time() + 2
+    while fetchers_alive() and time.time() < deadline:
+        time.sleep(0.01)
+    assert not fetchers_alive()
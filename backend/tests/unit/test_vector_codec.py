@@ -0,0 +1,29 @@
+import bson
+from vector_codec import encode_vector, decode_vector, storage_of, pack_bits
+
+
+VECTOR = [0.5, -0.25, 0.125, -1.0, 0.0, 0.75, -0.5, 0.25, 1.0, -0.125]
+
+
+def test_float32_round_trip_is_exact_for_representable_values():
+    encoded = encode_vector(VECTOR, "float32")
+    assert storage_of(encoded) == "float32"
+    assert decode_vector(encoded) == VECTOR
+
+
+def test_int8_keeps_direction():
+    decoded = decode_vector(encode_vector(VECTOR, "int8"))
+    assert decoded[3] == -127 and decoded[8] == 127
+    assert [x > 0 for x in decoded] == [x > 0 for x in VECTOR]
+
+
+def test_packed_bit_stores_signs_first_dimension_first():
+    packed, padding = pack_bits(VECTOR)
+    assert packed == [0b10100101, 0b10000000] and padding == 6
+    assert decode_vector(encode_vector(VECTOR, "packed_bit")) == [1.0 if x > 0 else -1.0 for x in VECTOR]
+
+
+def test_binary_formats_are_smaller_than_arrays():
+    sizes = {storage: len(bson.encode({"vector": encode_vector(VECTOR * 100, storage)})) for storage in ("array", "float32", "int8", "packed_bit")}
+    assert sizes["array"] > sizes["float32"] > sizes["int8"] > sizes["packed_bit"]
+    assert storage_of(encode_vector(VECTOR, "array")) == "array"
@@ -10,8 +10,19 @@ interface Message {
   timestamp: Date;
   documentReferences?: DocumentReference[];
   isLoading?: boolean;
+  isStreaming?: boolean;
 }
 
+const MESSAGE_API_URL =
+  "https://o43zaz9tv7.execute-api.us-west-2.amazonaws.com/prod/user/message";
+
+// How often the partial answer of the running request is polled
+const POLL_INTERVAL_MS = 1000;
+// How long to wait for the response of a request
+const POLL_TIMEOUT_MS = 15 * 60 * 1000;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
 interface DocumentReference {
   id: string;
   name: string;
@@ -100,69 +111,105 @@ const ChatContainer = ({
     setMessages((prev) => [...prev, loadingMessage]);
     setIsLoading(true);
   
-    try {
-      const response = await fetch(
-        "https://o43zaz9tv7.execute-api.us-west-2.amazonaws.com/prod/user/message",
-        {
-          method: "POST",
-          headers: {
-            Authorization: `Bearer ${idToken}`,
-            "Content-Type": "application/json",
-          },
-          body: JSON.stringify({
-            user_id: "userId",
-            request: content,
-            history: messages.map((msg) => ({
-              sender: msg.sender,
-              content: msg.content,
-              timestamp: msg.timestamp,
-            })),
-          }),
-        }
-      );
-    
-      console.log("HTTP Status:", response.status, response.statusText);
-    
-      const text = await response.text();
-      console.log("Raw Response Body:", text);
-    
-      let responseJson;
-      try {
-        responseJson = JSON.parse(text);
-      } catch (e) {
-        console.error("Failed to parse JSON:", e);
-        responseJson = {};
-      }
-    
-      const botResponse =
-        responseJson.response !== undefined && responseJson.response !== null
-          ? responseJson.response
-          : "No response from bot";
-    
-      console.log("Parsed bot response:", botResponse);
-    
+    // The request id is ours, so the request can be polled as soon as it is posted
+    const requestId = crypto.randomUUID();
+    const requestUserId = "userId";
+
+    const showPartialAnswer = (partial: string) => {
       setMessages((prev) =>
         prev
-          .filter((msg) => !msg.isLoading)
+          .filter((msg) => !msg.isLoading && !msg.isStreaming)
           .concat({
-            id: `bot-${Date.now()}`,
-            content: botResponse,
+            id: `stream-${requestId}`,
+            content: partial,
             sender: "bot",
             timestamp: new Date(),
+            isStreaming: true,
           })
       );
-    } catch (err) {
-      console.error("Error calling API:", err);
+    };
+
+    const showFinalAnswer = (content: string) => {
       setMessages((prev) =>
         prev
-          .filter((msg) => !msg.isLoading)
+          .filter((msg) => !msg.isLoading && !msg.isStreaming)
           .concat({
             id: `bot-${Date.now()}`,
-            content: "Apologies, error trying to contact the AI agent API.",
+            content,
             sender: "bot",
             timestamp: new Date(),
           })
       );
+    };
+
+    // Polls GET /user/message until the request completes, returns its response
+    const pollRequest = async (deadline: number): Promise<string | null> => {
+      let since: number | null = null;
+      let progress = "";
+      let shown = "";
+      while (Date.now() < deadline) {
+        await sleep(POLL_INTERVAL_MS);
+        try {
+          // Only the updates after the last one already read
+          const sinceParam = since !== null ? `&since=${since}` : "";
+          const pollResponse = await fetch(
+            `${MESSAGE_API_URL}?user_id=${encodeURIComponent(requestUserId)}&request_id=${requestId}${sinceParam}`,
+            { headers: { Authorization: `Bearer ${idToken}` } }
+          );
+          if (!pollResponse.ok) continue;
+          const update = await pollResponse.json();
+          const updates: { message: string; time_stamp: number }[] = update.messages ?? [];
+          if (updates.length) {
+            since = updates[updates.length - 1].time_stamp;
+            progress = `_${updates[updates.length - 1].message}…_`;
+          }
+          if (update.completed && updates.length) {
+            return updates[updates.length - 1].message;
+          }
+          // The answer while it streams, otherwise the latest progress
+          const partial = update.partial_answer || progress;
+          if (partial && partial !== shown) {
+            shown = partial;
+            showPartialAnswer(shown);
+          }
+        } catch (e) {
+          console.warn("Polling failed:", e);
+        }
+      }
+      return null;
+    };
+
+    try {
+      const response = await fetch(MESSAGE_API_URL, {
+        method: "POST",
+        headers: {
+          Authorization: `Bearer ${idToken}`,
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({
+          user_id: requestUserId,
+          request_id: requestId,
+          request: content,
+          history: messages.map((msg) => ({
+            sender: msg.sender,
+            content: msg.content,
+            timestamp: msg.timestamp,
+          })),
+        }),
+      });
+    
+      console.log("HTTP Status:", response.status, response.statusText);
+      if (!response.ok) {
+        throw new Error(`POST failed: ${response.status} ${await response.text()}`);
+      }
+
+      // The agent runs asynchronously, its progress and response are polled
+      const botResponse = await pollRequest(Date.now() + POLL_TIMEOUT_MS);
+      console.log("Bot response:", botResponse);
+      showFinalAnswer(botResponse ?? "No response from bot");
+    } catch (err) {
+      console.error("Error calling API:", err);
+      showFinalAnswer("Apologies, error trying to contact the AI agent API.");
     } finally {
       setIsLoading(false);
     }